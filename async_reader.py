@@ -0,0 +1,259 @@
+import asyncio
+import pixels
+import validation
+from reader import Chunk, Picture, STRICT, SKIP, INTEGRITY_POLICIES, get_checksum_times, verify_chunk
+from deflate import backends
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class AsyncReader:
+    """
+    Reads a PNG from an asyncio.StreamReader or an async iterator of bytes, chunk by chunk as the data arrives.
+    The header is available as soon as IHDR has been read, so oversized or invalid images can be rejected early.
+    Inflating and unfiltering run in an executor and never block the event loop.
+    """
+    def __init__(self, source, name=None, integrity=STRICT, executor=None, stats=None, inflate=backends.AUTO,
+                 limits=validation.DEFAULT_LIMITS):
+        """
+        :param source: asyncio.StreamReader, or any object with readexactly(), or an async iterable of bytes
+        :param integrity: STRICT, CRITICAL_ONLY or SKIP, see reader.INTEGRITY_POLICIES
+        :param executor: concurrent.futures executor for the CPU work (default: the loop's default executor)
+        :param stats: deflate.Stats object, see Reader
+        :param inflate: inflate backend, see reader.Picture
+        :param limits: validation.Limits checked as every chunk header arrives, see Reader
+        """
+        if hasattr(source, 'readexactly'):
+            self.stream, self.iterator = source, None
+        elif hasattr(source, '__aiter__'):
+            self.stream, self.iterator = None, source.__aiter__()
+        else:
+            raise TypeError('Expected a StreamReader or an async iterable')
+        if integrity not in INTEGRITY_POLICIES:
+            raise LookupError('Unknown integrity policy')
+        self.name = name
+        self.executor = executor
+        self.picture = None
+        self.integrity = integrity
+        self.stats = stats
+        self.inflate = inflate
+        self.checksum_times = get_checksum_times(stats)
+        self.validator = validation.ChunkValidator(limits)
+        self._buffer = bytearray()
+        self._finished = False
+
+    async def read_exactly(self, n):
+        if self.stream is not None:
+            try:
+                return await self.stream.readexactly(n)
+            except asyncio.IncompleteReadError:
+                raise IOError('Unexpected end of stream')
+
+        while len(self._buffer) < n:
+            try:
+                piece = await self.iterator.__anext__()
+            except StopAsyncIteration:
+                raise IOError('Unexpected end of stream')
+            self._buffer += piece
+        data = bytes(self._buffer[:n])
+        del self._buffer[:n]
+        return data
+
+    async def read_chunk(self):
+        header = await self.read_exactly(8)
+        length, name = int.from_bytes(header[:4], 'big'), header[4:]
+        self.validator.check_chunk(name, length)  # before waiting for or allocating the data
+        data = await self.read_exactly(length)
+        crc = await self.read_exactly(4)
+        chunk = Chunk(name, length, data, crc)
+        verify_chunk(chunk, self.integrity, self.checksum_times)
+        if name == b'IHDR':
+            self.validator.check_header(data)
+        return chunk
+
+    async def read_header(self):
+        """
+        Reads only the signature and IHDR.
+        :return: Picture with the IHDR metadata
+        """
+        if self.picture is None:
+            if await self.read_exactly(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+                raise TypeError('File seems to be corrupted')
+            header = await self.read_chunk()
+            if header.name != b'IHDR':
+                raise TypeError('File seems to be corrupted')
+            self.picture = Picture(self.name, [header], self.integrity, self.checksum_times, self.stats,
+                                   self.inflate)
+        return self.picture
+
+    async def iter_chunks(self):
+        """
+        :return: async generator of the chunks following IHDR, up to and including IEND
+        """
+        await self.read_header()
+        while not self._finished:
+            chunk = await self.read_chunk()
+            self._finished = chunk.name == b'IEND'
+            yield chunk
+
+    async def get_picture(self):
+        """
+        Reads the rest of the stream.
+        :return: Picture with all of its chunks
+        """
+        header = await self.read_header()
+        chunks = [header.chunks[0]]
+        async for chunk in self.iter_chunks():
+            chunks.append(chunk)
+        return Picture(self.name, chunks, self.integrity, self.checksum_times, self.stats, self.inflate)
+
+    async def decode_pixels(self, backend=pixels.AUTO):
+        """
+        Reads the rest of the stream and decodes it in the executor.
+        :return: pixels.PixelBuffer, see Picture.decode_pixels
+        """
+        picture = await self.get_picture()
+        return await self.run(picture.decode_pixels, backend)
+
+    async def iter_rows(self):
+        """
+        Decodes scanlines while the IDAT chunks arrive, every chunk is inflated and unfiltered in the executor.
+        Interlaced images are deinterlaced once all of their data has arrived. Inflating stops with ValueError as soon
+        as the output exceeds the size implied by IHDR.
+        :return: async generator of unfiltered scanlines, see pixels.PixelBuffer for their layout
+        """
+        picture = await self.read_header()
+        channels, stride, bpp = picture.get_scanline_layout()
+        backend = backends.get_backend(picture.inflate, stats=self.stats)
+        decompressor = backend.decompressobj(picture.integrity != SKIP, self.checksum_times, self.stats)
+        remaining = picture.get_image_data_size()
+        if picture.interlace_method == 1:
+            inflated = []
+            async for chunk in self.iter_chunks():
+                if chunk.name == b'IDAT':
+                    inflated.append(await self.run(self.__feed, decompressor, chunk.data, remaining))
+                    remaining -= len(inflated[-1])
+            self.__check_end(decompressor)
+            image = await self.run(pixels.deinterlace, inflated, picture.width, picture.height, channels,
+                                   picture.bit_depth)
+            for y in range(image.height):
+                yield bytes(image.row(y))
+            return
+
+        assembler = pixels.RowAssembler(picture.height, stride, bpp)
+        async for chunk in self.iter_chunks():
+            if chunk.name == b'IDAT':
+                inflated = await self.run(self.__feed, decompressor, chunk.data, remaining)
+                remaining -= len(inflated)
+                for row in await self.run(assembler.feed, inflated):
+                    yield row
+        self.__check_end(decompressor)
+        if assembler.y < picture.height:
+            raise ValueError('Not enough image data')
+
+    async def run(self, function, *arguments):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *arguments)
+
+    @staticmethod
+    def __feed(decompressor, data, remaining):
+        # At most one byte past the expected size is inflated, the rest of a decompression bomb stays compressed
+        output = decompressor.feed(data, remaining + 1)
+        if len(output) > remaining:
+            raise ValueError('Inflated data exceeds the expected size')
+        return output
+
+    @staticmethod
+    def __check_end(decompressor):
+        if not decompressor.eof:
+            raise IOError('Truncated zlib stream')
+
+
+async def _iter_file(path, piece_size=4096):
+    with open(path, 'rb') as file:
+        piece = file.read(piece_size)
+        while piece:
+            yield piece
+            await asyncio.sleep(0)
+            piece = file.read(piece_size)
+
+
+async def _demo(path):
+    reader = AsyncReader(_iter_file(path), path)
+    print(await reader.read_header())
+    rows = 0
+    async for _ in reader.iter_rows():
+        rows += 1
+    print(rows, 'rows', reader.checksum_times)
+
+
+def main():
+    asyncio.run(_demo('pics/mario.png'))
+
+
+def test():
+    import os
+    import zlib
+    import struct
+    import random
+    import tempfile
+    from reader import Reader
+    generator = random.Random(0)
+
+    def chunk(name, data):
+        return struct.pack('>I', len(data)) + name + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(name)))
+
+    async def iter_pieces(data, sizes):
+        position = 0
+        for size in sizes:
+            if position >= len(data):
+                return
+            yield data[position:position + size]
+            position += size
+            await asyncio.sleep(0)
+        yield data[position:]
+
+    async def read(data, sizes):
+        reader = AsyncReader(iter_pieces(data, sizes))
+        header = await reader.read_header()
+        return header, [row async for row in reader.iter_rows()]
+
+    width, height = 21, 17
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.png')
+        for bit_depth, color_type, interlace in ((8, 2, 0), (16, 6, 0), (2, 0, 0), (8, 2, 1), (1, 0, 1)):
+            channels = pixels.CHANNELS[color_type]
+            stride = pixels.row_stride(width, channels, bit_depth)
+            # Bytes below 5 are valid filter types as well as sample data
+            size = pixels.image_data_size(width, height, channels, bit_depth, interlace)
+            raw = bytes(generator.randrange(5) for _ in range(size))
+            stream = zlib.compress(raw)
+            header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, interlace)
+            data = PNG_SIGNATURE + chunk(b'IHDR', header) + chunk(b'tEXt', b'Comment\0async') + \
+                b''.join(chunk(b'IDAT', stream[start:start + 100]) for start in range(0, len(stream), 100)) + \
+                chunk(b'IEND', b'')
+            with open(path, 'wb') as file:
+                file.write(data)
+            reader = Reader().open(path)
+            try:
+                expected = list(reader.iter_rows())
+            finally:
+                reader.close()
+            assert len(expected) == height and all(len(row) == stride for row in expected)
+            for sizes in ([1] * 50, [3, 7, 13, 29] * 40, [len(data)]):
+                picture, rows = asyncio.run(read(data, sizes))
+                assert (picture.width, picture.height, picture.bit_depth, picture.color_type,
+                        picture.interlace_method) == (width, height, bit_depth, color_type, interlace)
+                assert rows == expected
+
+            corrupted = bytearray(data)
+            corrupted[-20] ^= 1  # in the last IDAT chunk
+            try:
+                asyncio.run(read(bytes(corrupted), [5]))
+            except (TypeError, ValueError):
+                pass
+            else:
+                raise AssertionError('Corrupted stream accepted')
+
+
+if __name__ == '__main__':
+    main()
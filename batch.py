@@ -0,0 +1,110 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from reader import Reader
+
+HEADER = 'header'
+PIXELS = 'pixels'
+
+TASKS_PER_WORKER = 4  # files queued per worker process, keeps the pool busy without submitting the whole batch
+DECODE_ERRORS = (ReferenceError, TypeError, LookupError, ValueError, IOError)
+
+
+class DecodeResult:
+    """
+    Outcome of decoding one file. Workers send back plain tuples, this object is built in the parent process.
+    """
+    def __init__(self, path, header, data, error):
+        self.path = path
+        self.width, self.height, self.bit_depth, self.color_type, self.interlace_method = header or (None,) * 5
+        self.data = data  # unfiltered rows, see pixels.PixelBuffer (pixels mode only)
+        self.error = error
+
+    def __str__(self):
+        if self.error:
+            return '{}: {}'.format(self.path, self.error)
+        return '{}: {}x{}, Bit depth: {}, Color type: {}, Interlace: {}'.format(self.path, self.width, self.height,
+                                                                               self.bit_depth, self.color_type,
+                                                                               self.interlace_method)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def decode_file(path, mode=HEADER):
+    """
+    Decodes a single file, capturing the errors raised by Reader and Picture.
+    :return: tuple of path, header fields, pixel data and error message
+    """
+    try:
+        reader = Reader().open(path)
+        try:
+            picture = reader.probe(()) if mode == HEADER else reader.get_picture()
+            data = bytes(picture.decode_pixels().data) if mode == PIXELS else None
+        finally:
+            reader.close()
+    except DECODE_ERRORS as error:
+        return path, None, None, '{}: {}'.format(type(error).__name__, error)
+    header = picture.width, picture.height, picture.bit_depth, picture.color_type, picture.interlace_method
+    return path, header, data, None
+
+
+def decode_many(paths, workers=None, mode=HEADER):
+    """
+    Decodes files in a process pool. A failing file yields a result with an error instead of stopping the batch.
+    :param paths: iterable of file paths
+    :param workers: number of processes (default: number of CPUs); 1 decodes in the calling process
+    :param mode: 'header' (IHDR only, see Reader.probe) or 'pixels'
+    :return: generator of DecodeResult in completion order
+    """
+    if mode not in (HEADER, PIXELS):
+        raise LookupError('Unknown mode')
+    if workers == 1:
+        for path in paths:
+            yield DecodeResult(*decode_file(path, mode))
+        return
+
+    paths = iter(paths)
+    queue_size = (workers or os.cpu_count() or 1) * TASKS_PER_WORKER
+    with ProcessPoolExecutor(workers) as executor:
+        pending = set()
+        while True:
+            for path in paths:
+                pending.add(executor.submit(decode_file, path, mode))
+                if len(pending) >= queue_size:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield DecodeResult(*future.result())
+
+
+def collect_paths(names):
+    for name in names:
+        if os.path.isdir(name):
+            for root, _, files in os.walk(name):
+                for file in sorted(files):
+                    if file.lower().endswith('.png'):
+                        yield os.path.join(root, file)
+        else:
+            yield name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode PNG files in parallel')
+    parser.add_argument('paths', nargs='+', help='files or directories')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('-m', '--mode', choices=(HEADER, PIXELS), default=HEADER)
+    arguments = parser.parse_args()
+
+    failed = 0
+    for result in decode_many(collect_paths(arguments.paths), arguments.workers, arguments.mode):
+        print(result)
+        failed += result.error is not None
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Differential run of the inflate backends on the synthetic corpus: every file is inflated by the pure Python and the
+zlib backends, at once and streamed, and their output compared byte for byte. The throughput of both is reported,
+so that the gap the zlib fast path closes stays visible.
+
+    python -m benchmarks.bench_backends [--corpus directory] [--sizes tiny small ...]
+
+Exits with status 1 when the backends disagree on any file.
+"""
+import os
+import sys
+import argparse
+import tempfile
+from reader import Reader
+from deflate import backends, zlib_stream
+from benchmarks import corpus
+from benchmarks.corpus import timed
+
+MEGABYTE = 2 ** 20
+
+
+def check_file(path):
+    """
+    :return: size of the inflated data, seconds taken by the pure and the zlib backends
+    """
+    picture = corpus.read_picture(path, Reader(inflate=backends.PURE))
+    stream = bytes(picture.get_image_data())
+    differential = backends.get_backend(backends.DIFFERENTIAL)
+    output, pure_time = timed(backends.get_backend(backends.PURE).decompress, stream)
+    _, zlib_time = timed(backends.get_backend(backends.ZLIB).decompress, stream)
+    differential.decompress(stream)
+    pieces = (chunk.data for chunk in picture.get_chunks(b'IDAT'))
+    for _ in zlib_stream.iter_decompress(pieces, decompressor=differential.decompressobj()):
+        pass
+    return len(output), pure_time, zlib_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the pure Python and zlib inflate backends')
+    parser.add_argument('--corpus', help='directory generated by benchmarks.corpus')
+    parser.add_argument('--sizes', nargs='+', default=corpus.DEFAULT_SIZES, choices=sorted(corpus.SIZES))
+    arguments = parser.parse_args()
+    if backends.ZLIB not in backends.BACKENDS:
+        print('The zlib module is not available', file=sys.stderr)
+        return 1
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = arguments.corpus or temporary
+        manifest = corpus.load_or_generate_manifest(directory, arguments.sizes)
+        for entry in manifest:
+            try:
+                size, pure_time, zlib_time = check_file(os.path.join(directory, entry['file']))
+            except (ValueError, IOError) as error:
+                print('{:32} MISMATCH {}'.format(entry['file'], error))
+                failed += 1
+                continue
+            print('{:32} pure {:8.2f} MB/s  zlib {:9.1f} MB/s  gap {:6.1f}x'.format(
+                entry['file'], size / MEGABYTE / pure_time, size / MEGABYTE / zlib_time, pure_time / zlib_time))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Inflater throughput on multi-megabyte PNGs: the IDAT stream of every file is inflated by the pure Python Deflate
+with its lookup table decoder, by the same Deflate walking the code tree one bit at a time as it did before the
+tables, and by zlib. The output of all three must be identical.
+
+    python -m benchmarks.bench_inflate [--corpus directory] [--sizes medium large ...] [--no-tree-walk] [file ...]
+
+Without files, the representative images of the given corpus sizes are used (generated in a temporary directory
+when no corpus is given). Exits with status 1 when an output differs.
+"""
+import os
+import sys
+import zlib
+import argparse
+import tempfile
+from reader import Reader
+from deflate import code_tree, deflate
+from deflate.bit_input_stream import BitInputStream
+from benchmarks import corpus
+from benchmarks.corpus import timed
+
+MEGABYTE = 2 ** 20
+DEFAULT_SIZES = ('medium',)
+
+
+class TreeWalkDeflate(deflate.Deflate):
+    """
+    Deflate decoding every symbol as it did before the lookup tables, reading one bit at a time down the Leaf and
+    InternalNode objects of the code tree.
+    """
+    def _Deflate__decode_literal(self, tree):
+        node = tree.root
+        input_stream = self.input
+        while not isinstance(node, code_tree.Leaf):
+            node = node.right_child if input_stream.read() else node.left_child
+        return node.symbol
+
+
+def inflate(stream, decoder_type=deflate.Deflate):
+    input_stream = BitInputStream(memoryview(stream)[2:])  # past the zlib header
+    return decoder_type().decompress(input_stream)
+
+
+def check_file(path, tree_walk=True):
+    """
+    :return: size of the inflated data, seconds taken by the lookup tables, the tree walk (None when skipped) and zlib
+    """
+    reader = Reader().open(path)
+    try:
+        stream = bytes(reader.get_picture().get_image_data())
+    finally:
+        reader.close()
+    expected, zlib_time = timed(zlib.decompress, stream)
+    output, table_time = timed(inflate, stream)
+    if bytes(output) != expected:
+        raise ValueError('The lookup tables differ from zlib')
+    walk_time = None
+    if tree_walk:
+        output, walk_time = timed(inflate, stream, TreeWalkDeflate)
+        if bytes(output) != expected:
+            raise ValueError('The tree walk differs from zlib')
+    return len(expected), table_time, walk_time, zlib_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Huffman lookup tables of the pure Python inflater')
+    parser.add_argument('files', nargs='*', help='PNG files to inflate instead of the corpus')
+    parser.add_argument('--corpus', help='directory generated by benchmarks.corpus')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, choices=sorted(corpus.SIZES))
+    parser.add_argument('--no-tree-walk', action='store_true', help='skip the slow bit by bit baseline')
+    arguments = parser.parse_args()
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as temporary:
+        paths = arguments.files
+        if not paths:
+            directory = arguments.corpus or temporary
+            manifest = corpus.load_or_generate_manifest(directory, arguments.sizes)
+            paths = [os.path.join(directory, entry['file']) for entry in manifest]
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                size, table_time, walk_time, zlib_time = check_file(path, not arguments.no_tree_walk)
+            except (ValueError, IOError) as error:
+                print('{:32} MISMATCH {}'.format(name, error))
+                failed += 1
+                continue
+            columns = ['{:32} {:6.1f} MB  tables {:6.2f} MB/s'.format(name, size / MEGABYTE,
+                                                                       size / MEGABYTE / table_time)]
+            if walk_time is not None:
+                columns.append('tree walk {:6.2f} MB/s  speedup {:5.1f}x'.format(size / MEGABYTE / walk_time,
+                                                                                 walk_time / table_time))
+            columns.append('zlib {:8.1f} MB/s'.format(size / MEGABYTE / zlib_time))
+            print('  '.join(columns))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Scaling of deflate.parallel.inflate with the number of worker processes.
+
+    python -m benchmarks.bench_parallel [megabytes]
+
+Inflates a synthetic stream compressed by zlib, once as a single stream and once with a full flush every 256 KiB
+of input, and checks that every run reproduces the input.
+"""
+import os
+import sys
+import time
+import zlib
+import random
+from deflate import parallel
+
+WORKER_COUNTS = (1, 2, 4, 8)
+FLUSH_INTERVAL = 2 ** 18
+
+
+def synthetic_data(size):
+    generator = random.Random(0)
+    words = [bytes(generator.choice(b'abcdefgh ') for _ in range(generator.randint(1, 9))) for _ in range(500)]
+    data = bytearray()
+    while len(data) < size:
+        data += b' '.join(generator.choices(words, k=1000))
+    return bytes(data[:size])
+
+
+def compress(data, flush_interval=None):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    step = flush_interval or len(data)
+    result = b''
+    for start in range(0, len(data), step):
+        result += compressor.compress(data[start:start + step])
+        if flush_interval:
+            result += compressor.flush(zlib.Z_FULL_FLUSH)
+    return result + compressor.flush()
+
+
+def main():
+    size = int(float(sys.argv[1]) * 2 ** 20) if len(sys.argv) > 1 else 2 ** 22
+    data = synthetic_data(size)
+    print('{} CPUs, {:.1f} MB of output'.format(os.cpu_count(), size / 2 ** 20))
+    for name, flush_interval in (('single stream', None), ('full flushes', FLUSH_INTERVAL)):
+        stream = compress(data, flush_interval)
+        for workers in WORKER_COUNTS:
+            start = time.perf_counter()
+            output, _ = parallel.inflate(stream, workers, segment_size=len(stream) // workers)
+            elapsed = time.perf_counter() - start
+            if output != data:
+                raise ValueError('Output differs from the input')
+            print('{:14} {} workers: {:6.2f} s, {:6.2f} MB/s'.format(name, workers, elapsed, size / elapsed / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Files per second for Reader.probe against Reader.get_picture.
+
+    python -m benchmarks.bench_probe [directory]
+
+Without a directory, a handful of large synthetic PNGs is generated in a temporary one.
+"""
+import os
+import sys
+import time
+import struct
+import zlib
+import tempfile
+from reader import Reader
+from benchmarks import corpus
+
+SYNTHETIC_FILES = 8
+SYNTHETIC_SIZE = 2000  # width and height of the synthetic images
+
+
+def write_png(path, width, height, text=b'Comment\0synthetic'):
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(corpus.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        file.write(corpus.chunk(b'tEXt', text))
+        data = b''.join(b'\0' + os.urandom(width * 3) for _ in range(height))
+        file.write(corpus.chunk(b'IDAT', zlib.compress(data, 0)))  # stored, so the files stay large
+        file.write(corpus.chunk(b'IEND', b''))
+
+
+def measure(paths, decode):
+    start = time.perf_counter()
+    for path in paths:
+        reader = Reader().open(path)
+        try:
+            decode(reader)
+        finally:
+            reader.close()
+    return len(paths) / (time.perf_counter() - start)
+
+
+def run(directory):
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.png')]
+    size = sum(os.path.getsize(path) for path in paths)
+    print('{} files, {:.1f} MB'.format(len(paths), size / 2 ** 20))
+    print('probe:       {:10.1f} files/s'.format(measure(paths, lambda reader: reader.probe())))
+    print('get_picture: {:10.1f} files/s'.format(measure(paths, lambda reader: reader.get_picture())))
+
+
+def main():
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(SYNTHETIC_FILES):
+            write_png(os.path.join(directory, '{}.png'.format(i)), SYNTHETIC_SIZE, SYNTHETIC_SIZE)
+        run(directory)
+
+
+if __name__ == '__main__':
+    main()
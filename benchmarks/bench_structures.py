@@ -0,0 +1,113 @@
+"""
+Memory per chunk object and Huffman tree build time.
+
+    python -m benchmarks.bench_structures [directory]
+
+Chunk memory is the size of the Picture, ExtendedChunk and flag objects built over chunks already read, the chunk
+payloads are shared and not counted. Table build time is taken from the Stats of the inflater, per distinct dynamic
+code found in the image data, and includes decoding its code lengths. Tree build time is that of the array-backed
+tree of the fixed codes. Without a directory, a set of small synthetic icons is generated in a temporary one.
+"""
+import os
+import sys
+import time
+import struct
+import zlib
+import random
+import tempfile
+import tracemalloc
+from reader import Reader, Picture
+from deflate import Stats, code_tree, deflate, zlib_stream
+from benchmarks import corpus
+
+SYNTHETIC_FILES = 64
+SYNTHETIC_SIZE = 48  # width and height of the synthetic icons
+TEXT_CHUNKS = 16  # tEXt chunks per synthetic file, to have more than a handful of chunks per picture
+REPEAT = 20
+
+
+def write_png(path, width, height, seed):
+    generator = random.Random(seed)
+    colors = [bytes(generator.getrandbits(8) for _ in range(3)) for _ in range(generator.randrange(2, 40))]
+    rows = []
+    for _ in range(height):
+        rows.append(b'\0' + b''.join(generator.choice(colors[:generator.randrange(1, len(colors))])
+                                     for _ in range(width)))
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(corpus.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        for number in range(TEXT_CHUNKS):
+            file.write(corpus.chunk(b'tEXt', 'Key{}\0value {}'.format(number, seed).encode()))
+        file.write(corpus.chunk(b'IDAT', zlib.compress(b''.join(rows), 9)))
+        file.write(corpus.chunk(b'IEND', b''))
+
+
+def read_chunks(paths):
+    result = []
+    for path in paths:
+        reader = Reader().open(path)
+        try:
+            reader.read_signature()
+            reader.read_all_chunks()
+        finally:
+            reader.close()
+        result.append((reader.name, reader.chunks))
+    return result
+
+
+def measure_chunk_memory(files):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pictures = [Picture(name, chunks) for name, chunks in files]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size / sum(len(picture.chunks) for picture in pictures)
+
+
+def measure_table_build(files):
+    """
+    Inflates the image data of every file, the Stats of the inflater time the dynamic codes it builds.
+    :return: number of codes built and seconds per code, including the decoding of the code lengths
+    """
+    stats = Stats()
+    for name, chunks in files:
+        zlib_stream.decompress(b''.join(chunk.data for chunk in chunks if chunk.name == b'IDAT'), stats=stats)
+    builds = stats.counts.get('table_builds', 0)
+    return builds, stats.times.get('table_build', 0.0) / builds if builds else None
+
+
+def measure_tree_build():
+    """
+    :return: seconds per array-backed tree of the fixed literal/length and distance codes
+    """
+    lengths = [deflate.FIXED_LITERAL_LENGTH_TABLE.code_lengths, deflate.FIXED_DISTANCE_TABLE.code_lengths]
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for code_lengths in lengths:
+            code_tree.CodeTree(code_lengths).children
+    return (time.perf_counter() - start) / (REPEAT * len(lengths))
+
+
+def run(directory):
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.png')]
+    files = read_chunks(paths)
+    builds, table_time = measure_table_build(files)
+    print('{} files, {} chunks, {} dynamic codes'.format(len(files), sum(len(chunks) for _, chunks in files), builds))
+    print('memory per chunk: {:8.1f} bytes'.format(measure_chunk_memory(files)))
+    if table_time is not None:
+        print('table build:      {:8.1f} us'.format(table_time * 1e6))
+    print('tree build:       {:8.1f} us'.format(measure_tree_build() * 1e6))
+
+
+def main():
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(SYNTHETIC_FILES):
+            write_png(os.path.join(directory, '{}.png'.format(i)), SYNTHETIC_SIZE, SYNTHETIC_SIZE, i)
+        run(directory)
+
+
+if __name__ == '__main__':
+    main()
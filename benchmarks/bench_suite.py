@@ -0,0 +1,125 @@
+"""
+Throughput and peak memory of the reader, the inflater, code tree construction and unfiltering on the synthetic
+corpus, with stdlib zlib as the baseline. Results are written as JSON to track regressions.
+
+    python -m benchmarks.bench_suite [--corpus directory] [--sizes tiny small ...] [--output results.json]
+
+Without --corpus the corpus is generated in a temporary directory. Every file is measured in a fresh process,
+so the reported peak RSS and the code trees built belong to that file alone. Code tree construction is timed by
+the Stats of the inflater, decoding the code lengths included.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import platform
+import subprocess
+import tempfile
+import pixels
+from deflate import Deflate, Stats
+from benchmarks import corpus
+from benchmarks.corpus import timed
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+MEGABYTE = 2 ** 20
+MEGAPIXEL = 10 ** 6
+
+
+def rate(amount, seconds, unit):
+    return round(amount / unit / seconds, 3) if seconds > 0 else None
+
+
+def measure_file(path, entry):
+    """
+    :param entry: manifest entry of the file, see corpus.generate
+    :return: dictionary of the results
+    """
+    file_size = os.path.getsize(path)
+    picture, read_time = timed(corpus.read_picture, path)
+    stream = b''.join(chunk.data for chunk in picture.get_chunks(b'IDAT'))
+
+    # The process starts with an empty code cache, so every distinct dynamic code is built during this first pass
+    stats = Stats()
+    Deflate(stats=stats).decompress(stream[2:])
+    table_builds = stats.counts.get('table_builds', 0)
+    raw, inflate_time = timed(Deflate().decompress, stream[2:])
+    baseline, zlib_time = timed(zlib.decompress, stream)
+    if bytes(raw) != baseline:
+        raise ValueError('Inflated data differs from zlib')
+
+    channels, stride, bpp = picture.get_scanline_layout()
+    if picture.interlace_method:
+        _, unfilter_time = timed(pixels.deinterlace, [raw], picture.width, picture.height, channels,
+                                 picture.bit_depth)
+    else:
+        _, unfilter_time = timed(pixels.unfilter, raw, picture.height, stride, bpp, pixels.PYTHON)
+
+    result = dict(entry)
+    result.update({
+        'file_bytes': file_size,
+        'get_picture_mb_s': rate(file_size, read_time, MEGABYTE),
+        'inflate_mb_s': rate(len(baseline), inflate_time, MEGABYTE),
+        'zlib_mb_s': rate(len(baseline), zlib_time, MEGABYTE),
+        'times_slower_than_zlib': round(inflate_time / zlib_time, 1) if zlib_time > 0 else None,
+        'dynamic_codes': table_builds,
+        'code_tree_us': round(stats.times['table_build'] / table_builds * 1e6, 1) if table_builds else None,
+        'unfilter_mp_s': rate(picture.width * picture.height, unfilter_time, MEGAPIXEL),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+    })
+    return result
+
+
+def run(directory, manifest):
+    results = []
+    for entry in manifest:
+        path = os.path.join(directory, entry['file'])
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite', '--measure', path,
+                                 json.dumps(entry)], check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output)
+        print('{file:32} inflate {inflate_mb_s:8.2f} MB/s  zlib {zlib_mb_s:9.1f} MB/s  '
+              'unfilter {unfilter_mp_s:7.3f} MP/s  peak {peak_rss_kb} KB'.format(**result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the reader and the inflater')
+    parser.add_argument('--corpus', help='directory generated by benchmarks.corpus')
+    parser.add_argument('--sizes', nargs='+', default=corpus.DEFAULT_SIZES, choices=sorted(corpus.SIZES))
+    parser.add_argument('--output', help='JSON file (default: standard output)')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)  # path and manifest entry, in the child
+    arguments = parser.parse_args()
+
+    if arguments.measure:
+        path, entry = arguments.measure
+        print(json.dumps(measure_file(path, json.loads(entry))))
+        return 0
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = arguments.corpus or temporary
+        manifest = corpus.load_or_generate_manifest(directory, arguments.sizes)
+        report = {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': run(directory, manifest),
+        }
+
+    text = json.dumps(report, indent=1)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Encoding speed and size of every writer preset on the synthetic corpus, with single-threaded zlib.compress of the
+filtered rows as the baseline. Every encoded file goes back through the reader and must give the same pixels.
+
+    python -m benchmarks.bench_writer [--corpus directory] [--sizes tiny small ...] [--workers n]
+
+Exits with status 1 when a round trip differs.
+"""
+import os
+import sys
+import zlib
+import argparse
+import tempfile
+import pixels
+import writer
+from benchmarks import corpus
+from benchmarks.corpus import timed
+
+MEGABYTE = 2 ** 20
+
+
+def check_file(path, workers, scratch):
+    """
+    :return: list of (preset, output bytes, seconds, round trip identical) and the size and seconds of the baseline
+    """
+    picture = corpus.read_picture(path)
+    image = picture.decode_pixels()
+    filtered = pixels.filter_image(image.data, image.height, image.stride, image.bytes_per_pixel)
+    baseline, baseline_time = timed(zlib.compress, filtered, 6)
+    results = []
+    for preset in writer.PRESETS:
+        _, seconds = timed(writer.Writer(preset, workers).write_picture, picture, scratch)
+        copy = corpus.read_picture(scratch)
+        identical = bytes(copy.decode_pixels().data) == bytes(image.data)
+        results.append((preset, os.path.getsize(scratch), seconds, identical))
+    return results, len(baseline), baseline_time, len(image.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the writer presets')
+    parser.add_argument('--corpus', help='directory generated by benchmarks.corpus')
+    parser.add_argument('--sizes', nargs='+', default=corpus.DEFAULT_SIZES, choices=sorted(corpus.SIZES))
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of threads')
+    arguments = parser.parse_args()
+
+    failed = 0
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = arguments.corpus or temporary
+        manifest = corpus.load_or_generate_manifest(directory, arguments.sizes)
+        scratch = os.path.join(temporary, 'encoded.png')
+        for entry in manifest:
+            results, baseline_size, baseline_time, raw_size = check_file(os.path.join(directory, entry['file']),
+                                                                         arguments.workers, scratch)
+            columns = ['{:32} zlib {:9} B {:7.1f} MB/s'.format(entry['file'], baseline_size,
+                                                               raw_size / MEGABYTE / baseline_time)]
+            for preset, size, seconds, identical in results:
+                columns.append('{} {:9} B {:7.1f} MB/s{}'.format(preset, size, raw_size / MEGABYTE / seconds,
+                                                                '' if identical else ' MISMATCH'))
+                failed += not identical
+            print('  '.join(columns))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
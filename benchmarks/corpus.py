@@ -0,0 +1,173 @@
+"""
+Synthetic PNG corpus for the benchmarks: every color type and bit depth, stored, fixed Huffman and dynamic Huffman
+blocks, interlaced and not, from tiny icons to 50 megapixel images.
+
+    python -m benchmarks.corpus directory [size ...]
+
+Files are reproducible: the same size names always give the same bytes. A manifest.json in the directory describes
+every file. Any byte sequence is a valid filtered scanline, so the image data is generated directly in filtered
+form with all five filter types and never has to be filtered or interlaced.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import random
+from reader import Reader
+
+# width and height of every size class
+SIZES = {'tiny': (16, 16), 'small': (256, 256), 'medium': (1024, 1024), 'large': (4000, 3000),
+         'huge': (8660, 5774)}
+FULL_MATRIX_SIZES = ('tiny', 'small')  # sizes generated for every combination, the larger ones for a few
+DEFAULT_SIZES = ('tiny', 'small')
+
+COLOR_TYPES = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+STORED = 'stored'
+FIXED = 'fixed'
+DYNAMIC = 'dynamic'
+BLOCK_TYPES = (STORED, FIXED, DYNAMIC)
+# color type, bit depth, block type and interlace method of the large images
+REPRESENTATIVE = ((2, 8, DYNAMIC, 0), (6, 8, DYNAMIC, 0), (2, 8, STORED, 0), (0, 16, FIXED, 0), (2, 8, DYNAMIC, 1))
+
+ADAM7_PASSES = ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4), (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2))
+QUANTIZE = bytes(value & 0xF0 for value in range(256))  # fewer distinct values, so that the data compresses
+MANIFEST = 'manifest.json'
+
+
+def chunk(name, data):
+    return struct.pack('>I', len(data)) + name + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(name)))
+
+
+def image_sizes(width, height, interlace):
+    """
+    :return: list of (width, height) of the images stored in the stream: the seven passes when interlaced
+    """
+    if not interlace:
+        return [(width, height)]
+    return [((width - x0 + dx - 1) // dx, (height - y0 + dy - 1) // dy) for x0, y0, dx, dy in ADAM7_PASSES]
+
+
+def filtered_data(width, height, channels, bit_depth, interlace, generator):
+    data = bytearray()
+    for pass_width, pass_height in image_sizes(width, height, interlace):
+        if pass_width <= 0 or pass_height <= 0:
+            continue
+        stride = (pass_width * channels * bit_depth + 7) // 8
+        noise = generator.randbytes(stride * ((pass_height + 1) // 2)).translate(QUANTIZE)
+        image = bytearray((stride + 1) * pass_height)
+        for y in range(pass_height):
+            start = y * (stride + 1)
+            image[start] = y % 5  # every filter type
+            line = (y // 2) * stride  # pairs of identical rows give the compressor long matches
+            image[start + 1:start + 1 + stride] = noise[line:line + stride]
+        data += image
+    return data
+
+
+def compress(data, block_type):
+    if block_type == STORED:
+        return zlib.compress(data, 0)
+    strategy = zlib.Z_FIXED if block_type == FIXED else zlib.Z_DEFAULT_STRATEGY
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 15, 9, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def write_png(path, width, height, color_type, bit_depth, block_type, interlace, seed):
+    generator = random.Random(seed)
+    channels = CHANNELS[color_type]
+    data = filtered_data(width, height, channels, bit_depth, interlace, generator)
+    with open(path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, interlace)))
+        if color_type == 3:
+            file.write(chunk(b'PLTE', generator.randbytes(3 << bit_depth)))
+        file.write(chunk(b'IDAT', compress(data, block_type)))
+        file.write(chunk(b'IEND', b''))
+    return len(data)
+
+
+def iter_cases(sizes):
+    """
+    :return: generator of (size name, color type, bit depth, block type, interlace method)
+    """
+    for size in sizes:
+        if size not in SIZES:
+            raise LookupError('Unknown size: {}'.format(size))
+        if size in FULL_MATRIX_SIZES:
+            for color_type, depths in COLOR_TYPES.items():
+                for bit_depth in depths:
+                    for block_type in BLOCK_TYPES:
+                        for interlace in (0, 1):
+                            yield size, color_type, bit_depth, block_type, interlace
+        else:
+            for case in REPRESENTATIVE:
+                yield (size,) + case
+
+
+def generate(directory, sizes=DEFAULT_SIZES):
+    """
+    Writes the corpus and its manifest.
+    :return: list of the manifest entries
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = []
+    for seed, (size, color_type, bit_depth, block_type, interlace) in enumerate(iter_cases(sizes)):
+        width, height = SIZES[size]
+        name = '{}-c{}-d{}-{}{}.png'.format(size, color_type, bit_depth, block_type, '-i' if interlace else '')
+        inflated = write_png(os.path.join(directory, name), width, height, color_type, bit_depth, block_type,
+                             interlace, seed)
+        manifest.append({'file': name, 'size': size, 'width': width, 'height': height, 'color_type': color_type,
+                         'bit_depth': bit_depth, 'blocks': block_type, 'interlace': interlace,
+                         'inflated_bytes': inflated})
+    with open(os.path.join(directory, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=1)
+    return manifest
+
+
+def load_or_generate_manifest(directory, sizes=DEFAULT_SIZES):
+    """
+    :param directory: corpus directory, generated there with the given sizes when it holds no manifest
+    :return: list of the manifest entries of those sizes
+    """
+    manifest_path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return generate(directory, sizes)
+    with open(manifest_path) as file:
+        return [entry for entry in json.load(file) if entry['size'] in sizes]
+
+
+def read_picture(path, reader=None):
+    """
+    :param reader: Reader to open the file with, a default one when None
+    :return: Picture of the file, which is closed again whether or not it could be read
+    """
+    reader = (reader or Reader()).open(path)
+    try:
+        return reader.get_picture()
+    finally:
+        reader.close()
+
+
+def timed(function, *arguments):
+    """
+    :return: result of the call and the seconds it took
+    """
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python -m benchmarks.corpus directory [size ...], sizes: {}'.format(', '.join(SIZES)))
+        return 1
+    manifest = generate(sys.argv[1], sys.argv[2:] or DEFAULT_SIZES)
+    print('{} files written to {}'.format(len(manifest), sys.argv[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
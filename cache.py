@@ -0,0 +1,252 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import pixels
+from reader import Reader
+
+DEFAULT_MAX_BYTES = 2 ** 28  # 256 MiB of decoded image data
+SPILL_SUFFIX = '.scanlines'
+
+PICTURE = 'picture'
+PIXELS = 'pixels'
+
+
+class DecodeCache:
+    """
+    LRU cache of parsed pictures and decoded pixels, bounded by the total number of bytes held. Pixel data is kept
+    as immutable bytes and handed out as read-only memoryviews, a hit copies nothing. With a spill directory, pixel
+    data evicted from memory is written there as raw scanlines and read back on the next hit.
+    Keys are (kind, source key), where the source key is file_key(path) or content_key(picture).
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, spill_directory=None, spill_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+        self.spill_max_bytes = spill_max_bytes
+        self.size = 0
+        self.spill_size = 0
+        self.entries = OrderedDict()  # key -> (value, size), least recently used first
+        self.spilled = OrderedDict()  # key -> (file name, width, height, channels, bit depth, size)
+        self.counters = dict.fromkeys(('hits', 'misses', 'evictions', 'spills', 'spill_hits'), 0)
+        self.lock = threading.Lock()
+        if spill_directory:
+            os.makedirs(spill_directory, exist_ok=True)
+
+    def __str__(self):
+        return 'Entries: {}, Size: {}/{}, Spilled: {}'.format(len(self.entries), self.size, self.max_bytes,
+                                                              len(self.spilled))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_picture(self, path):
+        """
+        Cached Reader.get_picture() for a file.
+        :return: reader.Picture, shared between callers
+        """
+        key = PICTURE, file_key(path)
+        picture = self.get(key)
+        if picture is None:
+            picture = read_picture(path)
+            self.put(key, picture, sum(chunk.length for chunk in picture.chunks))
+        return picture
+
+    def decode_pixels(self, path, backend=pixels.AUTO):
+        """
+        Cached Picture.decode_pixels() for a file. On a miss the file is parsed without caching the picture,
+        only the decoded pixels are kept.
+        :return: pixels.PixelBuffer whose data is a read-only memoryview
+        """
+        key = PIXELS, file_key(path)
+        image = self.get(key)
+        if image is None:
+            image = self.put_pixels(key, read_picture(path).decode_pixels(backend))
+        return image
+
+    def get(self, key):
+        """
+        :return: the cached value, None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[0]
+            if key not in self.spilled:
+                self.counters['misses'] += 1
+                return None
+            self.counters['spill_hits'] += 1
+            image = self.__read_spilled(key)
+        return self.put_pixels(key, image)
+
+    def put(self, key, value, size):
+        """
+        Stores a value, evicting the least recently used entries until the total size fits. A value larger than the
+        whole cache is not stored.
+        :return: value
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self.entries[key] = value, size
+                self.size += size
+            while self.size > self.max_bytes:
+                self.__evict()
+        return value
+
+    def put_pixels(self, key, image):
+        """
+        Stores decoded pixels as immutable bytes.
+        :return: pixels.PixelBuffer over a read-only memoryview of the cached data
+        """
+        data = image.data if isinstance(image.data, bytes) else bytes(image.data)
+        cached = pixels.PixelBuffer(memoryview(data), image.width, image.height, image.channels, image.bit_depth)
+        return self.put(key, cached, len(data))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            while self.spilled:
+                self.__drop_spilled()
+
+    def stats(self):
+        """
+        :return: dictionary of the counters and current sizes, for monitoring
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update(entries=len(self.entries), bytes=self.size, spilled_entries=len(self.spilled),
+                         spilled_bytes=self.spill_size)
+        return stats
+
+    def __evict(self):
+        key, (value, size) = self.entries.popitem(last=False)
+        self.size -= size
+        self.counters['evictions'] += 1
+        if self.spill_directory and key[0] == PIXELS:
+            self.__spill(key, value, size)
+
+    def __spill(self, key, image, size):
+        if self.spill_max_bytes is not None and size > self.spill_max_bytes:
+            return
+        name = os.path.join(self.spill_directory, hashlib.sha1(repr(key).encode()).hexdigest() + SPILL_SUFFIX)
+        with open(name, 'wb') as file:
+            file.write(image.data)
+        if key in self.spilled:
+            self.spill_size -= self.spilled.pop(key)[-1]
+        self.spilled[key] = name, image.width, image.height, image.channels, image.bit_depth, size
+        self.spill_size += size
+        self.counters['spills'] += 1
+        while self.spill_max_bytes is not None and self.spill_size > self.spill_max_bytes:
+            self.__drop_spilled()
+
+    def __read_spilled(self, key):
+        name, width, height, channels, bit_depth, size = self.spilled[key]
+        with open(name, 'rb') as file:
+            data = file.read()
+        self.__drop_spilled(key)
+        return pixels.PixelBuffer(data, width, height, channels, bit_depth)
+
+    def __drop_spilled(self, key=None):
+        if key is None:
+            key = next(iter(self.spilled))
+        name, *_, size = self.spilled.pop(key)
+        self.spill_size -= size
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def read_picture(path):
+    reader = Reader().open(path)
+    try:
+        return reader.get_picture()
+    finally:
+        reader.close()
+
+
+def file_key(path):
+    """
+    :return: key that changes whenever the file is replaced or modified: absolute path, mtime and size
+    """
+    if not os.path.isfile(path):
+        raise ReferenceError('File not found')
+    status = os.stat(path)
+    return os.path.abspath(path), status.st_mtime_ns, status.st_size
+
+
+def content_key(picture):
+    """
+    Key of the image content independent of the file: the IHDR data and the CRCs of the IDAT chunks, which
+    Reader already reads and checks.
+    """
+    header = bytes(picture.get_chunks(b'IHDR')[0].data)
+    return (header,) + tuple(bytes(chunk.crc) for chunk in picture.get_chunks(b'IDAT'))
+
+
+def main():
+    cache = DecodeCache()
+    for _ in range(3):
+        print(cache.decode_pixels('pics/mario.png'))
+    print(cache, cache.stats())
+
+
+def test():
+    import zlib
+    import struct
+    import tempfile
+
+    def image(value, size):
+        return pixels.PixelBuffer(bytes([value]) * size, size, 1, 1, 8)
+
+    cache = DecodeCache(max_bytes=10)
+    cache.put(('a',), 'A', 4)
+    cache.put(('b',), 'B', 4)
+    assert cache.get(('a',)) == 'A' and cache.get(('c',)) is None
+    cache.put(('c',), 'C', 4)  # b is the least recently used
+    assert list(cache.entries) == [('a',), ('c',)] and cache.size == 8
+    cache.put(('d',), 'D', 11)  # larger than the cache, not stored
+    assert cache.get(('d',)) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DecodeCache(max_bytes=10, spill_directory=os.path.join(directory, 'spill'))
+        cache.put_pixels((PIXELS, 'x'), image(1, 6))
+        cache.put_pixels((PIXELS, 'y'), image(2, 6))  # x is spilled to disk
+        assert list(cache.spilled) == [(PIXELS, 'x')] and cache.spill_size == 6
+        promoted = cache.get((PIXELS, 'x'))  # read back into memory, y is spilled in turn
+        assert bytes(promoted.data) == bytes([1]) * 6 and promoted.data.readonly
+        assert list(cache.entries) == [(PIXELS, 'x')] and list(cache.spilled) == [(PIXELS, 'y')]
+        stats = cache.stats()
+        assert (stats['spills'], stats['spill_hits'], stats['evictions']) == (2, 1, 2)
+        assert len(os.listdir(os.path.join(directory, 'spill'))) == 1
+        cache.clear()
+        assert not os.listdir(os.path.join(directory, 'spill'))
+
+        def write_png(path, value):
+            def chunk(name, data):
+                return struct.pack('>I', len(data)) + name + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(name)))
+            with open(path, 'wb') as file:
+                file.write(bytes((137, 80, 78, 71, 13, 10, 26, 10)) +
+                           chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0)) +
+                           chunk(b'IDAT', zlib.compress(bytes((0, value)))) + chunk(b'IEND', b''))
+
+        path = os.path.join(directory, 'test.png')
+        write_png(path, 1)
+        cache = DecodeCache()
+        assert bytes(cache.decode_pixels(path).data) == bytes(cache.decode_pixels(path).data) == b'\1'
+        assert cache.get_picture(path) is cache.get_picture(path)
+        write_png(path, 2)
+        os.utime(path, ns=(0, 0))  # a different mtime even on coarse file systems
+        assert bytes(cache.decode_pixels(path).data) == b'\2'
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (2, 3)
+
+
+if __name__ == '__main__':
+    main()
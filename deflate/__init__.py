@@ -0,0 +1,4 @@
+from .bit_input_stream import BitInputStream
+from .code_tree import CodeTree
+from .deflate import Deflate
+from .stats import Stats
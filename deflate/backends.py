@@ -0,0 +1,232 @@
+from . import zlib_stream
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+PURE = 'pure'
+ZLIB = 'zlib'
+AUTO = 'auto'  # zlib when it can be imported and no stats or workers are asked for, pure otherwise
+DIFFERENTIAL = 'differential'  # both, comparing their output
+
+RAW_WINDOW_BITS = -15  # raw DEFLATE for zlib, used when the checksum is not verified
+
+
+class PureBackend:
+    """
+    The pure Python inflater: portable, instrumented (stats) and able to use several processes (workers).
+    """
+    name = PURE
+
+    def decompress(self, data, verify=True, timings=None, stats=None, workers=None, max_length=None):
+        """
+        :return: bytes-like object with the inflated data, see zlib_stream.decompress
+        """
+        return zlib_stream.decompress(data, workers, verify, timings, stats, max_length)
+
+    def decompressobj(self, verify=True, timings=None, stats=None):
+        """
+        :return: incremental decoder with the zlib_stream.ZlibDecompressor interface
+        """
+        return zlib_stream.ZlibDecompressor(verify, timings, stats)
+
+
+class ZlibBackend:
+    """
+    The C implementation of the stdlib zlib module. The stream is inflated as raw DEFLATE and its Adler-32 checked
+    here, so that the checksum time is recorded as with the pure backend. Stats and workers cannot be honoured.
+    """
+    name = ZLIB
+
+    def decompress(self, data, verify=True, timings=None, stats=None, workers=None, max_length=None):
+        _check_arguments(self.name, stats, workers)
+        zlib_stream.check_header(data[:2])
+        decompressor = zlib.decompressobj(RAW_WINDOW_BITS)
+        limit = 0 if max_length is None else max_length + 1  # 0 is no limit for zlib
+        try:
+            output = decompressor.decompress(memoryview(data)[2:], limit)
+        except zlib.error as error:
+            raise ValueError(str(error))
+        if max_length is not None and len(output) > max_length:
+            raise ValueError('Inflated data exceeds the expected size')
+        trailer = decompressor.unused_data[:4]
+        if not decompressor.eof or len(trailer) < 4:
+            raise IOError('Truncated zlib stream')
+        if verify:
+            zlib_stream.check_adler32(output, int.from_bytes(trailer, 'big'), timings=timings)
+        return output
+
+    def decompressobj(self, verify=True, timings=None, stats=None):
+        _check_arguments(self.name, stats, None)
+        return zlib_stream.ZlibDecompressor(verify, timings, inflater=RawZlibInflater())
+
+
+class RawZlibInflater:
+    """
+    zlib.decompressobj for raw DEFLATE behind the feed interface of Deflate, the zlib header and trailer are left to
+    zlib_stream.ZlibDecompressor.
+    """
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(RAW_WINDOW_BITS)
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    @property
+    def unused_data(self):
+        return self._decompressor.unused_data
+
+    @property
+    def needs_input(self):
+        return not self._decompressor.unconsumed_tail
+
+    def feed(self, data, max_length=-1):
+        """
+        :return: bytes inflated since the previous call, see Deflate.feed
+        """
+        try:
+            return self._decompressor.decompress(self._decompressor.unconsumed_tail + bytes(data), max(max_length, 0))
+        except zlib.error as error:
+            raise ValueError(str(error))
+
+
+class DifferentialBackend:
+    """
+    Runs two backends on the same data and raises ValueError at the first byte where they disagree, to validate
+    the pure Python inflater against zlib.
+    """
+    name = DIFFERENTIAL
+
+    def __init__(self, reference, candidate):
+        self.reference = reference
+        self.candidate = candidate
+
+    def decompress(self, data, verify=True, timings=None, stats=None, workers=None, max_length=None):
+        expected = self.reference.decompress(data, verify, max_length=max_length)
+        output = self.candidate.decompress(data, verify, timings, stats, workers, max_length)
+        compare(expected, output, 0)
+        return output
+
+    def decompressobj(self, verify=True, timings=None, stats=None):
+        return DifferentialDecompressor(self.reference.decompressobj(verify),
+                                        self.candidate.decompressobj(verify, timings, stats))
+
+
+class DifferentialDecompressor:
+    """
+    Feeds two decompressors and compares their output as it is produced; the candidate's output is returned.
+    """
+    def __init__(self, reference, candidate):
+        self.reference = reference
+        self.candidate = candidate
+        self._expected = b''  # reference output not matched by the candidate yet
+        self._output = b''  # and the other way round
+        self._position = 0
+
+    @property
+    def eof(self):
+        return self.candidate.eof
+
+    @property
+    def unused_data(self):
+        return self.candidate.unused_data
+
+    @property
+    def needs_input(self):
+        return self.candidate.needs_input
+
+    def feed(self, data, max_length=-1):
+        self._expected += self.reference.feed(data)
+        while not self.reference.needs_input and not self.reference.eof:
+            self._expected += self.reference.feed(b'')
+        output = self.candidate.feed(data, max_length)
+        self._output += output
+        length = min(len(self._expected), len(self._output))
+        compare(self._expected[:length], self._output[:length], self._position)
+        self._expected, self._output = self._expected[length:], self._output[length:]
+        self._position += length
+        if self.candidate.eof and (self._expected or self._output or not self.reference.eof):
+            raise ValueError('Inflate backends disagree on the length of the output')
+        return output
+
+    def flush(self):
+        return self.feed(b'')
+
+
+def _check_arguments(name, stats, workers):
+    if stats is not None or (workers and workers > 1):
+        raise ValueError('The {} inflate backend records no stats and uses no workers'.format(name))
+
+
+def compare(expected, output, offset):
+    if expected != output:
+        position = next((index for index, (x, y) in enumerate(zip(expected, output)) if x != y),
+                        min(len(expected), len(output)))
+        raise ValueError('Inflate backends disagree at output byte {}'.format(offset + position))
+
+
+BACKENDS = {PURE: PureBackend()}
+if zlib is not None:
+    BACKENDS[ZLIB] = ZlibBackend()
+    BACKENDS[DIFFERENTIAL] = DifferentialBackend(BACKENDS[ZLIB], BACKENDS[PURE])
+
+
+def register(name, backend):
+    """
+    :param backend: object with the decompress and decompressobj methods of PureBackend
+    """
+    BACKENDS[name] = backend
+
+
+def get_backend(name=AUTO, workers=None, stats=None):
+    """
+    :param name: 'pure', 'zlib', 'differential', 'auto' or a registered name
+    :param workers: number of processes the caller asks for, see zlib_stream.decompress
+    :param stats: Stats object the caller passes; 'auto' keeps the pure backend for those and for several workers,
+    which zlib cannot honour
+    :return: the backend
+    """
+    if name == AUTO:
+        native = ZLIB in BACKENDS and stats is None and not (workers and workers > 1)
+        name = ZLIB if native else PURE
+    if name not in BACKENDS:
+        raise LookupError('Unknown or unavailable inflate backend: {}'.format(name))
+    return BACKENDS[name]
+
+
+def test():
+    from .deflate import sample_streams
+
+    class WrongBackend(PureBackend):
+        def decompress(self, data, verify=True, timings=None, stats=None, workers=None, max_length=None):
+            return super().decompress(data, verify, timings, stats, workers, max_length)[:-1]
+
+        def decompressobj(self, verify=True, timings=None, stats=None):
+            return WrongDecompressor(verify, timings, stats)
+
+    class WrongDecompressor(zlib_stream.ZlibDecompressor):
+        def feed(self, data, max_length=-1):
+            return super().feed(data, max_length).replace(b'a', b'b')
+
+    def decompress_pieces(backend, data):
+        pieces = [data[start:start + 1000] for start in range(0, len(data), 1000)]
+        return b''.join(zlib_stream.iter_decompress(pieces, 5000, decompressor=backend.decompressobj()))
+
+    names = [name for name in (PURE, ZLIB, DIFFERENTIAL) if name in BACKENDS]
+    for data, stream in sample_streams():
+        # zlib header of the default compression level, the raw stream and the Adler-32 trailer
+        zlib_data = b'\x78\x9c' + stream + zlib_stream.adler32(data).to_bytes(4, 'big')
+        for name in names:
+            assert BACKENDS[name].decompress(zlib_data) == data
+            assert decompress_pieces(BACKENDS[name], zlib_data) == data
+        if ZLIB in BACKENDS and b'a' in data:
+            wrong = DifferentialBackend(BACKENDS[ZLIB], WrongBackend())
+            for decompress in (wrong.decompress, lambda zlib_data: decompress_pieces(wrong, zlib_data)):
+                try:
+                    decompress(zlib_data)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError('Wrong candidate accepted')
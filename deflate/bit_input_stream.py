@@ -1,35 +1,51 @@
 import io
 
 
+REFILL_BITS = 64  # the bit buffer is topped up to a 64-bit word at once
+IO_BLOCK_SIZE = 2 ** 16  # bytes read at once from file-like inputs
+
+
 class BitInputStream:
     def __init__(self, input_stream):
-        if not isinstance(input_stream, io.IOBase):
+        if isinstance(input_stream, (bytes, bytearray, memoryview)):
+            self._input = None
+            self._data = input_stream
+        elif isinstance(input_stream, io.IOBase):
+            self._input = input_stream
+            self._data = b''
+        else:
             raise TypeError
-        self._input = input_stream
-        self._current_byte = 0
-        self._bits_remaining = 0
+        self._position = 0
+        self._discarded = 0  # bytes dropped from the front of the data by extend()
+        self._bit_buffer = 0
+        self._bit_count = 0
+
+    @classmethod
+    def at(cls, data, bit_position):
+        """
+        :param data: bytes-like object
+        :param bit_position: position of the first bit to read
+        :return: BitInputStream over data, positioned there; tell() counts from the byte holding that bit
+        """
+        input_stream = cls(memoryview(data)[bit_position >> 3:])
+        input_stream.read_bits(bit_position & 7)
+        return input_stream
 
     def get_bit_position(self):
-        return (8 - self._bits_remaining) % 8
+        return -self._bit_count % 8
 
     def read_byte(self):
-        self._current_byte = 0
-        self._bits_remaining = 0
-        read = self._input.read(1)
-        if read:
-            return read[0]
-        raise IOError
+        self.align_to_byte()
+        return self.read_bits(8)
+
+    def align_to_byte(self):
+        """
+        Skips the remaining bits of the current byte, if any.
+        """
+        self.consume(self._bit_count % 8)
 
     def read(self):
-        if self._bits_remaining == 0:
-            new_byte = self._input.read(1)
-            if new_byte:
-                self._current_byte = new_byte[0]
-                self._bits_remaining = 8
-            else:
-                raise IOError
-        self._bits_remaining -= 1
-        return (self._current_byte >> (7 - self._bits_remaining)) & 1
+        return self.read_bits(1)
 
     def read_bits(self, number):
         """
@@ -37,15 +53,121 @@ class BitInputStream:
         :param number: number of bits to read
         :return: int-representation of read data
         """
-        result = 0
-        for i in range(0, number):
-            result |= self.read() << i
+        result = self.peek_bits(number)
+        self.consume(number)
+        return result
+
+    def peek_bits(self, number):
+        """
+        Returns the next bits of the stream without consuming them. Bits past the end of the stream read as zeros.
+        :param number: number of bits to look ahead
+        :return: int-representation of peeked data
+        """
+        while self._bit_count < number:
+            bit_count = self._bit_count
+            self.__refill()
+            if self._bit_count == bit_count:
+                break
+        return self._bit_buffer & ((1 << number) - 1)
+
+    def consume(self, number):
+        """
+        Drops bits previously returned by peek_bits.
+        :param number: number of bits to drop
+        """
+        if number > self._bit_count:
+            raise IOError
+        self._bit_buffer >>= number
+        self._bit_count -= number
+
+    def read_bytes(self, number):
+        """
+        Reads whole bytes starting at the next byte boundary, bypassing the bit buffer where possible.
+        :param number: number of bytes to read
+        :return: bytes read
+        """
+        self.align_to_byte()
+        buffered = min(number, self._bit_count >> 3)
+        result = (self._bit_buffer & ((1 << (buffered << 3)) - 1)).to_bytes(buffered, 'little')
+        self.consume(buffered << 3)
+        remaining = number - buffered
+        if remaining:
+            chunk = bytes(self._data[self._position:self._position + remaining])
+            self._position += len(chunk)
+            if len(chunk) < remaining and self._input is not None:
+                chunk += self._input.read(remaining - len(chunk))
+            if len(chunk) < remaining:
+                raise IOError
+            result += chunk
         return result
 
+    def extend(self, data):
+        """
+        Appends the next piece of input to a stream over bytes, e.g. a chunk that has just been received.
+        :param data: bytes-like object
+        """
+        if self._input is not None:
+            raise TypeError
+        if not data:
+            return
+        self._discarded += self._position
+        if self._position < len(self._data):
+            self._data = bytes(self._data[self._position:]) + bytes(data)
+        else:
+            self._data = data
+        self._position = 0
+
+    def tell(self):
+        """
+        :return: number of bits consumed from a stream over bytes
+        """
+        return ((self._discarded + self._position) << 3) - self._bit_count
+
+    def available_bits(self):
+        """
+        :return: number of bits left in a stream over bytes
+        """
+        return self._bit_count + ((len(self._data) - self._position) << 3)
+
+    def remaining_bytes(self):
+        """
+        :return: whole bytes left in a stream over bytes, without consuming them
+        """
+        buffered = (self._bit_buffer >> (self._bit_count % 8)).to_bytes(self._bit_count >> 3, 'little')
+        return buffered + bytes(self._data[self._position:])
+
+    def mark(self):
+        """
+        :return: current state of the stream, to be passed to reset()
+        """
+        return self._data, self._position, self._discarded, self._bit_buffer, self._bit_count
+
+    def reset(self, mark):
+        """
+        Rewinds the stream to a state returned by mark().
+        """
+        self._data, self._position, self._discarded, self._bit_buffer, self._bit_count = mark
+
     def close(self):
-        self._input.close()
-        self._current_byte = b''
-        self._bits_remaining = 0
+        if self._input:
+            self._input.close()
+        self._data = b''
+        self._position = 0
+        self._bit_buffer = 0
+        self._bit_count = 0
+
+    def __refill(self):
+        count = (REFILL_BITS - self._bit_count) >> 3
+        chunk = self._data[self._position:self._position + count]
+        if len(chunk) < count and self._input is not None:
+            block = self._input.read(IO_BLOCK_SIZE)
+            if block:
+                self._data = bytes(chunk) + block
+                self._position = 0
+                chunk = self._data[:count]
+        self._position += len(chunk)
+        self._bit_buffer |= int.from_bytes(chunk, 'little') << self._bit_count
+        self._bit_count += len(chunk) << 3
 
 
 def main():
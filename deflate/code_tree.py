@@ -1,54 +1,202 @@
+from array import array
+from functools import lru_cache
+
+MAX_CODE_LENGTH = 15  # maximum code length for DEFLATE
+PRIMARY_BITS = 9  # number of bits resolved by the first-level lookup table
+LENGTH_MASK = 0xF
+LEAF = 0x8000  # child references at or above are leaves, LEAF | symbol
+TABLE_CACHE_SIZE = 64  # distinct code length sets kept by get_code_tree
+
+
 class CodeTree:
-    def __init__(self, code_lengths):
-        self.root = None
-        self.__string = ""
-        self.__build_tree(code_lengths)
+    """
+    Canonical Huffman code, decoded through a flat lookup table.
 
-    def __build_tree(self, code_lengths):
+    The table is laid out the zlib way: a primary table indexed by the next PRIMARY_BITS bits of the input
+    (least significant bit first) followed by subtables for the longer codes. A non-negative entry is
+    (symbol << 4) | code_length, a negative entry is -((subtable_offset << 4) | subtable_bits).
+    """
+    __slots__ = ('code_lengths', 'max_length', 'primary_bits', 'primary_mask', 'table', '__children', '__root')
+
+    def __init__(self, code_lengths):
+        self.code_lengths = list(code_lengths)
+        self.max_length = 0
+        self.primary_bits = 0
+        self.primary_mask = 0
+        self.table = None
+        self.__children = None
+        self.__root = None
+        self.__build_table(self.code_lengths)
+
+    @property
+    def children(self):
+        """
+        Array-backed code tree, built on first use (decoding only needs the table): left and right arrays indexed by
+        internal node, holding either the index of the child node or LEAF | symbol. The root is the last node.
+        """
+        if self.__children is None:
+            self.__children = self.__build_tree(self.code_lengths)
+        return self.__children
+
+    @property
+    def root(self):
+        """
+        The code tree as Leaf and InternalNode objects.
+        """
+        if self.__root is None:
+            left, right = self.children
+
+            def node(reference):
+                if reference & LEAF:
+                    return Leaf(reference ^ LEAF)
+                return InternalNode(node(left[reference]), node(right[reference]))
+
+            self.__root = node(len(left) - 1)
+        return self.__root
+
+    def decode_symbol(self, input_stream):
+        """
+        Decodes a single symbol with one peek and one consume of the bit input stream.
+        :param input_stream: BitInputStream positioned at the beginning of a code
+        :return: decoded symbol
+        """
+        bits = input_stream.peek_bits(self.max_length)
+        entry = self.table[bits & self.primary_mask]
+        if entry < 0:
+            link = -entry
+            entry = self.table[(link >> 4) + ((bits >> self.primary_bits) & ((1 << (link & LENGTH_MASK)) - 1))]
+        input_stream.consume(entry & LENGTH_MASK)
+        return entry >> 4
+
+    def __build_table(self, code_lengths):
         # Check basic validity
         if len(code_lengths) < 2:
             raise ValueError
+        length_counts = [0] * (MAX_CODE_LENGTH + 1)
         for code in code_lengths:
-            if code < 0:
+            if code < 0 or code > MAX_CODE_LENGTH:
                 raise ValueError('Illegal code length')
+            length_counts[code] += 1
 
-        # Convert code lengths to code tree
-        nodes = []
-        for i in range(15, -1, -1):  # Descend through code lengths (maximum 15 for DEFLATE)
-            if len(nodes) % 2 != 0:
+        # The code must be complete: neither over-subscribed nor missing any leaves
+        left = 1
+        for length in range(1, MAX_CODE_LENGTH + 1):
+            left = (left << 1) - length_counts[length]
+            if left < 0:
                 raise ValueError('This canonical code does not represent a Huffman code tree')
-            new_nodes = []
-            if i > 0:
-                for j in range(0, len(code_lengths)):
-                    if code_lengths[j] == i:
-                        new_nodes.append(Leaf(j))
+        if left != 0:
+            raise ValueError('This canonical code does not represent a Huffman code tree')
+
+        # Assign canonical codes (RFC 1951, 3.2.2)
+        length_counts[0] = 0
+        next_code = [0] * (MAX_CODE_LENGTH + 1)
+        code = 0
+        for length in range(1, MAX_CODE_LENGTH + 1):
+            code = (code + length_counts[length - 1]) << 1
+            next_code[length] = code
+
+        self.max_length = max(code_lengths)
+        primary_bits = min(PRIMARY_BITS, self.max_length)
+        table_size = 1 << primary_bits
+        table = [0] * table_size
+        long_codes = {}
+
+        for symbol, length in enumerate(code_lengths):
+            if length == 0:
+                continue
+            reversed_code = _reverse_bits(next_code[length], length)
+            next_code[length] += 1
+            if length <= primary_bits:
+                step = 1 << length
+                table[reversed_code::step] = [(symbol << 4) | length] * ((table_size - 1 - reversed_code) // step + 1)
+            else:
+                long_codes.setdefault(reversed_code & (table_size - 1), []).append((symbol, length, reversed_code))
+
+        for prefix in sorted(long_codes):
+            codes = long_codes[prefix]
+            sub_bits = max(length for _, length, _ in codes) - primary_bits
+            sub_size = 1 << sub_bits
+            offset = len(table)
+            table.extend([0] * sub_size)
+            table[prefix] = -((offset << 4) | sub_bits)
+            for symbol, length, reversed_code in codes:
+                index = reversed_code >> primary_bits
+                step = 1 << (length - primary_bits)
+                table[offset + index:offset + sub_size:step] = [(symbol << 4) | length] * ((sub_size - 1 - index) // step + 1)
+
+        self.primary_bits = primary_bits
+        self.primary_mask = table_size - 1
+        self.table = table
 
-            # Merge pairs of nodes from the previous deeper layer
-            for j in range(0, len(nodes), 2):
-                new_nodes.append(InternalNode(nodes[j], nodes[j+1]))
+    def __build_tree(self, code_lengths):
+        # Convert code lengths to code tree, merging the nodes of every layer pairwise into the layer above
+        layers = [[] for _ in range(MAX_CODE_LENGTH + 1)]
+        for symbol, length in enumerate(code_lengths):
+            layers[length].append(LEAF | symbol)
 
-            nodes = new_nodes
+        left, right = array('H'), array('H')
+        nodes = []
+        for i in range(MAX_CODE_LENGTH, -1, -1):  # Descend through code lengths
+            if len(nodes) % 2 != 0:
+                raise ValueError('This canonical code does not represent a Huffman code tree')
+            # Leaves of this length come first, then the parents of the pairs from the previous deeper layer
+            first = len(left)
+            left.extend(nodes[0::2])
+            right.extend(nodes[1::2])
+            nodes = (layers[i] if i > 0 else []) + list(range(first, len(left)))
 
-        if len(nodes) != 1:
+        if len(nodes) != 1 or nodes[0] & LEAF:
             raise ValueError("This canonical code does not represent a Huffman code tree")
-        self.root = nodes[0]
+        return left, right
 
     def __repr__(self):
-        self.__to_string("", self.root)
-        return self.__string
+        left, right = self.children
+        lines = []
+        stack = [('', len(left) - 1)]
+        while stack:
+            prefix, reference = stack.pop()
+            if reference & LEAF:
+                lines.append('Code {}: Symbol {}\n'.format(prefix, reference ^ LEAF))
+            else:
+                stack.append((prefix + '1', right[reference]))
+                stack.append((prefix + '0', left[reference]))
+        return ''.join(lines)
 
     def __str__(self):
         return self.__repr__()
 
-    def __to_string(self, prefix, node):
-        if isinstance(node, InternalNode):
-            self.__to_string(prefix + '0', node.left_child)
-            self.__to_string(prefix + '1', node.right_child)
-        else:
-            self.__string += 'Code {}: Symbol {}\n'.format(prefix, node.symbol)
+
+def get_code_tree(code_lengths):
+    """
+    Memoized CodeTree: encoders often repeat the same dynamic code across blocks and images, a tree is built once
+    per distinct set of code lengths and shared. Trees must not be modified.
+    """
+    return _cached_code_tree(tuple(code_lengths))
+
+
+def get_cache_info():
+    """
+    :return: hits and misses of get_code_tree, see functools.lru_cache
+    """
+    return _cached_code_tree.cache_info()
+
+
+@lru_cache(maxsize=TABLE_CACHE_SIZE)
+def _cached_code_tree(code_lengths):
+    return CodeTree(code_lengths)
+
+
+def _reverse_bits(code, length):
+    result = 0
+    for _ in range(length):
+        result = (result << 1) | (code & 1)
+        code >>= 1
+    return result
 
 
 class Leaf:
+    __slots__ = ('symbol',)
+
     def __init__(self, symbol):
         if symbol < 0:
             raise ValueError
@@ -60,6 +208,8 @@ class Leaf:
 
 
 class InternalNode:
+    __slots__ = ('left_child', 'right_child')
+
     def __init__(self, left, right):
         self.left_child = left
         self.right_child = right
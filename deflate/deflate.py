@@ -1,6 +1,7 @@
 import io
-import code_tree
-from bit_input_stream import BitInputStream
+import time
+from . import code_tree
+from .bit_input_stream import BitInputStream
 
 ONE_BIT = 1
 TWO_BITS = 2
@@ -11,63 +12,227 @@ SEVEN_BITS = 7
 EIGHT_BITS = 8
 SIXTEEN_BITS = 16
 
+WINDOW_SIZE = 2 ** 15
+MAX_SYMBOL_BITS = 48  # longest literal/length code with extra bits followed by the longest distance code
+SYMBOL_BATCH = 1024  # symbols decoded between two checks of the output limit
 
-class Buffer:
-    def __init__(self, size):
-        self.data = [0] * size
-        self.index = 0
+# Fixed Huffman codes (RFC 1951, 3.2.6), shared by all decoders
+FIXED_LITERAL_LENGTH_TABLE = code_tree.CodeTree([8] * 144 + [9] * (256 - 144) + [7] * (280 - 256) + [8] * (288 - 280))
+FIXED_DISTANCE_TABLE = code_tree.CodeTree([5] * 32)
 
-    def append(self, value):
-        self.data[self.index] = value
-        self.index = (self.index + 1) % len(self.data)
+# Decoder states between two calls of feed()
+BLOCK_HEADER = 0
+STORED_BLOCK = 1
+HUFFMAN_BLOCK = 2
+FINISHED = 3
 
-    def copy(self, length, distance, output_stream):
-        read_index = (self.index - distance + len(self.data)) % len(self.data)
-        for _ in range(0, length):
-            byte = self.data[read_index]
-            read_index = (read_index + 1) % len(self.data)
-            output_stream.write(bytes([byte]))
-            self.append(byte)
+BLOCK_COUNTERS = ('stored_blocks', 'fixed_blocks', 'dynamic_blocks')  # Stats counter of every block type
 
 
 class Deflate:
-    def __init__(self):
-        self.fixed_literal_length_table = None
-        self.fixed_distance_table = None
+    def __init__(self, window=None, stats=None):
+        """
+        :param window: output preceding the stream, referenced by its back-references (a preset dictionary);
+        a bytes-like object, or an array when the decoder should produce array items instead of bytes
+        :param stats: Stats object to record timings and counters in, None to measure nothing
+        """
+        self.fixed_literal_length_table = FIXED_LITERAL_LENGTH_TABLE
+        self.fixed_distance_table = FIXED_DISTANCE_TABLE
         self.dynamic_literal_length_table = None
         self.dynamic_distance_table = None
         self.input = None
-        self.output = io.BytesIO()
-        self.buffer = Buffer(2 ** 15)
-        self.__build_static_tables()
-
-    def decompress(self, input_stream):
+        self.output = bytearray() if window is None else window[-WINDOW_SIZE:]
+        if isinstance(self.output, (bytes, memoryview)):
+            self.output = bytearray(self.output)
+        self.needs_input = True
+        self._state = BLOCK_HEADER
+        self._final_block = False
+        self._length_table = None
+        self._distance_table = None
+        self._stored_remaining = 0
+        self._input_complete = False
+        self._output_limit = None
+        self._stop_position = None
+        self._stop_length = None
+        self._returned = len(self.output)
+        self.stats = stats
+        self._matches = 0
+        self._match_bytes = 0
+        if stats is not None:
+            # Instance attributes shadow the plain methods, so the loop has no checks when stats are disabled
+            self.__decode_symbols = self.__measured_decode_symbols
+            self.__copy = self.__measured_copy
+
+    @property
+    def eof(self):
+        """
+        True once the final block has been decoded and all of its output returned.
+        """
+        return self._state == FINISHED and self._returned == len(self.output)
+
+    @property
+    def unused_data(self):
+        """
+        Input that follows the end of the DEFLATE stream, e.g. the zlib checksum.
+        """
+        if self._state != FINISHED:
+            return b''
+        return self.input.remaining_bytes()
+
+    @property
+    def at_block_boundary(self):
+        return self._state in (BLOCK_HEADER, FINISHED)
+
+    def decompress(self, input_stream, stop_position=None, stop_length=None, max_length=None):
+        """
+        Inflates a raw DEFLATE stream. After a stop, calling it again with the same input stream continues.
+        :param input_stream: BitInputStream, bytes-like object or binary file object
+        :param stop_position: stop before the first block that starts at or after this bit position of the input
+        :param stop_length: stop before the first block that starts once the output holds this many bytes
+        :param max_length: raise ValueError as soon as the output grows past this many bytes, window included
+        :return: bytearray with the inflated data, preceded by the window if one was given
+        """
+        if not isinstance(input_stream, BitInputStream):
+            input_stream = BitInputStream(input_stream)
         self.input = input_stream
-        while True:
-            b_final = self.input.read() == 1
-            b_type = self.input.read_bits(2)
-
-            if b_type == 0:
-                self.__decompress_uncompressed_data()
-            elif b_type == 1:
-                self.__decompress_huffman_data(self.fixed_literal_length_table, self.fixed_distance_table)
-            elif b_type == 2:
-                self.__build_dynamic_tables()
-                self.__decompress_huffman_data(self.dynamic_literal_length_table, self.dynamic_distance_table)
-            else:
-                raise RuntimeError('Invalid compression type')
-
-            if b_final:
-                break
-
+        self._input_complete = True
+        self._stop_position = stop_position
+        self._stop_length = stop_length
+        self._output_limit = None if max_length is None else max_length + 1
+        try:
+            self.__inflate()
+        finally:
+            self._stop_position = self._stop_length = self._output_limit = None
+        if max_length is not None and len(self.output) > max_length:
+            raise ValueError('Inflated data exceeds the expected size')
+        self._returned = len(self.output)
         return self.output
 
-    def __build_static_tables(self):
-        code_table = [8] * 144 + [9] * (256 - 144) + [7] * (280 - 256) + [8] * (288 - 280)
-        self.fixed_literal_length_table = code_tree.CodeTree(code_table)
+    def discard_output(self):
+        """
+        Drops the output of decompress except the last 32 KiB, which later back-references may still need.
+        """
+        excess = len(self.output) - WINDOW_SIZE
+        if excess > 0:
+            del self.output[:excess]
+            self._returned = max(self._returned - excess, 0)
+
+    def feed(self, data, max_length=-1):
+        """
+        Inflates as much of the input fed so far as possible, in the manner of zlib.decompressobj.
+        Block, header and Huffman table state is kept between calls and only the last 32 KiB of output are retained.
+        Input fed after the end of the stream is available in unused_data.
+        :param data: next piece of the raw DEFLATE stream
+        :param max_length: maximum number of bytes to return, the rest stays buffered for the next call
+        (call again with empty data while needs_input is False); -1 for no limit
+        :return: bytes inflated since the previous call
+        """
+        if self.input is None:
+            self.input = BitInputStream(b'')
+        self.input.extend(data)
+
+        limit = len(self.output) if max_length < 0 else self._returned + max_length
+        if max_length < 0 or len(self.output) < limit:
+            self._output_limit = None if max_length < 0 else limit
+            self.__inflate()
+            self._output_limit = None
+
+        end = min(len(self.output), limit) if max_length >= 0 else len(self.output)
+        result = bytes(self.output[self._returned:end])
+        self._returned = end
+        if end < len(self.output):
+            self.needs_input = False
+        if self._returned > WINDOW_SIZE:
+            del self.output[:self._returned - WINDOW_SIZE]
+            self._returned = WINDOW_SIZE
+        return result
+
+    def flush(self):
+        """
+        Inflates all the input fed so far without an output limit.
+        :return: all remaining output; check eof to find out whether the stream is complete
+        """
+        return self.feed(b'')
+
+    def __inflate(self):
+        if self.stats is None:
+            self.__run_blocks()
+            return
+        start = self.input.tell()
+        self.__run_blocks()
+        self.stats.add('compressed_bits', self.input.tell() - start)
+        self.stats.add('matches', self._matches)
+        self.stats.add('match_bytes', self._match_bytes)
+        self._matches = self._match_bytes = 0
+
+    def __run_blocks(self):
+        # Runs the block state machine until the stream ends, the input runs dry or the output limit is reached
+        self.needs_input = False
+        while self._state != FINISHED:
+            if self._state == BLOCK_HEADER:
+                if self._stop_position is not None and self.input.tell() >= self._stop_position:
+                    return
+                if self._stop_length is not None and len(self.output) >= self._stop_length:
+                    return
+                if not self.__resumable(self.__read_block_header):
+                    return
+                continue
+            elif self._state == STORED_BLOCK:
+                done = self.__decompress_uncompressed_data()
+            else:
+                done = self.__decompress_huffman_data(self._length_table, self._distance_table)
 
-        dist_table = [5] * 32
-        self.fixed_distance_table = code_tree.CodeTree(dist_table)
+            if not done:
+                return
+            if self._final_block:
+                self._state = FINISHED
+                self.input.align_to_byte()
+            else:
+                self._state = BLOCK_HEADER
+
+    def __resumable(self, step):
+        # Runs a step that must not be interrupted. If the input runs out, the stream is rewound to retry later
+        if self._input_complete:
+            step()
+            return True
+        mark = self.input.mark()
+        try:
+            step()
+        except IOError:
+            self.input.reset(mark)
+            self.needs_input = True
+            return False
+        return True
+
+    def __output_full(self):
+        return self._output_limit is not None and len(self.output) >= self._output_limit
+
+    def __read_block_header(self):
+        self._final_block = self.input.read() == 1
+        b_type = self.input.read_bits(2)
+        if self.stats is not None and b_type < 3:
+            self.stats.add(BLOCK_COUNTERS[b_type])
+
+        if b_type == 0:
+            self.input.align_to_byte()
+            len = self.input.read_bits(SIXTEEN_BITS)
+            nlen = self.input.read_bits(SIXTEEN_BITS)
+            if (len ^ 0xFFFF) != nlen:
+                raise ValueError('Invalid length in uncompressed block')
+            self._stored_remaining = len
+            self._state = STORED_BLOCK
+        elif b_type == 1:
+            self._length_table, self._distance_table = self.fixed_literal_length_table, self.fixed_distance_table
+            self._state = HUFFMAN_BLOCK
+        elif b_type == 2:
+            if self.stats is None:
+                self.__build_dynamic_tables()
+            else:
+                self.__measured_build_dynamic_tables()
+            self._length_table, self._distance_table = self.dynamic_literal_length_table, self.dynamic_distance_table
+            self._state = HUFFMAN_BLOCK
+        else:
+            raise RuntimeError('Invalid compression type')
 
     def __build_dynamic_tables(self):
         hlit = self.input.read_bits(FIVE_BITS) + 257
@@ -85,7 +250,7 @@ class Deflate:
             else:
                 temp_code_lengths[7 - i // 2] = self.input.read_bits(THREE_BITS)
 
-        code_length_table = code_tree.CodeTree(temp_code_lengths)
+        code_length_table = code_tree.get_code_tree(temp_code_lengths)
 
         code_lengths = [0] * (hlit + hdist)
         temp_value = -1
@@ -116,7 +281,7 @@ class Deflate:
             raise ValueError('Run exceeds number of codes')
 
         literal_length_table_length = code_lengths[:hlit]
-        self.dynamic_literal_length_table = code_tree.CodeTree(literal_length_table_length)
+        self.dynamic_literal_length_table = code_tree.get_code_tree(literal_length_table_length)
 
         distance_table_length = code_lengths[hlit:]
         if len(distance_table_length) == 1 and distance_table_length[0] == 0:
@@ -134,32 +299,72 @@ class Deflate:
                 	distance_table_length = distance_table_length + [0] * (32 - len(distance_table_length))
                 distance_table_length[31] = 1
 
-            self.dynamic_distance_table = code_tree.CodeTree(distance_table_length)
-
-    def __decompress_uncompressed_data(self):
-        while self.input.get_bit_position() != 0:
-            self.input.read()
-
-        len = self.input.read_bits(SIXTEEN_BITS)
-        nlen = self.input.read_bits(SIXTEEN_BITS)
+            self.dynamic_distance_table = code_tree.get_code_tree(distance_table_length)
 
-        if (len ^ 0xFFFF) != nlen:
-            raise ValueError('Invalid length in uncompressed block')
+    def __measured_build_dynamic_tables(self):
+        before = code_tree.get_cache_info()
+        with self.stats.timer('table_build'):
+            self.__build_dynamic_tables()
+        after = code_tree.get_cache_info()
+        self.stats.add('table_builds', after.misses - before.misses)
+        self.stats.add('table_cache_hits', after.hits - before.hits)
 
-        for i in range(0, len):
-            byte = self.input.read_byte()
-            self.output.write(bytes([byte]))
-            self.buffer.append(byte)
+    def __decompress_uncompressed_data(self):
+        count = self._stored_remaining
+        if not self._input_complete:
+            count = min(count, self.input.available_bits() >> 3)
+        if self._output_limit is not None:
+            count = min(count, max(self._output_limit - len(self.output), 0))
+
+        if self.stats is None:
+            self.output.extend(self.input.read_bytes(count))
+        else:
+            with self.stats.timer('stored_copy'):
+                self.output.extend(self.input.read_bytes(count))
+            self.stats.add('stored_bytes', count)
+        self._stored_remaining -= count
+        if self._stored_remaining:
+            self.needs_input = not self.__output_full()
+            return False
+        return True
 
     def __decompress_huffman_data(self, length_table, distance_table):
-        while True:
-            symbol = self.__decode_literal(length_table)
-            if symbol == 256:  # end of block
-                break
+        while not self.__output_full():
+            if self._input_complete:
+                budget = -1 if self._output_limit is None else SYMBOL_BATCH
+            else:
+                # Enough input for this many symbols is guaranteed, no need to check each of them
+                budget = min(self.input.available_bits() // MAX_SYMBOL_BITS, SYMBOL_BATCH)
 
+            if budget:
+                if self.__decode_symbols(length_table, distance_table, budget):
+                    return True
+            else:
+                output_length = len(self.output)
+                mark = self.input.mark()
+                try:
+                    if self.__decode_symbols(length_table, distance_table, 1):
+                        return True
+                except IOError:
+                    self.input.reset(mark)
+                    del self.output[output_length:]
+                    self.needs_input = True
+                    return False
+        return False
+
+    def __decode_symbols(self, length_table, distance_table, count):
+        """
+        Decodes up to count symbols of a Huffman block, a negative count means no limit.
+        :return: True if the end of block was reached
+        """
+        output = self.output
+        while count:
+            count -= 1
+            symbol = self.__decode_literal(length_table)
             if symbol < 256:  # symbol is literal
-                self.output.write(bytes([symbol]))
-                self.buffer.append(symbol)
+                output.append(symbol)
+            elif symbol == 256:  # end of block
+                return True
             else:  # symbol is length-distance pair
                 length = self.__decode_length(symbol)
                 if length < 3 or length > 258:
@@ -168,27 +373,42 @@ class Deflate:
                     raise ValueError('Length symbol encountered with empty distance code')
                 distance_byte = self.__decode_literal(distance_table)
                 distance = self.__decode_distance(distance_byte)
-                if distance < 1 or distance > 2 ** 15:
+                if distance < 1 or distance > WINDOW_SIZE or distance > len(output):
                     raise ValueError('Invalid distance')
 
-                self.buffer.copy(length, distance, self.output)
+                self.__copy(length, distance)
+        return False
+
+    def __measured_decode_symbols(self, length_table, distance_table, count):
+        output_length, match_bytes = len(self.output), self._match_bytes
+        start = time.perf_counter()
+        try:
+            return Deflate.__decode_symbols(self, length_table, distance_table, count)
+        finally:
+            self.stats.add_time('huffman_decode', time.perf_counter() - start)
+            produced = len(self.output) - output_length
+            self.stats.add('huffman_bytes', produced)
+            self.stats.add('literals', produced - (self._match_bytes - match_bytes))
+
+    def __measured_copy(self, length, distance):
+        start = time.perf_counter()
+        Deflate.__copy(self, length, distance)
+        self.stats.add_time('copy', time.perf_counter() - start)
+        self._matches += 1
+        self._match_bytes += length
+
+    def __copy(self, length, distance):
+        output = self.output
+        start = len(output) - distance
+        if distance >= length:  # no overlap, plain slice copy
+            output += output[start:start + length]
+        elif distance == 1:  # run of a single byte
+            output += output[-1:] * length
+        else:  # overlapping run, repeat the pattern
+            output += (output[start:] * (length // distance + 1))[:length]
 
     def __decode_literal(self, tree):
-        current_node = tree.root
-        while True:
-            byte = self.input.read()
-            next_node = None
-            if byte == 0:
-                next_node = current_node.left_child
-            elif byte == 1:
-                next_node = current_node.right_child
-            else:
-                raise ValueError
-
-            if isinstance(next_node, code_tree.Leaf):
-                return next_node.symbol
-
-            current_node = next_node
+        return tree.decode_symbol(self.input)
 
     def __decode_length(self, symbol):
         if symbol < 257 or symbol > 287:
@@ -220,11 +440,50 @@ def main():
     stream = io.BytesIO(data)
     bit_input_stream = BitInputStream(stream)
 
-    deflate = Deflate(bit_input_stream)
-    output_stream = deflate.decompress()
-
-    output_stream.seek(0)
-    print(output_stream.read())
+    deflate = Deflate()
+    output = deflate.decompress(bit_input_stream)
+    print(bytes(output))
+
+
+def sample_streams():
+    """
+    Sample data compressed by zlib with every block type and strategy, for the tests of the inflaters.
+    :return: list of (data, raw DEFLATE stream) pairs
+    """
+    import zlib
+    import random
+    generator = random.Random(0)
+    words = [bytes(generator.choices(b'abcdefgh ', k=generator.randint(1, 9))) for _ in range(200)]
+    samples = [b'', b'a', bytes(range(256)) * 4, b'\0' * 100000, b'abc' * 30000, generator.randbytes(70000),
+               b' '.join(generator.choices(words, k=40000))]
+    streams = []
+    for data in samples:
+        for level, strategy in ((0, zlib.Z_DEFAULT_STRATEGY), (1, zlib.Z_DEFAULT_STRATEGY), (6, zlib.Z_FIXED),
+                                (6, zlib.Z_HUFFMAN_ONLY), (6, zlib.Z_RLE), (9, zlib.Z_DEFAULT_STRATEGY)):
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, strategy)
+            streams.append((data, compressor.compress(data) + compressor.flush()))
+    return streams
+
+
+def test():
+    for data, stream in sample_streams():
+        assert Deflate().decompress(stream) == data
+        assert Deflate().decompress(io.BytesIO(stream)) == data
+        if data:
+            assert Deflate().decompress(stream, max_length=len(data)) == data
+            try:
+                Deflate().decompress(stream, max_length=len(data) - 1)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('max_length not enforced')
+    for stream in (b'', b'\x07', b'\xff' * 16):  # truncated, reserved block type, invalid codes
+        try:
+            Deflate().decompress(stream)
+        except (ValueError, IOError, RuntimeError):
+            pass
+        else:
+            raise AssertionError('Invalid stream accepted')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,48 @@
+from .bit_input_stream import BitInputStream
+from .deflate import Deflate, WINDOW_SIZE
+
+SPAN = 2 ** 20  # output between two checkpoints
+
+
+class Checkpoint:
+    """
+    State needed to resume inflating at a block boundary, as in zlib's zran.c: where the block starts in the
+    compressed stream, how much output precedes it and the last 32 KiB of that output.
+    """
+    __slots__ = ('bit_offset', 'output_offset', 'window')
+
+    def __init__(self, bit_offset, output_offset, window):
+        self.bit_offset = bit_offset
+        self.output_offset = output_offset
+        self.window = window
+
+    def __str__(self):
+        return 'Bit offset: {}, Output offset: {}, Window: {}'.format(self.bit_offset, self.output_offset,
+                                                                       len(self.window))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def iter_spans(data, span=SPAN, checkpoint=None):
+    """
+    Inflates a raw DEFLATE stream a few blocks at a time, keeping only the window between spans.
+    :param data: bytes-like object with the whole raw stream
+    :param span: minimum output of a span, every span ends at a block boundary
+    :param checkpoint: resume from this checkpoint instead of the start of the stream
+    :return: generator of (Checkpoint at the start of the span, inflated bytes of the span)
+    """
+    if checkpoint is None:
+        checkpoint = Checkpoint(0, 0, b'')
+    input_stream = BitInputStream.at(data, checkpoint.bit_offset)
+    base = checkpoint.bit_offset & ~7
+    deflate = Deflate(checkpoint.window)
+    offset = checkpoint.output_offset
+    while not deflate.eof:
+        start = Checkpoint(base + input_stream.tell(), offset, bytes(deflate.output[-WINDOW_SIZE:]))
+        begin = len(deflate.output)
+        deflate.decompress(input_stream, stop_length=begin + span)
+        piece = bytes(deflate.output[begin:])
+        deflate.discard_output()
+        offset += len(piece)
+        yield start, piece
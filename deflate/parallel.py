@@ -0,0 +1,231 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from .bit_input_stream import BitInputStream
+from .deflate import Deflate, WINDOW_SIZE
+
+SEGMENT_SIZE = 2 ** 18  # minimum number of compressed bytes per segment
+SEARCH_LIMIT = 2 ** 16  # bytes scanned for a block start after the nominal beginning of a segment
+SYNC_MARKER = b'\x00\x00\xff\xff'  # LEN and NLEN of the empty stored block written by a sync or full flush
+PLACEHOLDER_BASE = 256  # byte k of the unknown window preceding a segment decodes to PLACEHOLDER_BASE + k
+PLACEHOLDER_WINDOW = array('H', range(PLACEHOLDER_BASE, PLACEHOLDER_BASE + WINDOW_SIZE))  # copied by Deflate
+DECODE_ERRORS = (ValueError, RuntimeError, IOError)
+
+# Kraft sum (in units of 2 ** -7) of four packed 3-bit code lengths of the code length code
+KRAFT_SUMS = [sum(1 << (7 - length) for length in ((i >> shift) & 7 for shift in (0, 3, 6, 9)) if length)
+              for i in range(1 << 12)]
+
+_data = None  # compressed stream, handed to the worker processes once by the pool initializer
+
+
+def inflate(data, workers=None, segment_size=SEGMENT_SIZE, max_length=None):
+    """
+    Inflates a raw DEFLATE stream, decoding segments of it in parallel processes.
+
+    Segments start at block boundaries found after evenly spaced offsets: the block following a sync marker or a
+    plausible dynamic block header. Every segment is decoded against a window of placeholders, so back-references
+    into the previous segment survive as PLACEHOLDER_BASE + window index. A second, sequential pass checks that each
+    segment started where the previous one really ended and replaces the placeholders with the bytes of the
+    previous window; segments that started at a false boundary are decoded again sequentially.
+    :param data: bytes-like object holding the stream
+    :param workers: number of processes (default: number of CPUs)
+    :param segment_size: minimum number of compressed bytes per segment
+    :param max_length: raise ValueError as soon as the output grows past this many bytes. No worker inflates more
+    than that, and the segments not started yet are cancelled once the segments resolved so far exceed it
+    :return: bytearray with the inflated data and the bit position where the stream ended
+    """
+    data = bytes(data)
+    segments = max(1, min(workers or os.cpu_count() or 1, len(data) // segment_size))
+    if segments == 1:
+        input_stream = BitInputStream(data)
+        return Deflate().decompress(input_stream, max_length=max_length), input_stream.tell()
+
+    nominal = [len(data) * i // segments * 8 for i in range(1, segments)]
+    executor = ProcessPoolExecutor(workers, initializer=_share_data, initargs=(data,))
+    try:
+        found = executor.map(_find_block_start, nominal)
+        starts = [0] + sorted(set(start for start in found if start is not None))
+        stops = starts[1:] + [None]
+        futures = [executor.submit(_decode_segment, start, stop, max_length) for start, stop in zip(starts, stops)]
+        # Resolved in order as they complete, so that an oversized output stops the pool early
+        return resolve_segments(data, starts, (future.result() for future in futures), max_length)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def find_block_start(data, position, limit=SEARCH_LIMIT):
+    """
+    Looks for a position where a block seems to start: after a sync marker, or else at a dynamic block header
+    whose code trees are complete and whose first symbol decodes.
+    :param position: bit position to search from
+    :return: bit position or None
+    """
+    start = (position + 7) >> 3
+    end = min(len(data), start + limit)
+    marker = data.find(SYNC_MARKER, start, end)
+    if 0 <= marker < len(data) - len(SYNC_MARKER):
+        return (marker + len(SYNC_MARKER)) << 3
+    for bit in _header_candidates(data, start, end):
+        if _is_dynamic_header(data, bit):
+            return bit
+    return None
+
+
+def decode_segment(data, start, stop, max_length=None):
+    """
+    Decodes whole blocks from start up to the first block boundary at or after stop.
+    :param max_length: give up once the segment inflates to more than this many bytes
+    :return: inflated data (array of placeholders and bytes unless the segment starts the stream, bytes when it
+    references nothing before it), bit position where decoding stopped and whether the final block was decoded;
+    None if the data does not decode
+    """
+    window = None if start == 0 else PLACEHOLDER_WINDOW
+    input_stream = BitInputStream.at(data, start)
+    deflate = Deflate(window)
+    limit = max_length if max_length is None or window is None else max_length + len(window)
+    try:
+        output = deflate.decompress(input_stream, None if stop is None else stop - (start & ~7), max_length=limit)
+    except DECODE_ERRORS:
+        return None
+    if window is not None:
+        output = output[WINDOW_SIZE:]
+        if not output or max(output) < PLACEHOLDER_BASE:
+            output = bytes(output.tolist())
+    return output, (start & ~7) + input_stream.tell(), deflate.eof
+
+
+def resolve_segments(data, starts, results, max_length=None):
+    """
+    Second pass of inflate: chains the segments, replacing placeholders with the bytes they stand for.
+    :param results: iterable of the results of decode_segment, in the order of starts
+    :param max_length: raise ValueError as soon as the output grows past this many bytes
+    :return: bytearray with the inflated data and the bit position where the stream ended
+    """
+    output = bytearray()
+    position = 0
+    finished = False
+    for number, (start, result) in enumerate(zip(starts, results)):
+        stop = starts[number + 1] if number + 1 < len(starts) else None
+        if finished or (stop is not None and position >= stop):
+            continue
+        if start == position and result is not None:
+            piece, position, finished = result
+            if isinstance(piece, array):
+                window = output[-WINDOW_SIZE:]
+                # Placeholders before the start of the stream have no byte, as distances past it are invalid
+                table = list(range(PLACEHOLDER_BASE)) + [None] * (WINDOW_SIZE - len(window)) + list(window)
+                try:
+                    piece = bytes(map(table.__getitem__, piece))
+                except TypeError:
+                    raise ValueError('Invalid distance')
+            output += piece
+        else:
+            # The segment did not start at a real block boundary, continue from the last one sequentially
+            window = bytes(output[-WINDOW_SIZE:])
+            input_stream = BitInputStream.at(data, position)
+            deflate = Deflate(window)
+            limit = None if max_length is None else max_length - len(output) + len(window)
+            output += deflate.decompress(input_stream, None if stop is None else stop - (position & ~7),
+                                         max_length=limit)[len(window):]
+            position = (position & ~7) + input_stream.tell()
+            finished = deflate.eof
+        if max_length is not None and len(output) > max_length:
+            raise ValueError('Inflated data exceeds the expected size')
+
+    if not finished:
+        raise IOError
+    return output, position
+
+
+def _header_candidates(data, start, end):
+    # Bit positions with BTYPE == 2, HLIT <= 29 and HDIST <= 29, tested for the whole range at once on a big integer
+    region = int.from_bytes(data[start:end + 2], 'little')
+    mask = ~region >> 1 & region >> 2
+    mask &= ~(region >> 4 & region >> 5 & region >> 6 & region >> 7)
+    mask &= ~(region >> 9 & region >> 10 & region >> 11 & region >> 12)
+    mask &= (1 << ((end - start) << 3)) - 1
+    bits = bin(mask)[:1:-1]  # least significant bit first
+    index = bits.find('1')
+    while index >= 0:
+        yield (start << 3) + index
+        index = bits.find('1', index + 1)
+
+
+def _is_dynamic_header(data, position):
+    # Cheap check first: the code length code must be complete
+    word = int.from_bytes(data[position >> 3:(position >> 3) + 10], 'little') >> (position & 7)
+    code_lengths = (word >> 17) & ((1 << (3 * (((word >> 13) & 15) + 4))) - 1)
+    kraft_sum = 0
+    while code_lengths:
+        kraft_sum += KRAFT_SUMS[code_lengths & 0xFFF]
+        code_lengths >>= 12
+    if kraft_sum != 1 << 7:
+        return False
+
+    # Complete header: the trees must build and the first symbol must decode
+    deflate = Deflate(PLACEHOLDER_WINDOW)
+    deflate.input = BitInputStream.at(data, position)
+    try:
+        deflate.feed(b'', 1)
+    except DECODE_ERRORS:
+        return False
+    return not deflate.needs_input
+
+
+def _share_data(data):
+    global _data
+    _data = data
+
+
+def _find_block_start(position):
+    return find_block_start(_data, position)
+
+
+def _decode_segment(start, stop, max_length):
+    return decode_segment(_data, start, stop, max_length)
+
+
+def test():
+    import zlib
+    from .deflate import sample_streams
+    for data, stream in sample_streams():
+        if len(stream) < 2 ** 13:
+            continue
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        flushed = b''.join(compressor.compress(data[start:start + 2 ** 14]) + compressor.flush(zlib.Z_FULL_FLUSH)
+                           for start in range(0, len(data), 2 ** 14)) + compressor.flush()
+        for stream in (stream, flushed):
+            # Block starts found after a quarter, half and three quarters of the stream, plus one that is not a block
+            # boundary
+            found = (find_block_start(stream, len(stream) * 8 * quarter // 4) for quarter in (1, 2, 3))
+            starts = sorted({0, len(stream) * 4 + 3} | {start for start in found if start is not None})
+            results = [decode_segment(stream, start, stop) for start, stop in zip(starts, starts[1:] + [None])]
+            output, end = resolve_segments(stream, starts, results)
+            assert output == data and (end + 7) >> 3 == len(stream)
+
+    # A segment referencing data before the start of the stream, through a preset dictionary
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    head = compressor.compress(b'abc') + compressor.flush(zlib.Z_SYNC_FLUSH)
+    dictionary = bytes(range(200))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=dictionary)
+    stream = head + compressor.compress(dictionary) + compressor.flush()
+    starts = [0, len(head) * 8]
+    for decode in (lambda: Deflate().decompress(stream),
+                   lambda: resolve_segments(stream, starts, [decode_segment(stream, 0, starts[1]),
+                                                             decode_segment(stream, starts[1], None)])):
+        try:
+            decode()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Distance before the start of the stream accepted')
+
+    data, stream = sample_streams()[-1]
+    output, end = inflate(stream, 2, segment_size=2 ** 12)
+    assert output == data and (end + 7) >> 3 == len(stream)
+    try:
+        inflate(stream, 2, segment_size=2 ** 12, max_length=len(data) - 1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('max_length not enforced')
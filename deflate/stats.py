@@ -0,0 +1,59 @@
+import time
+
+
+class Stats:
+    """
+    Opt-in instrumentation shared by Reader, Picture and Deflate: wall time per stage and counters. Without a Stats
+    object nothing is measured, and the symbol decoding loop is the same as before.
+
+    Stages (seconds): chunk_io, crc32, adler32, table_build, huffman_decode (including copy), copy, stored_copy,
+    unfilter. Counters: chunks, bytes_read, compressed_bits, stored_blocks, fixed_blocks, dynamic_blocks,
+    table_builds, table_cache_hits, stored_bytes, huffman_bytes, literals, matches, match_bytes.
+    Subclasses can override add and add_time to forward every measurement, e.g. to a metrics client.
+    """
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+
+    def __str__(self):
+        return ', '.join('{}: {:.6f}s'.format(stage, seconds) for stage, seconds in self.times.items()) + \
+            '\r\n' + ', '.join('{}: {}'.format(name, count) for name, count in self.counts.items())
+
+    def __repr__(self):
+        return self.__str__()
+
+    def add(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def timer(self, stage):
+        """
+        :return: context manager adding the time spent inside it to the stage
+        """
+        return _Timer(self, stage)
+
+    def as_dict(self):
+        """
+        :return: {'times': {stage: seconds}, 'counts': {name: count}, 'literal_ratio': share of literals among
+        the symbols of Huffman blocks, None before any}
+        """
+        literals, matches = self.counts.get('literals', 0), self.counts.get('matches', 0)
+        return {'times': dict(self.times), 'counts': dict(self.counts),
+                'literal_ratio': literals / (literals + matches) if literals + matches else None}
+
+
+class _Timer:
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.stats.add_time(self.stage, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,254 @@
+import time
+from itertools import accumulate
+from .bit_input_stream import BitInputStream
+from .deflate import Deflate
+from . import parallel
+
+try:
+    from zlib import adler32 as native_adler32  # only the checksum, inflating stays pure Python
+except ImportError:
+    native_adler32 = None
+
+DEFLATE_METHOD = 8
+MAX_WINDOW_BITS_CODE = 7  # CINFO is log2(window size) - 8
+PRESET_DICTIONARY_FLAG = 0x20
+
+STREAM_CHUNK_SIZE = 2 ** 16  # bytes of output produced per step when streaming
+
+ADLER_MODULO = 65521
+ADLER_BLOCK_SIZE = 5552  # largest n such that the sums cannot overflow 32 bits before the modulo
+
+
+def adler32(data, value=1):
+    """
+    Computes the Adler-32 checksum used by the zlib format (RFC 1950), in C when the zlib module is available.
+    :param data: bytes-like object
+    :param value: running checksum to continue from
+    :return: updated checksum
+    """
+    if native_adler32 is not None:
+        return native_adler32(data, value)
+    return python_adler32(data, value)
+
+
+def python_adler32(data, value=1):
+    """
+    Pure Python Adler-32, see adler32.
+    """
+    a, b = value & 0xFFFF, value >> 16
+    for start in range(0, len(data), ADLER_BLOCK_SIZE):
+        block = data[start:start + ADLER_BLOCK_SIZE]
+        # b gains the running value of a after every byte: len * a + sum of the prefix sums
+        b = (b + a * len(block) + sum(accumulate(block))) % ADLER_MODULO
+        a = (a + sum(block)) % ADLER_MODULO
+    return (b << 16) | a
+
+
+def adler32_combine(first, second, length):
+    """
+    Checksum of two concatenated pieces of data from their own checksums, see zlib's adler32_combine.
+    :param first: checksum of the first piece
+    :param second: checksum of the second piece, computed from the initial value 1
+    :param length: length of the second piece
+    :return: checksum of both pieces
+    """
+    a1, b1 = first & 0xFFFF, first >> 16
+    a2, b2 = second & 0xFFFF, second >> 16
+    a = (a1 + a2 - 1) % ADLER_MODULO
+    # Every byte of the second piece adds a1 - 1 more to b than it did starting from 1
+    b = (b1 + b2 + length * (a1 - 1)) % ADLER_MODULO
+    return (b << 16) | a
+
+
+def check_header(header):
+    """
+    Validates the two-byte zlib header.
+    :param header: CMF and FLG bytes
+    """
+    if len(header) < 2:
+        raise ValueError('Truncated zlib header')
+    cmf, flg = header[0], header[1]
+    if cmf & 0x0F != DEFLATE_METHOD or cmf >> 4 > MAX_WINDOW_BITS_CODE:
+        raise ValueError('Unsupported zlib compression method')
+    if ((cmf << 8) | flg) % 31 != 0:
+        raise ValueError('Invalid zlib header check bits')
+    if flg & PRESET_DICTIONARY_FLAG:
+        raise ValueError('Preset dictionaries are not supported')
+
+
+def check_adler32(data, expected, value=1, timings=None):
+    """
+    :param expected: stored checksum
+    :param value: running checksum of the data preceding `data`
+    :param timings: dictionary, the seconds spent are added to its 'adler32' entry
+    :return: checksum of the data, raises ValueError when it differs from `expected` (None to only compute it)
+    """
+    start = time.perf_counter()
+    value = adler32(data, value)
+    if timings is not None:
+        timings['adler32'] = timings.get('adler32', 0.0) + time.perf_counter() - start
+    if expected is not None and value != expected:
+        raise ValueError('Adler-32 checksum mismatch')
+    return value
+
+
+def decompress(data, workers=None, verify=True, timings=None, stats=None, max_length=None):
+    """
+    Inflates a complete zlib stream and verifies its Adler-32 checksum.
+    :param data: bytes-like object holding the zlib stream
+    :param workers: inflate segments of the stream in this many processes, see parallel.inflate
+    :param verify: False skips the Adler-32 check, the trailer must still be present
+    :param timings: dictionary collecting the checksum time, see check_adler32
+    :param stats: Stats object for the inflater, not used with several workers
+    :param max_length: raise ValueError as soon as the output grows past this many bytes, see parallel.inflate
+    :return: bytearray with the inflated data
+    """
+    data = memoryview(data)
+    check_header(data[:2])
+    if workers and workers > 1:
+        output, end = parallel.inflate(data[2:], workers, max_length=max_length)
+    else:
+        input_stream = BitInputStream(data[2:])
+        output = Deflate(stats=stats).decompress(input_stream, max_length=max_length)
+        end = input_stream.tell()
+    trailer = data[2 + ((end + 7) >> 3):][:4]
+    if len(trailer) < 4:
+        raise IOError('Truncated zlib stream')
+    if verify:
+        check_adler32(output, int.from_bytes(trailer, 'big'), timings=timings)
+    return output
+
+
+class ZlibDecompressor:
+    """
+    Incremental zlib decoder around the feed method of a raw DEFLATE inflater, checking the header and the Adler-32
+    trailer on the fly.
+    """
+    def __init__(self, verify=True, timings=None, stats=None, inflater=None):
+        """
+        :param verify: False skips the Adler-32 check
+        :param timings: dictionary collecting the checksum time, see check_adler32
+        :param stats: Stats object for the inflater
+        :param inflater: object with the feed, eof, needs_input and unused_data of Deflate (default: a new Deflate)
+        """
+        self.inflater = Deflate(stats=stats) if inflater is None else inflater
+        self.verify = verify
+        self.timings = timings
+        self.eof = False
+        self.unused_data = b''
+        self._header = b''
+        self._trailer = b''
+        self._checksum = 1
+
+    @property
+    def needs_input(self):
+        if self.eof:
+            return False
+        return len(self._header) < 2 or self.inflater.eof or self.inflater.needs_input
+
+    def feed(self, data, max_length=-1):
+        """
+        :param data: next piece of the zlib stream
+        :param max_length: see Deflate.feed
+        :return: bytes inflated since the previous call
+        """
+        if self.eof:
+            self.unused_data += bytes(data)
+            return b''
+
+        if len(self._header) < 2:
+            taken = 2 - len(self._header)
+            self._header += bytes(data[:taken])
+            data = data[taken:]
+            if len(self._header) < 2:
+                return b''
+            check_header(self._header)
+
+        output = b''
+        if not self.inflater.eof:
+            output = self.inflater.feed(data, max_length)
+            if self.verify:
+                self._checksum = check_adler32(output, None, self._checksum, self.timings)
+            if not self.inflater.eof:
+                return output
+            data = self.inflater.unused_data
+
+        self._trailer += bytes(data)
+        if len(self._trailer) >= 4:
+            if self.verify and int.from_bytes(self._trailer[:4], 'big') != self._checksum:
+                raise ValueError('Adler-32 checksum mismatch')
+            self.eof = True
+            self.unused_data = self._trailer[4:]
+        return output
+
+    def flush(self):
+        """
+        :return: all remaining output, see Deflate.flush
+        """
+        return self.feed(b'')
+
+
+def iter_decompress(pieces, chunk_size=STREAM_CHUNK_SIZE, verify=True, timings=None, stats=None, decompressor=None,
+                    max_length=None):
+    """
+    Inflates a zlib stream arriving in pieces, e.g. the payloads of consecutive IDAT chunks.
+    Only the inflater window and one output piece are held in memory.
+    :param pieces: iterable of bytes-like objects
+    :param chunk_size: maximum number of bytes yielded at once
+    :param verify: False skips the Adler-32 check
+    :param timings: dictionary collecting the checksum time, see check_adler32
+    :param stats: Stats object for the inflater
+    :param decompressor: object with the ZlibDecompressor interface to use instead, see backends
+    :param max_length: raise ValueError as soon as the output grows past this many bytes
+    :return: generator of inflated pieces
+    """
+    if decompressor is None:
+        decompressor = ZlibDecompressor(verify, timings, stats)
+    total = 0
+    for piece in pieces:
+        output = decompressor.feed(piece, chunk_size)
+        while output:
+            total += len(output)
+            if max_length is not None and total > max_length:
+                raise ValueError('Inflated data exceeds the expected size')
+            yield output
+            output = decompressor.feed(b'', chunk_size)
+
+    if not decompressor.eof:
+        raise IOError('Truncated zlib stream')
+
+
+def test():
+    import zlib
+    from .deflate import sample_streams
+    for data, stream in sample_streams():
+        for piece_size, max_length in ((97, -1), (7, 1000), (4096, -1), (len(stream) + 1, 100)):
+            deflate = Deflate()
+            output = []
+            pieces = [stream[start:start + piece_size] for start in range(0, len(stream), piece_size)]
+            for piece in pieces + [b'end']:
+                output.append(deflate.feed(piece, max_length))
+                while not deflate.needs_input and not deflate.eof:
+                    output.append(deflate.feed(b'', max_length))
+            output.append(deflate.flush())
+            assert b''.join(output) == data and deflate.eof and deflate.unused_data == b'end'
+
+        zlib_data = zlib.compress(data)
+        pieces = [zlib_data[start:start + 1000] for start in range(0, len(zlib_data), 1000)]
+        assert b''.join(iter_decompress(pieces, chunk_size=5000)) == data
+        assert decompress(zlib_data) == data
+        decompressor = ZlibDecompressor()
+        assert decompressor.feed(zlib_data + b'end') + decompressor.flush() == data
+        assert decompressor.eof and decompressor.unused_data == b'end'
+        for broken, error in ((zlib_data[:-1], IOError), (zlib_data[:-1] + bytes((zlib_data[-1] ^ 1,)), ValueError)):
+            try:
+                for _ in iter_decompress([broken]):
+                    pass
+            except error:
+                pass
+            else:
+                raise AssertionError('Broken stream accepted')
+
+
+if __name__ == '__main__':
+    test()
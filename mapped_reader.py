@@ -0,0 +1,188 @@
+import os.path
+import time
+import mmap
+import struct
+import binascii
+import validation
+from reader import Chunk, Picture, STRICT, INTEGRITY_POLICIES, should_check_crc, get_checksum_times
+from deflate import backends
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+CHUNK_HEADER = struct.Struct('>I4s')
+
+
+class MappedChunk(Chunk):
+    """
+    Chunk whose data and CRC are slices of a memory-mapped file, nothing is read or copied until used.
+    """
+    __slots__ = ('offset', 'crc_offset', '_view')
+
+    def __init__(self, view, name, offset, length, crc_offset):
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.crc_offset = crc_offset
+        self._view = view
+
+    @property
+    def data(self):
+        return self._view[self.offset:self.offset + self.length]
+
+    @property
+    def crc(self):
+        return self._view[self.crc_offset:self.crc_offset + 4]
+
+    def check_crc(self):
+        return binascii.crc32(self.data, binascii.crc32(self.name)) == int.from_bytes(self.crc, 'big')
+
+
+class MappedReader:
+    """
+    Reader over a memory-mapped file. Opening only scans the chunk headers to build an index of
+    (name, data offset, length, CRC offset); chunk payloads are exposed as memoryview slices of the mapping.
+    """
+    def __init__(self, integrity=STRICT, stats=None, inflate=backends.AUTO, limits=validation.DEFAULT_LIMITS):
+        """
+        :param integrity: STRICT, CRITICAL_ONLY or SKIP, see reader.INTEGRITY_POLICIES
+        :param stats: deflate.Stats object, see reader.Reader
+        :param inflate: inflate backend of the pictures, see reader.Picture
+        :param limits: validation.Limits checked while the chunk headers are scanned
+        """
+        if integrity not in INTEGRITY_POLICIES:
+            raise LookupError('Unknown integrity policy')
+        self.integrity = integrity
+        self.stats = stats
+        self.inflate = inflate
+        self.limits = limits
+        self.checksum_times = get_checksum_times(stats)  # shared with the pictures, as in reader.Reader
+        self.name = None
+        self.file = None
+        self.mapping = None
+        self.view = None
+        self.index = []
+        self.index_by_name = {}
+
+    def open(self, file):
+        if os.path.isfile(file):
+            self.file = open(file, 'rb')
+            self.name = os.path.basename(file)
+        else:
+            raise ReferenceError('File not found')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapping)
+        self.build_index()
+        return self
+
+    def close(self):
+        """
+        Unmaps and closes the file. While chunk data views are still referenced the mapping cannot be unmapped and
+        BufferError is raised; the file and the reader are closed anyway, and the mapping is freed together with the
+        last of those views.
+        """
+        if not self.file:
+            raise ReferenceError('Nothing is opened')
+        try:
+            self.view.release()
+            self.mapping.close()
+        finally:
+            self.file.close()
+            self.file = self.mapping = self.view = None
+
+    def build_index(self):
+        if self.view[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+            raise TypeError('File seems to be corrupted')
+
+        self.index = []
+        self.index_by_name = {}
+        validator = validation.ChunkValidator(self.limits)
+        position = len(PNG_SIGNATURE)
+        while position + CHUNK_HEADER.size <= len(self.view):
+            length, name = CHUNK_HEADER.unpack_from(self.view, position)
+            offset = position + CHUNK_HEADER.size
+            crc_offset = offset + length
+            validator.check_chunk(name, length)
+            if crc_offset + 4 > len(self.view):
+                raise TypeError('File seems to be corrupted')
+            if name == b'IHDR':
+                validator.check_header(self.view[offset:crc_offset])
+            self.index_by_name.setdefault(name, []).append(len(self.index))
+            self.index.append((name, offset, length, crc_offset))
+            position = crc_offset + 4
+            if name == b'IEND':
+                return
+        raise TypeError('File seems to be corrupted')
+
+    def get_chunk(self, number):
+        return MappedChunk(self.view, *self.index[number])
+
+    def find_chunks(self, name):
+        """
+        :param name: chunk type, e.g. b'IDAT'
+        :return: list of the chunks of that type, in file order
+        """
+        return [self.get_chunk(number) for number in self.index_by_name.get(name, [])]
+
+    def get_picture(self, check_crc=True):
+        """
+        :param check_crc: verify the chunk CRCs the integrity policy asks for; without it only the chunk headers are
+        ever touched
+        :return: Picture whose chunk data are views of the mapping
+        """
+        if not self.file:
+            raise ReferenceError('Nothing is opened')
+        chunks = [self.get_chunk(number) for number in range(len(self.index))]
+        if check_crc:
+            start = time.perf_counter()
+            valid = all(chunk.check_crc() for chunk in chunks if should_check_crc(self.integrity, chunk.name))
+            self.checksum_times['crc32'] += time.perf_counter() - start
+            if not valid:
+                raise TypeError('File seems to be corrupted')
+        return Picture(self.name, chunks, self.integrity, self.checksum_times, self.stats, self.inflate)
+
+
+def main():
+    reader = MappedReader().open('pics/mario.png')
+    print(reader.index)
+    pic = reader.get_picture()
+    print(pic)
+    print(pic.decode_pixels())
+
+
+def test():
+    import zlib
+    import tempfile
+
+    def chunk(name, data):
+        return CHUNK_HEADER.pack(len(data), name) + data + zlib.crc32(data, zlib.crc32(name)).to_bytes(4, 'big')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.png')
+        with open(path, 'wb') as file:
+            file.write(PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', 2, 2, 8, 0, 0, 0, 0)) +
+                       chunk(b'IDAT', zlib.compress(b'\0\1\2\0\3\4')) + chunk(b'IEND', b''))
+        reader = MappedReader().open(path)
+        picture = reader.get_picture()
+        assert bytes(picture.decode_pixels().data) == b'\1\2\3\4'
+        del picture
+        reader.close()  # nothing refers to the chunk data any more
+
+        reader = MappedReader().open(path)
+        data = reader.find_chunks(b'IDAT')[0].data
+        file = reader.file
+        try:
+            reader.close()
+        except BufferError:
+            pass
+        else:
+            raise AssertionError('Mapping closed while chunk data is referenced')
+        assert file.closed and bytes(data) == zlib.compress(b'\0\1\2\0\3\4')
+        try:
+            reader.close()
+        except ReferenceError:
+            pass
+        else:
+            raise AssertionError('Closed twice')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+from operator import and_
+import pixels
+
+OPAQUE = 255
+TRANSPARENT = 0
+
+# Byte value -> 0xFF if it equals the key byte, 0 otherwise
+MATCH_TABLES = [bytes(0xFF if value == key else 0 for value in range(256)) for key in range(256)]
+INVERT_TABLE = bytes(255 - value for value in range(256))
+
+
+class Palette:
+    """
+    Colors of an indexed-color image (PLTE) with their optional alpha values (tRNS). Expansion goes through
+    precomputed tables: one translate() per output channel for 8-bit indices, and for smaller bit depths a table from
+    every packed byte to the pixels it holds.
+    """
+    def __init__(self, plte, trns=b''):
+        if not plte or len(plte) % 3 or len(plte) > 3 * 256:
+            raise ValueError('Invalid palette length')
+        if len(trns) > len(plte) // 3:
+            raise ValueError('More alpha values than palette entries')
+
+        self.size = len(plte) // 3
+        self.has_alpha = len(trns) > 0
+        self.channels = 4 if self.has_alpha else 3
+        # Indices past the palette are an error in the stream, they are shown as opaque black
+        padding = 256 - self.size
+        self.tables = [bytes(plte[channel::3]) + bytes(padding) for channel in range(3)]
+        if self.has_alpha:
+            self.tables.append(bytes(trns) + bytes([OPAQUE]) * (256 - len(trns)))
+        self.packed_tables = {}
+
+    def __str__(self):
+        return 'Entries: {}, Alpha: {}'.format(self.size, self.has_alpha)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def expand(self, image):
+        """
+        :param image: pixels.PixelBuffer of palette indices
+        :return: pixels.PixelBuffer of 8-bit RGB or RGBA pixels
+        """
+        if image.bit_depth == 8:
+            indices = bytes(image.data[:image.width * image.height])
+            return pixels.PixelBuffer(self.expand_indices(indices), image.width, image.height, self.channels, 8)
+
+        table = self.get_packed_table(image.bit_depth)
+        length = image.width * self.channels
+        data = bytearray()
+        for y in range(image.height):
+            data += b''.join(map(table.__getitem__, image.row(y)))[:length]
+        return pixels.PixelBuffer(data, image.width, image.height, self.channels, 8)
+
+    def expand_indices(self, indices):
+        """
+        :param indices: bytes with one palette index each
+        :return: bytearray of interleaved RGB or RGBA samples
+        """
+        channels = self.channels
+        data = bytearray(len(indices) * channels)
+        for channel, table in enumerate(self.tables):
+            data[channel::channels] = indices.translate(table)
+        return data
+
+    def get_packed_table(self, bit_depth):
+        """
+        :return: list of 256 entries, the expanded pixels of every byte of packed indices
+        """
+        if bit_depth not in self.packed_tables:
+            self.packed_tables[bit_depth] = [bytes(self.expand_indices(samples))
+                                             for samples in pixels.UNPACK_TABLES[bit_depth]]
+        return self.packed_tables[bit_depth]
+
+
+def add_color_key_alpha(image, key):
+    """
+    Adds an alpha channel to a grayscale or truecolor image from a tRNS color key: pixels equal to the key become
+    fully transparent, all others opaque. Sub-byte grayscale is scaled to 8 bits, as alpha needs at least 8.
+    :param image: pixels.PixelBuffer with 1 or 3 channels
+    :param key: tRNS chunk data, one 16-bit value per channel
+    :return: pixels.PixelBuffer with 2 or 4 channels
+    """
+    channels = image.channels
+    if len(key) != 2 * channels:
+        raise ValueError('Invalid tRNS length')
+    values = [int.from_bytes(key[offset:offset + 2], 'big') for offset in range(0, len(key), 2)]
+    if max(values) >= 1 << image.bit_depth:
+        raise ValueError('tRNS value out of range')
+
+    bit_depth = image.bit_depth
+    if bit_depth < 8:
+        scale = 255 // ((1 << bit_depth) - 1)
+        data = bytes(pixels.unpack_samples(image.data, image.width, image.height, 1, bit_depth))
+        data = data.translate(bytes(min(value * scale, 255) for value in range(256)))
+        values = [values[0] * scale]
+        bit_depth = 8
+    else:
+        data = bytes(image.data[:image.height * image.stride])
+
+    sample_size = bit_depth // 8
+    key_bytes = b''.join(value.to_bytes(sample_size, 'big') for value in values)
+    alpha = transparency_mask(data, key_bytes).translate(INVERT_TABLE)
+
+    pixel_size = len(key_bytes)
+    output_size = pixel_size + sample_size
+    result = bytearray(len(alpha) * output_size)
+    for offset in range(pixel_size):
+        result[offset::output_size] = data[offset::pixel_size]
+    for offset in range(pixel_size, output_size):
+        result[offset::output_size] = alpha
+    return pixels.PixelBuffer(result, image.width, image.height, channels + 1, bit_depth)
+
+
+def transparency_mask(data, key_bytes):
+    """
+    :param data: pixels of len(key_bytes) bytes each
+    :return: bytes with 0xFF for every pixel equal to the key, 0 otherwise
+    """
+    pixel_size = len(key_bytes)
+    mask = data[0::pixel_size].translate(MATCH_TABLES[key_bytes[0]])
+    for offset in range(1, pixel_size):
+        mask = bytes(map(and_, mask, data[offset::pixel_size].translate(MATCH_TABLES[key_bytes[offset]])))
+    return mask
+
+
+def test():
+    import random
+    generator = random.Random(0)
+    width, height = 11, 5
+    for bit_depth in (1, 2, 4, 8):
+        for size in (1 << bit_depth, max(1, (1 << bit_depth) - 1)):  # a full palette, and one an index is past
+            plte = generator.randbytes(3 * size)
+            indices = [generator.getrandbits(bit_depth) for _ in range(width * height)]
+            data = b''.join(pixels.pack_samples(indices[y * width:(y + 1) * width], bit_depth) if bit_depth < 8
+                            else bytes(indices[y * width:(y + 1) * width]) for y in range(height))
+            image = pixels.PixelBuffer(data, width, height, 1, bit_depth)
+            for trns in (b'', generator.randbytes(max(1, size // 2))):
+                expected = bytearray()
+                for index in indices:
+                    expected += plte[3 * index:3 * index + 3] if index < size else bytes(3)
+                    if trns:
+                        expected.append(trns[index] if index < len(trns) else OPAQUE)
+                expanded = Palette(plte, trns).expand(image)
+                assert expanded.channels == (4 if trns else 3) and bytes(expanded.data) == expected
+
+    for channels in (1, 3):
+        for bit_depth in (8, 16):
+            sample_size = bit_depth // 8
+            pixel_size = channels * sample_size
+            data = bytearray(generator.randbytes(width * height * pixel_size))
+            key = data[:pixel_size]
+            data[5 * pixel_size:6 * pixel_size] = key  # at least two transparent pixels
+            image = pixels.PixelBuffer(data, width, height, channels, bit_depth)
+            trns = b''.join(int.from_bytes(key[offset:offset + sample_size], 'big').to_bytes(2, 'big')
+                            for offset in range(0, pixel_size, sample_size))
+            expected = bytearray()
+            for offset in range(0, len(data), pixel_size):
+                pixel = data[offset:offset + pixel_size]
+                expected += pixel + bytes([TRANSPARENT if pixel == key else OPAQUE]) * sample_size
+            result = add_color_key_alpha(image, trns)
+            assert result.channels == channels + 1 and result.bit_depth == bit_depth
+            assert bytes(result.data) == expected
@@ -0,0 +1,560 @@
+import sys
+from array import array
+from itertools import accumulate, repeat
+from operator import add, sub, and_, or_, lshift, rshift, floordiv
+
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+ALL_FILTERS = (FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE, FILTER_PAETH)
+
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # samples per pixel for every color type
+
+# Adam7 passes: first column, first row, column step and row step
+ADAM7_PASSES = ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4), (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2))
+# Spacing of the pixels known once each pass is complete
+ADAM7_GRIDS = ((8, 8), (4, 8), (4, 4), (2, 4), (2, 2), (1, 2), (1, 1))
+
+AUTO = 'auto'
+PYTHON = 'python'
+NUMPY = 'numpy'
+
+# Packed byte -> one byte per sample, for every sub-byte depth
+UNPACK_TABLES = {depth: [bytes((byte >> shift) & ((1 << depth) - 1) for shift in range(8 - depth, -1, -depth))
+                         for byte in range(256)]
+                 for depth in (1, 2, 4)}
+# Filtered byte -> its magnitude as a signed byte, the cost minimized when choosing a filter per row
+SIGNED_MAGNITUDE = bytes(min(value, 256 - value) for value in range(256))
+
+
+class PixelBuffer:
+    """
+    Unfiltered image data in row-major order. Every row takes `stride` bytes and keeps the sample layout of the
+    PNG stream: sub-byte samples stay packed (leftmost pixel in the high-order bits), 16-bit samples are big endian.
+    """
+    def __init__(self, data, width, height, channels, bit_depth):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.stride = row_stride(width, channels, bit_depth)
+        self.bytes_per_pixel = bytes_per_pixel(channels, bit_depth)
+
+    def __str__(self):
+        return '{}x{}, Channels: {}, Bit depth: {}, Stride: {}'.format(self.width, self.height, self.channels,
+                                                                     self.bit_depth, self.stride)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def row(self, y):
+        return memoryview(self.data)[y * self.stride:(y + 1) * self.stride]
+
+    def unpack(self):
+        """
+        Spreads sub-byte samples to one byte each, 8 and 16-bit data is returned unchanged.
+        :return: bytearray, identical to the bytes of to_array()
+        """
+        return unpack_samples(self.data, self.width, self.height, self.channels, self.bit_depth)
+
+    def to_array(self):
+        """
+        :return: numpy array of shape (height, width, channels)
+        """
+        import pixels_numpy
+        return pixels_numpy.unpack_samples(self.data, self.width, self.height, self.channels, self.bit_depth)
+
+
+def row_stride(width, channels, bit_depth):
+    return (width * channels * bit_depth + 7) // 8
+
+
+def bytes_per_pixel(channels, bit_depth):
+    # Filters operate on whole bytes: sub-byte pixels are compared with the previous byte
+    return max(1, channels * bit_depth // 8)
+
+
+def unfilter(raw, height, stride, bpp, backend=AUTO):
+    """
+    Reverses the PNG filters with the requested backend. 'auto' picks NumPy when it can be imported.
+    :return: bytes-like object of height * stride bytes
+    """
+    numpy_backend = _load_numpy_backend(backend)
+    if numpy_backend:
+        return numpy_backend.unfilter_scanlines(raw, height, stride, bpp).reshape(-1).data
+    return unfilter_scanlines(raw, height, stride, bpp)
+
+
+def filter_image(data, height, stride, bpp, filter_types=ALL_FILTERS, previous=None, backend=AUTO):
+    """
+    Applies the PNG filters with the requested backend, see filter_scanlines.
+    :return: bytes-like object of height * (stride + 1) bytes
+    """
+    numpy_backend = _load_numpy_backend(backend)
+    if numpy_backend:
+        return numpy_backend.filter_scanlines(data, height, stride, bpp, filter_types, previous).reshape(-1).data
+    return filter_scanlines(data, height, stride, bpp, filter_types, previous)
+
+
+def _load_numpy_backend(backend):
+    if backend == PYTHON:
+        return None
+    if backend not in (AUTO, NUMPY):
+        raise LookupError('Unknown backend')
+    try:
+        import pixels_numpy
+    except ImportError:
+        if backend == NUMPY:
+            raise
+        return None
+    return pixels_numpy
+
+
+def unpack_samples(data, width, height, channels, bit_depth):
+    """
+    Pure Python counterpart of pixels_numpy.unpack_samples.
+    :return: bytearray with one byte per sample for bit depths below 8
+    """
+    stride = row_stride(width, channels, bit_depth)
+    if bit_depth >= 8:
+        return bytearray(data[:height * stride])
+
+    table = UNPACK_TABLES[bit_depth]
+    samples_per_row = width * channels
+    result = bytearray()
+    for y in range(height):
+        result += b''.join(map(table.__getitem__, data[y * stride:(y + 1) * stride]))[:samples_per_row]
+    return result
+
+
+def unfilter_scanlines(raw, height, stride, bpp):
+    """
+    Reverses the PNG filters of consecutive scanlines.
+    :param raw: inflated image data, every scanline prefixed with its filter type byte
+    :param height: number of scanlines
+    :param stride: length of a scanline without the filter type byte
+    :param bpp: bytes per complete pixel, rounded up to one
+    :return: bytearray of height * stride bytes
+    """
+    if len(raw) < height * (stride + 1):
+        raise ValueError('Not enough image data')
+
+    result = bytearray(height * stride)
+    previous = bytes(stride)
+    position = 0
+    for y in range(height):
+        row = bytearray(raw[position + 1:position + 1 + stride])
+        unfilter_row(raw[position], row, previous, bpp)
+        result[y * stride:(y + 1) * stride] = row
+        previous = row
+        position += stride + 1
+    return result
+
+
+def filter_scanlines(data, height, stride, bpp, filter_types=ALL_FILTERS, previous=None):
+    """
+    Inverse of unfilter_scanlines. With several candidate filter types every scanline gets the one whose output has
+    the minimum sum of absolute differences, the bytes taken as signed (the heuristic of the PNG specification).
+    :param data: height * stride bytes of unfiltered scanlines
+    :param filter_types: candidate filter types
+    :param previous: unfiltered scanline above the first one (default: zeros), to filter a band of an image
+    :return: bytearray of height * (stride + 1) bytes, every scanline prefixed with its filter type byte
+    """
+    if len(data) < height * stride:
+        raise ValueError('Not enough image data')
+
+    result = bytearray()
+    previous = bytes(stride) if previous is None else bytes(previous)
+    for y in range(height):
+        row = bytes(data[y * stride:(y + 1) * stride])
+        candidates = [(filter_type, filter_row(filter_type, row, previous, bpp)) for filter_type in filter_types]
+        if len(candidates) > 1:
+            # The first of equal costs wins, so the cheaper filter types are preferred
+            candidates.sort(key=lambda candidate: sum(candidate[1].translate(SIGNED_MAGNITUDE)))
+        filter_type, filtered = candidates[0]
+        result.append(filter_type)
+        result += filtered
+        previous = row
+    return result
+
+
+def iter_unfiltered_rows(pieces, height, stride, bpp):
+    """
+    Streaming counterpart of unfilter_scanlines: only the previous scanline and a partial one are kept.
+    :param pieces: iterable of inflated image data pieces of any size
+    :return: generator of unfiltered scanlines (bytes)
+    """
+    for _, _, row in iter_scanlines(pieces, [(height, stride)], bpp):
+        yield row
+
+
+class RowAssembler:
+    """
+    Push counterpart of iter_unfiltered_rows: inflated data goes in as it arrives, complete scanlines come out.
+    The state can be captured and restored, see region_index.
+    """
+    def __init__(self, height, stride, bpp, y=0, previous=None, pending=b''):
+        """
+        :param y: index of the next scanline
+        :param previous: unfiltered scanline y - 1 (default: zeros, as above the first row)
+        :param pending: inflated bytes of scanline y received so far, starting with its filter type byte
+        """
+        self.height = height
+        self.stride = stride
+        self.bpp = bpp
+        self.y = y
+        self.previous = bytes(stride) if previous is None else bytes(previous)
+        self.pending = bytearray(pending)
+
+    def feed(self, data):
+        """
+        :param data: inflated image data
+        :return: list of the scanlines completed by the data
+        """
+        self.pending += data
+        rows = []
+        position, stride = 0, self.stride
+        while self.y < self.height and len(self.pending) - position > stride:
+            row = bytearray(self.pending[position + 1:position + 1 + stride])
+            unfilter_row(self.pending[position], row, self.previous, self.bpp)
+            self.previous = bytes(row)
+            rows.append(self.previous)
+            position += stride + 1
+            self.y += 1
+        del self.pending[:position]
+        return rows
+
+
+def iter_scanlines(pieces, images, bpp):
+    """
+    Unfilters the scanlines of consecutive images stored in one stream, e.g. the seven Adam7 passes.
+    :param pieces: iterable of inflated image data pieces of any size
+    :param images: list of (height, stride) of the images; an image without pixels takes no data
+    :return: generator of (image index, row index, unfiltered scanline as bytes)
+    """
+    pieces = iter(pieces)
+    pending = bytearray()
+    position = 0
+    for index, (height, stride) in enumerate(images):
+        if not height or not stride:
+            continue
+        previous = bytes(stride)
+        for y in range(height):
+            while len(pending) - position <= stride:
+                del pending[:position]
+                position = 0
+                piece = next(pieces, None)
+                if piece is None:
+                    raise ValueError('Not enough image data')
+                pending += piece
+            row = bytearray(pending[position + 1:position + 1 + stride])
+            unfilter_row(pending[position], row, previous, bpp)
+            previous = bytes(row)
+            position += stride + 1
+            yield index, y, previous
+
+
+def downscale(rows, width, height, channels, bit_depth, factor, average=True):
+    """
+    Shrinks an image by an integer factor while its rows stream in, only one row of sums is kept.
+    :param rows: iterable of unfiltered scanlines, at least `height` of them
+    :param average: mean of every factor x factor block (box filter), blocks cut by the right and bottom edges are
+    averaged over the pixels they have; False keeps the top left pixel of every block instead
+    :return: PixelBuffer of ceil(width / factor) x ceil(height / factor) pixels
+    """
+    out_width, out_height = -(-width // factor), -(-height // factor)
+    step = factor * channels
+    rows = iter(rows)
+    data = bytearray()
+    for y in range(0, height, factor):
+        block_height = min(factor, height - y)
+        line = [0] * (out_width * channels)
+        if average:
+            sums = [[0] * out_width for _ in range(channels)]
+            for _ in range(block_height):
+                samples = _row_samples(next(rows), width, channels, bit_depth, out_width * step)
+                for start in range(step):
+                    sums[start % channels] = list(map(add, sums[start % channels], samples[start::step]))
+            counts = [factor * block_height] * (out_width - 1) + [(width - (out_width - 1) * factor) * block_height]
+            halves = [count // 2 for count in counts]
+            for channel in range(channels):
+                line[channel::channels] = map(floordiv, map(add, sums[channel], halves), counts)
+        else:
+            samples = _row_samples(next(rows), width, channels, bit_depth, out_width * step)
+            for channel in range(channels):
+                line[channel::channels] = samples[channel::step]
+            for _ in range(block_height - 1):
+                next(rows)  # every row is needed to unfilter the next one
+        data += _pack_row(line, bit_depth)
+    return PixelBuffer(data, out_width, out_height, channels, bit_depth)
+
+
+def _row_samples(row, width, channels, bit_depth, length):
+    # One integer per sample, zero padded to `length`
+    if bit_depth == 16:
+        samples = array('H', bytes(row[:width * channels * 2]))
+        if sys.byteorder == 'little':
+            samples.byteswap()
+    elif bit_depth == 8:
+        samples = bytearray(row[:width * channels])
+    else:
+        samples = unpack_samples(row, width, 1, channels, bit_depth)
+    samples.extend(bytes(length - len(samples)))
+    return samples
+
+
+def _pack_row(samples, bit_depth):
+    if bit_depth == 16:
+        samples = array('H', samples)
+        if sys.byteorder == 'little':
+            samples.byteswap()
+        return samples.tobytes()
+    if bit_depth == 8:
+        return bytes(samples)
+    return pack_samples(samples, bit_depth)
+
+
+def iter_adam7(pieces, width, height, channels, bit_depth):
+    """
+    Unfilters Adam7 interlaced image data pass by pass.
+    :param pieces: iterable of inflated image data pieces of any size
+    :return: generator of (pass number from 1 to 7, Deinterlacer holding every pass up to that one)
+    """
+    deinterlacer = Deinterlacer(width, height, channels, bit_depth)
+    images = [(pass_height, row_stride(pass_width, channels, bit_depth))
+              for pass_width, pass_height in (adam7_pass_size(width, height, number) for number in range(1, 8))]
+    bpp = bytes_per_pixel(channels, bit_depth)
+
+    completed = 0
+    for index, y, row in iter_scanlines(pieces, images, bpp):
+        while completed < index:
+            completed += 1
+            yield completed, deinterlacer
+        deinterlacer.add_row(index + 1, y, row)
+    while completed < len(ADAM7_PASSES):
+        completed += 1
+        yield completed, deinterlacer
+
+
+def deinterlace(pieces, width, height, channels, bit_depth):
+    """
+    :param pieces: iterable of inflated Adam7 image data pieces of any size
+    :return: PixelBuffer of the full image
+    """
+    for _, deinterlacer in iter_adam7(pieces, width, height, channels, bit_depth):
+        pass
+    return deinterlacer.result()
+
+
+def iter_adam7_previews(pieces, width, height, channels, bit_depth):
+    """
+    :param pieces: iterable of inflated Adam7 image data pieces of any size
+    :return: generator of (pass number, PixelBuffer with the preview after that pass, see Deinterlacer.preview)
+    """
+    for number, deinterlacer in iter_adam7(pieces, width, height, channels, bit_depth):
+        yield number, deinterlacer.preview(number)
+
+
+def adam7_pass_size(width, height, number):
+    """
+    :param number: pass number from 1 to 7
+    :return: width and height of the reduced image of the pass
+    """
+    x0, y0, dx, dy = ADAM7_PASSES[number - 1]
+    return max(0, (width - x0 + dx - 1) // dx), max(0, (height - y0 + dy - 1) // dy)
+
+
+def image_data_size(width, height, channels, bit_depth, interlace_method=0):
+    """
+    :return: length of the inflated image data, filter type bytes included
+    """
+    if interlace_method != 1:
+        return height * (row_stride(width, channels, bit_depth) + 1)
+    sizes = (adam7_pass_size(width, height, number) for number in range(1, 8))
+    return sum(pass_height * (row_stride(pass_width, channels, bit_depth) + 1)
+               for pass_width, pass_height in sizes if pass_width)
+
+
+class Deinterlacer:
+    """
+    Scatters the reduced images of the Adam7 passes into the full image. Pixels are kept one per `pixel_size` bytes,
+    sub-byte samples unpacked, and packed again when a PixelBuffer is produced.
+    """
+    def __init__(self, width, height, channels, bit_depth):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.bit_depth = bit_depth
+        self.pixel_size = bytes_per_pixel(channels, bit_depth) if bit_depth >= 8 else 1
+        self.data = bytearray(width * height * self.pixel_size)
+
+    def add_row(self, number, y, row):
+        """
+        :param number: pass number from 1 to 7
+        :param y: row index within the reduced image of the pass
+        :param row: unfiltered scanline of the pass
+        """
+        x0, y0, dx, dy = ADAM7_PASSES[number - 1]
+        if self.bit_depth < 8:
+            row = unpack_samples(row, adam7_pass_size(self.width, self.height, number)[0], 1, 1, self.bit_depth)
+        size = self.pixel_size
+        line = (y0 + y * dy) * self.width * size
+        for channel in range(size):
+            self.data[line + x0 * size + channel:line + self.width * size:dx * size] = row[channel::size]
+
+    def preview(self, number):
+        """
+        Low resolution image of the pixels known after a pass: every 8th pixel in both directions after pass 1,
+        every 4th after pass 3, every 2nd after pass 5 and all of them after pass 7.
+        :param number: pass number from 1 to 7
+        :return: PixelBuffer of the preview
+        """
+        x_step, y_step = ADAM7_GRIDS[number - 1]
+        width, size = (self.width + x_step - 1) // x_step, self.pixel_size
+        line_length = self.width * size
+        data = bytearray()
+        for y in range(0, self.height, y_step):
+            line = self.data[y * line_length:(y + 1) * line_length]
+            row = bytearray(width * size)
+            for channel in range(size):
+                row[channel::size] = line[channel::x_step * size]
+            data += row if self.bit_depth >= 8 else pack_samples(row, self.bit_depth)
+        return PixelBuffer(data, width, (self.height + y_step - 1) // y_step, self.channels, self.bit_depth)
+
+    def result(self):
+        """
+        :return: PixelBuffer of the full image
+        """
+        if self.bit_depth >= 8:
+            return PixelBuffer(self.data, self.width, self.height, self.channels, self.bit_depth)
+        return self.preview(len(ADAM7_PASSES))
+
+
+def pack_samples(samples, bit_depth):
+    """
+    Inverse of unpack_samples for a single row: packs one-byte samples, leftmost in the high-order bits.
+    """
+    per_byte = 8 // bit_depth
+    samples = bytes(samples) + bytes(-len(samples) % per_byte)
+    result = bytes(len(samples) // per_byte)
+    for index in range(per_byte):
+        shifted = map(lshift, samples[index::per_byte], repeat(8 - bit_depth * (index + 1)))
+        result = bytes(map(or_, result, shifted))
+    return result
+
+
+def unfilter_row(filter_type, row, previous, bpp):
+    """
+    Reverses the filter of a single scanline in place.
+    :param filter_type: filter type byte of the scanline
+    :param row: bytearray with the filtered scanline
+    :param previous: unfiltered previous scanline (all zeros for the first one)
+    :param bpp: bytes per complete pixel, rounded up to one
+    """
+    if filter_type == FILTER_NONE:
+        return
+    elif filter_type == FILTER_SUB:
+        # Each byte position modulo bpp is an independent running sum
+        for channel in range(min(bpp, len(row))):
+            row[channel::bpp] = bytes(map(and_, accumulate(row[channel::bpp]), repeat(0xFF)))
+    elif filter_type == FILTER_UP:
+        row[:] = bytes(map(and_, map(add, row, previous), repeat(0xFF)))
+    elif filter_type == FILTER_AVERAGE:
+        for i in range(min(bpp, len(row))):
+            row[i] = (row[i] + (previous[i] >> 1)) & 0xFF
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + ((row[i - bpp] + previous[i]) >> 1)) & 0xFF
+    elif filter_type == FILTER_PAETH:
+        for i in range(min(bpp, len(row))):
+            row[i] = (row[i] + previous[i]) & 0xFF
+        for i in range(bpp, len(row)):
+            a, b, c = row[i - bpp], previous[i], previous[i - bpp]
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            if pa <= pb and pa <= pc:
+                predictor = a
+            elif pb <= pc:
+                predictor = b
+            else:
+                predictor = c
+            row[i] = (row[i] + predictor) & 0xFF
+    else:
+        raise ValueError('Unknown filter type')
+
+
+def filter_row(filter_type, row, previous, bpp):
+    """
+    Filters a single scanline, the inverse of unfilter_row.
+    :param row: unfiltered scanline (bytes)
+    :param previous: unfiltered previous scanline (all zeros for the first one)
+    :return: filtered scanline (bytes)
+    """
+    left = bytes(bpp) + row[:len(row) - bpp]
+    if filter_type == FILTER_NONE:
+        return bytes(row)
+    elif filter_type == FILTER_SUB:
+        predictors = left
+    elif filter_type == FILTER_UP:
+        predictors = previous
+    elif filter_type == FILTER_AVERAGE:
+        predictors = map(rshift, map(add, left, previous), repeat(1))
+    elif filter_type == FILTER_PAETH:
+        upper_left = bytes(bpp) + previous[:len(row) - bpp]
+        predictors = map(paeth_predictor, left, previous, upper_left)
+    else:
+        raise ValueError('Unknown filter type')
+    return bytes(map(and_, map(sub, row, predictors), repeat(0xFF)))
+
+
+def paeth_predictor(a, b, c):
+    """
+    :param a: byte to the left, b: byte above, c: byte above and to the left
+    :return: the one closest to a + b - c
+    """
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+def test():
+    import random
+    generator = random.Random(0)
+    for channels, bit_depth in ((1, 1), (1, 2), (1, 4), (1, 8), (3, 8), (2, 16), (4, 16)):
+        pixel_size = bytes_per_pixel(channels, bit_depth) if bit_depth >= 8 else 1
+        for width, height in ((1, 1), (3, 2), (5, 7), (8, 8), (13, 11)):
+            # One entry per pixel: its bytes, or its sample for sub-byte depths
+            image = [[generator.randbytes(pixel_size) if bit_depth >= 8 else generator.getrandbits(bit_depth)
+                      for _ in range(width)] for _ in range(height)]
+
+            def pack(line):
+                return b''.join(line) if bit_depth >= 8 else pack_samples(line, bit_depth)
+
+            expected = b''.join(pack(line) for line in image)
+            interlaced = bytearray()
+            for x0, y0, dx, dy in ADAM7_PASSES:
+                rows = [pack(line[x0::dx]) for line in image[y0::dy] if line[x0::dx]]
+                if rows:
+                    interlaced += filter_scanlines(b''.join(rows), len(rows), len(rows[0]),
+                                                   bytes_per_pixel(channels, bit_depth))
+            assert image_data_size(width, height, channels, bit_depth, 1) == len(interlaced)
+            pieces = [interlaced[start:start + 7] for start in range(0, len(interlaced), 7)]
+            assert bytes(deinterlace(pieces, width, height, channels, bit_depth).data) == expected
+
+            previews = list(iter_adam7_previews(pieces, width, height, channels, bit_depth))
+            assert [number for number, _ in previews] == list(range(1, 8))
+            for number, preview in previews:
+                x_step, y_step = ADAM7_GRIDS[number - 1]
+                assert bytes(preview.data) == b''.join(pack(line[::x_step]) for line in image[::y_step])
+            try:
+                deinterlace(pieces[:-1], width, height, channels, bit_depth)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('Truncated image data accepted')
@@ -0,0 +1,133 @@
+import numpy as np
+import pixels
+
+
+def unfilter_scanlines(raw, height, stride, bpp):
+    """
+    NumPy counterpart of pixels.unfilter_scanlines.
+    :return: uint8 array of shape (height, stride)
+    """
+    if len(raw) < height * (stride + 1):
+        raise ValueError('Not enough image data')
+
+    lines = np.frombuffer(raw, dtype=np.uint8, count=height * (stride + 1)).reshape(height, stride + 1)
+    filter_types = lines[:, 0].tolist()
+    result = lines[:, 1:].copy()
+    previous = np.zeros(stride, dtype=np.uint8)
+    for y, filter_type in enumerate(filter_types):
+        row = result[y]
+        if filter_type == pixels.FILTER_NONE:
+            pass
+        elif filter_type == pixels.FILTER_SUB:
+            # A running sum per byte position modulo bpp, wrapping in uint8
+            if stride % bpp == 0:
+                np.cumsum(row.reshape(-1, bpp), axis=0, dtype=np.uint8, out=row.reshape(-1, bpp))
+            else:
+                for channel in range(bpp):
+                    row[channel::bpp] = np.cumsum(row[channel::bpp], dtype=np.uint8)
+        elif filter_type == pixels.FILTER_UP:
+            row += previous
+        elif filter_type in (pixels.FILTER_AVERAGE, pixels.FILTER_PAETH):
+            # Every byte depends on the one bpp positions to its left, a per-byte loop is faster than numpy here
+            line = bytearray(row.tobytes())
+            pixels.unfilter_row(filter_type, line, previous.tobytes(), bpp)
+            row[:] = np.frombuffer(line, dtype=np.uint8)
+        else:
+            raise ValueError('Unknown filter type')
+        previous = row
+    return result
+
+
+def unpack_samples(data, width, height, channels, bit_depth):
+    """
+    Converts unfiltered rows into an array of samples.
+    :param data: unfiltered image data, see pixels.PixelBuffer
+    :return: array of shape (height, width, channels), uint8 for bit depths up to 8, big endian uint16 otherwise
+    """
+    stride = pixels.row_stride(width, channels, bit_depth)
+    rows = np.frombuffer(data, dtype=np.uint8, count=height * stride).reshape(height, stride)
+    if bit_depth == 16:
+        return rows.view('>u2').reshape(height, width, channels)
+    if bit_depth == 8:
+        return rows.reshape(height, width, channels)
+
+    per_byte = 8 // bit_depth
+    shifts = np.arange((per_byte - 1) * bit_depth, -1, -bit_depth, dtype=np.uint8)
+    samples = (rows[:, :, np.newaxis] >> shifts) & ((1 << bit_depth) - 1)
+    return samples.reshape(height, stride * per_byte)[:, :width * channels].reshape(height, width, channels)
+
+
+def filter_scanlines(data, height, stride, bpp, filter_types=pixels.ALL_FILTERS, previous=None):
+    """
+    NumPy counterpart of pixels.filter_scanlines. Filtering only reads unfiltered bytes, so every row and every
+    candidate filter type is computed at once.
+    :return: uint8 array of shape (height, stride + 1)
+    """
+    if len(data) < height * stride:
+        raise ValueError('Not enough image data')
+
+    rows = np.frombuffer(data, dtype=np.uint8, count=height * stride).reshape(height, stride)
+    above = np.empty_like(rows)
+    above[0] = 0 if previous is None else np.frombuffer(previous, dtype=np.uint8, count=stride)
+    above[1:] = rows[:-1]
+    left = np.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+
+    candidates = np.empty((len(filter_types), height, stride), dtype=np.uint8)
+    for index, filter_type in enumerate(filter_types):
+        candidates[index] = rows - _predictors(filter_type, left, above, bpp)
+
+    result = np.empty((height, stride + 1), dtype=np.uint8)
+    if len(filter_types) == 1:
+        result[:, 0] = filter_types[0]
+        result[:, 1:] = candidates[0]
+        return result
+    # Sum of absolute differences with the bytes taken as signed; argmin keeps the first of equal costs
+    costs = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2, dtype=np.int64)
+    choice = costs.argmin(axis=0)
+    result[:, 0] = np.asarray(filter_types, dtype=np.uint8)[choice]
+    result[:, 1:] = candidates[choice, np.arange(height)]
+    return result
+
+
+def _predictors(filter_type, left, above, bpp):
+    if filter_type == pixels.FILTER_NONE:
+        return 0
+    elif filter_type == pixels.FILTER_SUB:
+        return left
+    elif filter_type == pixels.FILTER_UP:
+        return above
+    elif filter_type == pixels.FILTER_AVERAGE:
+        return ((left.astype(np.uint16) + above) >> 1).astype(np.uint8)
+    elif filter_type == pixels.FILTER_PAETH:
+        a, b = left.astype(np.int16), above.astype(np.int16)
+        c = np.zeros_like(b)
+        c[:, bpp:] = b[:, :-bpp]
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c)).astype(np.uint8)
+    raise ValueError('Unknown filter type')
+
+
+def test():
+    import random
+    generator = random.Random(0)
+    height = 9
+    for bpp in range(1, 9):
+        for stride in (bpp * 6, bpp * 5 + 3):
+            data = generator.randbytes(height * stride)
+            previous = generator.randbytes(stride)
+            for filter_types in [(filter_type,) for filter_type in pixels.ALL_FILTERS] + [pixels.ALL_FILTERS]:
+                for band_previous in (None, previous):
+                    expected = pixels.filter_scanlines(data, height, stride, bpp, filter_types, band_previous)
+                    filtered = filter_scanlines(data, height, stride, bpp, filter_types, band_previous)
+                    assert filtered.tobytes() == expected
+            # Every filter type in turn over random bytes
+            raw = b''.join(bytes((y % 5,)) + generator.randbytes(stride) for y in range(height))
+            expected = pixels.unfilter_scanlines(raw, height, stride, bpp)
+            assert unfilter_scanlines(raw, height, stride, bpp).tobytes() == expected
+    for channels in range(1, 5):
+        for bit_depth in (1, 2, 4, 8, 16):
+            width = 13
+            data = generator.randbytes(height * pixels.row_stride(width, channels, bit_depth))
+            expected = pixels.unpack_samples(data, width, height, channels, bit_depth)
+            assert unpack_samples(data, width, height, channels, bit_depth).tobytes() == expected
@@ -1,6 +1,13 @@
+import io
 import os.path
+import time
 import binascii
-from deflate import Deflate
+from itertools import islice
+import pixels
+import palette
+import region_index
+import validation
+from deflate import zlib_stream, backends
 
 SUPPORTED_CHUNKS = {'IHDR', 'IDAT', 'IEND', 'PLTE',
                     'bKGD', 'cHRM', 'gAMA', 'iTXt',
@@ -8,14 +15,44 @@ SUPPORTED_CHUNKS = {'IHDR', 'IDAT', 'IEND', 'PLTE',
                     'sTER', 'tEXt', 'tIME', 'tRNS',
                     'zTXt', 'iCCP', 'hIST'}
 
+PROBE_CHUNKS = {b'tEXt', b'pHYs', b'tIME'}  # ancillary chunks collected by Reader.probe by default
+
+# Integrity policies: which checksums Reader and Picture verify
+STRICT = 'strict'  # every chunk CRC and the Adler-32 of the image data
+CRITICAL_ONLY = 'critical-only'  # CRCs of critical chunks and the Adler-32, ancillary chunks are trusted
+SKIP = 'skip'  # nothing, for trusted internal pipelines
+INTEGRITY_POLICIES = (STRICT, CRITICAL_ONLY, SKIP)
+
+# Chunk property bits, see Picture.identify_chunk
+ANCILLARY = 1
+PRIVATE = 2
+RESERVED = 4
+SAFE_TO_COPY = 8
+UNKNOWN = 16
+
 INDEXED_COLOR = 'indexed-color'
 GRAYSCALE = 'grayscale'
 TRUECOLOR = 'truecolor'
 
 
 class Picture:
-    def __init__(self, name, chunks):
+    __slots__ = ('name', 'width', 'height', 'bit_depth', 'sample_depth', 'color_type', 'type_of_pixel',
+                 'alpha_channel', 'compression_method', 'filter_method', 'interlace_method', 'chunks',
+                 'chunks_by_name', 'integrity', 'checksum_times', 'stats', 'inflate')
+
+    def __init__(self, name, chunks, integrity=STRICT, checksum_times=None, stats=None, inflate=backends.AUTO):
+        """
+        :param integrity: STRICT, CRITICAL_ONLY or SKIP; decides whether the Adler-32 of the image data is checked
+        :param checksum_times: dictionary collecting the seconds spent checksumming, see Reader
+        :param stats: deflate.Stats object recording the inflate and unfilter stages, None to measure nothing
+        :param inflate: inflate backend, 'pure', 'zlib', 'differential' or 'auto' (see deflate.backends); only the
+        pure one records inflate stats and uses workers, 'auto' picks it when they are asked for
+        """
         self.name = name
+        self.integrity = integrity
+        self.checksum_times = {} if checksum_times is None else checksum_times
+        self.stats = stats
+        self.inflate = inflate
         self.width = None
         self.height = None
         self.bit_depth = None
@@ -30,6 +67,7 @@ class Picture:
         self.filter_method = None
         self.interlace_method = None
         self.chunks = []
+        self.chunks_by_name = {}
         self.analyze_chunks(chunks)
 
     def __str__(self):
@@ -46,32 +84,47 @@ class Picture:
         return self.__str__()
 
     def analyze_chunks(self, chunks):
-        self.check_chunk_order(chunks)
+        chunks = self.check_chunk_order(chunks)
 
         for chunk in chunks:
-            chunk_bits = self.identify_chunk(chunk.name)
-            new_chunk = ExtendedChunk(chunk, chunk_bits)
+            new_chunk = ExtendedChunk(chunk, self.identify_chunk(chunk.name))
             if new_chunk.unknown:
                 continue
             self.chunks.append(new_chunk)
+            self.chunks_by_name.setdefault(new_chunk.name, []).append(new_chunk)
 
         self.read_header()
 
+    def get_chunks(self, name):
+        """
+        :param name: chunk type, e.g. b'IDAT'
+        :return: list of the known chunks of that type, in file order
+        """
+        return self.chunks_by_name.get(name, [])
+
     def check_chunk_order(self, chunks):
-        # TODO: http://www.libpng.org/pub/png/spec/1.2/PNG-Chunks.html#C.Summary-of-standard-chunks
-        pass
+        """
+        Enforces the chunk ordering rules of the specification, raising ValueError for the critical chunks:
+        http://www.libpng.org/pub/png/spec/1.2/PNG-Chunks.html#C.Summary-of-standard-chunks
+        :return: the chunks without misplaced or repeated ancillary chunks, which are ignored
+        """
+        return validation.check_chunk_order(chunks)
 
     def identify_chunk(self, chunk_name):
-        ancillary = False if (65 <= chunk_name[0] <= 90) else True
-        private = False if (65 <= chunk_name[1] <= 90) else True
-        reserved = False if (65 <= chunk_name[2] <= 90) else True
-        safe = False if (65 <= chunk_name[3] <= 90) else True
-        unknown = False if chunk_name.decode() in SUPPORTED_CHUNKS else True
-
-        if not ancillary and unknown:
+        """
+        :return: bitfield of ANCILLARY, PRIVATE, RESERVED, SAFE_TO_COPY (lowercase letters of the name) and UNKNOWN
+        """
+        flags = 0
+        for bit, letter in zip((ANCILLARY, PRIVATE, RESERVED, SAFE_TO_COPY), chunk_name):
+            if not 65 <= letter <= 90:
+                flags |= bit
+        if chunk_name.decode() not in SUPPORTED_CHUNKS:
+            flags |= UNKNOWN
+
+        if flags & (ANCILLARY | UNKNOWN) == UNKNOWN:
             raise LookupError('Unknown critical chunk faced, terminating')  # TODO: exception type
 
-        return ancillary, private, reserved, safe, unknown
+        return flags
 
     def read_header(self):
         header_chunk = self.chunks[0]  # IHDR chunk must be FIRST
@@ -88,6 +141,186 @@ class Picture:
 
         self.get_type_of_pixel()
 
+    def decode_pixels(self, backend=pixels.AUTO, workers=None):
+        """
+        Concatenates the IDAT chunks, inflates them at once and reverses the scanline filters.
+        Inflating stops with ValueError as soon as the output exceeds the size implied by IHDR.
+        :param backend: 'python', 'numpy' or 'auto' (NumPy when it can be imported); interlaced images are always
+        deinterlaced in Python
+        :param workers: inflate segments of the image data in this many processes (see deflate.parallel)
+        :return: pixels.PixelBuffer with the unfiltered rows
+        """
+        channels, stride, bpp = self.get_scanline_layout()
+        inflater = backends.get_backend(self.inflate, workers, self.stats)
+        raw = inflater.decompress(self.get_image_data(), self.integrity != SKIP, self.checksum_times, self.stats,
+                                  workers, self.get_image_data_size())
+        start = time.perf_counter()
+        if self.interlace_method == 1:
+            image = pixels.deinterlace([raw], self.width, self.height, channels, self.bit_depth)
+        else:
+            data = pixels.unfilter(raw, self.height, stride, bpp, backend)
+            image = pixels.PixelBuffer(data, self.width, self.height, channels, self.bit_depth)
+        if self.stats is not None:
+            self.stats.add_time('unfilter', time.perf_counter() - start)
+        return image
+
+    def decode_expanded(self, backend=pixels.AUTO, workers=None):
+        """
+        Like decode_pixels, with indexed-color pixels looked up in the palette (RGB, or RGBA when tRNS is present) and
+        a tRNS color key of grayscale or truecolor images turned into an alpha channel.
+        :return: pixels.PixelBuffer
+        """
+        image = self.decode_pixels(backend, workers)
+        if self.type_of_pixel == INDEXED_COLOR:
+            return self.get_palette().expand(image)
+        transparency = self.get_chunks(b'tRNS')
+        if transparency and not self.alpha_channel:
+            return palette.add_color_key_alpha(image, transparency[0].data)
+        return image
+
+    def get_palette(self):
+        """
+        :return: palette.Palette built from PLTE and tRNS, None when there is no PLTE chunk
+        """
+        plte = self.get_chunks(b'PLTE')
+        if not plte:
+            if self.type_of_pixel == INDEXED_COLOR:
+                raise LookupError('Indexed-color image without a palette')
+            return None
+        transparency = self.get_chunks(b'tRNS')
+        return palette.Palette(plte[0].data, transparency[0].data if transparency else b'')
+
+    def get_image_data_size(self):
+        """
+        :return: length of the inflated image data implied by IHDR, filter type bytes included
+        """
+        channels, _, _ = self.get_scanline_layout()
+        return pixels.image_data_size(self.width, self.height, channels, self.bit_depth, self.interlace_method)
+
+    def get_image_data(self):
+        """
+        :return: the zlib stream of the image data, the IDAT payloads joined
+        """
+        idat = self.get_chunks(b'IDAT')
+        return idat[0].data if len(idat) == 1 else b''.join(chunk.data for chunk in idat)
+
+    def decode_region(self, y0, y1, index=None):
+        """
+        Decodes the rows y0 <= y < y1 only. The image data is inflated incrementally and decoding stops after row
+        y1 - 1, the rest of the IDAT data is never inflated. Rows of an interlaced image are spread over all seven
+        passes, such images are deinterlaced in full first.
+        :param index: region_index.RegionIndex of the picture; inflating then starts at the nearest checkpoint
+        instead of the start of the stream (the Adler-32 is not verified in that case)
+        :return: pixels.PixelBuffer of width x (y1 - y0) pixels
+        """
+        if not 0 <= y0 <= y1 <= self.height:
+            raise ValueError('Region is outside the image')
+        channels, _, bpp = self.get_scanline_layout()
+        if index is not None:
+            if not self.index_matches(index):
+                raise ValueError('Index does not match the image')
+            rows = region_index.iter_rows(self.get_image_data(), index, y0, y1, bpp) if y0 < y1 else ()
+        else:
+            rows = islice(self.iter_rows(y1), y0, None)
+        return pixels.PixelBuffer(b''.join(rows), self.width, y1 - y0, channels, self.bit_depth)
+
+    def build_index(self, span=region_index.SPAN):
+        """
+        Inflates the image data once, recording checkpoints for decode_region, see region_index.
+        :param span: inflated bytes between two checkpoints
+        :return: region_index.RegionIndex
+        """
+        _, stride, bpp = self.get_scanline_layout()
+        if self.interlace_method != 0:
+            raise LookupError('Interlaced images cannot be indexed')
+        return region_index.build(self.get_image_data(), self.get_chunks(b'IHDR')[0].data,
+                                  region_index.get_chunk_crcs(self.get_chunks(b'IDAT')), self.height, stride, bpp, span)
+
+    def index_matches(self, index):
+        """
+        :return: whether the index was built from this image data: same IHDR, IDAT lengths and IDAT CRCs
+        """
+        idat = self.get_chunks(b'IDAT')
+        return index.matches(sum(chunk.length for chunk in idat), self.get_chunks(b'IHDR')[0].data,
+                             region_index.get_chunk_crcs(idat))
+
+    def decode_scaled(self, factor):
+        """
+        Decodes the image shrunk by an integer factor. Rows are unfiltered one at a time and averaged into a single
+        row of sums (box filter), the full resolution image is never built. Palette indices cannot be averaged,
+        indexed-color images keep the top left pixel of every block.
+        :param factor: e.g. 4 for a quarter of the width and height
+        :return: pixels.PixelBuffer of ceil(width / factor) x ceil(height / factor) pixels
+        """
+        if factor < 1:
+            raise ValueError('Scale factor must be positive')
+        channels, _, _ = self.get_scanline_layout()
+        return pixels.downscale(self.iter_rows(), self.width, self.height, channels, self.bit_depth, factor,
+                                average=self.type_of_pixel != INDEXED_COLOR)
+
+    def iter_rows(self, height=None):
+        """
+        Inflates the loaded image data incrementally and unfilters it one scanline at a time.
+        :param height: stop after this many rows (default: all of them)
+        :return: generator of unfiltered scanlines, see pixels.PixelBuffer for their layout
+        """
+        pieces = self.iter_image_data()
+        return _iter_rows(self, pieces, height)
+
+    def iter_passes(self):
+        """
+        Decodes an interlaced image progressively, inflating the image data only as far as each pass needs.
+        :return: generator of (pass number from 1 to 7, pixels.PixelBuffer with a preview of the pixels known so far:
+        1/8 of the size in both directions after pass 1, 1/4 after pass 3, 1/2 after pass 5, full size after pass 7)
+        """
+        channels, _, _ = self.get_scanline_layout()
+        if self.interlace_method != 1:
+            raise LookupError('Image is not interlaced')
+        pieces = self.iter_image_data()
+        return pixels.iter_adam7_previews(pieces, self.width, self.height, channels, self.bit_depth)
+
+    def iter_image_data(self, idat=None):
+        """
+        :param idat: iterable of IDAT payloads (default: those of the picture)
+        :return: generator of inflated pieces, checked and measured according to the integrity policy and stats;
+        raises ValueError as soon as they exceed the size implied by IHDR
+        """
+        if idat is None:
+            idat = (chunk.data for chunk in self.get_chunks(b'IDAT'))
+        backend = backends.get_backend(self.inflate, stats=self.stats)
+        decompressor = backend.decompressobj(self.integrity != SKIP, self.checksum_times, self.stats)
+        return zlib_stream.iter_decompress(idat, decompressor=decompressor, max_length=self.get_image_data_size())
+
+    def get_scanline_layout(self):
+        """
+        Checks that the image data can be decoded.
+        :return: channels, length of a scanline in bytes and bytes per complete pixel
+        """
+        if self.compression_method != 0 or self.filter_method != 0:
+            raise LookupError('Unknown compression or filter method')
+        if self.interlace_method not in (0, 1):
+            raise LookupError('Unknown interlace method')
+
+        channels = pixels.CHANNELS[self.color_type]
+        return (channels, pixels.row_stride(self.width, channels, self.bit_depth),
+                pixels.bytes_per_pixel(channels, self.bit_depth))
+
+    def get_text(self):
+        """
+        :return: dictionary of the keywords and texts of the tEXt chunks (Latin-1)
+        """
+        text = {}
+        for chunk in self.get_chunks(b'tEXt'):
+            keyword, _, value = bytes(chunk.data).partition(b'\0')
+            text[keyword.decode('latin-1')] = value.decode('latin-1')
+        return text
+
+    def decode_array(self):
+        """
+        :return: numpy array of shape (height, width, channels), see pixels_numpy.unpack_samples
+        """
+        return self.decode_pixels(pixels.NUMPY).to_array()
+
     def get_type_of_pixel(self):
         bit_depth, color_type = self.bit_depth, self.color_type
 
@@ -146,6 +379,8 @@ class Picture:
 
 
 class Chunk:
+    __slots__ = ('name', 'length', 'data', 'crc')
+
     def __init__(self, name, length, data, crc):
         self.name = name
         self.length = length
@@ -160,16 +395,52 @@ class Chunk:
 
 
 class ExtendedChunk(Chunk):
-    def __init__(self, chunk, chunk_bits):
+    __slots__ = ('flags',)
+
+    def __init__(self, chunk, flags):
         super().__init__(chunk.name, chunk.length, chunk.data, chunk.crc)
-        self.ancillary_bit, self.private_bit, self.reserved_bit, self.safe_to_copy_bit, self.unknown = chunk_bits
+        self.flags = flags  # see Picture.identify_chunk
+
+    @property
+    def ancillary_bit(self):
+        return bool(self.flags & ANCILLARY)
+
+    @property
+    def private_bit(self):
+        return bool(self.flags & PRIVATE)
+
+    @property
+    def reserved_bit(self):
+        return bool(self.flags & RESERVED)
+
+    @property
+    def safe_to_copy_bit(self):
+        return bool(self.flags & SAFE_TO_COPY)
+
+    @property
+    def unknown(self):
+        return bool(self.flags & UNKNOWN)
 
 
 class Reader:
-    def __init__(self):
+    def __init__(self, integrity=STRICT, stats=None, inflate=backends.AUTO, limits=validation.DEFAULT_LIMITS):
+        """
+        :param integrity: STRICT, CRITICAL_ONLY or SKIP, see INTEGRITY_POLICIES
+        :param stats: deflate.Stats object recording every stage of reading and decoding, None to measure nothing
+        :param inflate: inflate backend of the pictures read, see Picture
+        :param limits: validation.Limits checked while the chunk headers are read, before any data is inflated
+        """
+        if integrity not in INTEGRITY_POLICIES:
+            raise LookupError('Unknown integrity policy')
         self.name = None
         self.file = None
         self.chunks = []
+        self.integrity = integrity
+        self.stats = stats
+        self.inflate = inflate
+        self.limits = limits
+        self.validator = validation.ChunkValidator(limits)
+        self.checksum_times = get_checksum_times(stats)  # shared with the pictures read
 
     def open(self, file):
         if os.path.isfile(file):
@@ -186,22 +457,47 @@ class Reader:
             raise ReferenceError('Nothing is opened')
 
     def read(self, n):
-        return self.file.read(n)
-
-    def read_next_chunk(self):
-        b_length = self.file.read(4)
+        if self.stats is None:
+            return self.file.read(n)
+        start = time.perf_counter()
+        data = self.file.read(n)
+        self.stats.add_time('chunk_io', time.perf_counter() - start)
+        self.stats.add('bytes_read', len(data))
+        return data
+
+    def read_chunk_header(self):
+        b_length = self.read(4)
         length = int(binascii.hexlify(b_length), 16)
         name = self.read(4)
+        self.validator.check_chunk(name, length)
+        return length, name
+
+    def skip_chunk(self, length):
+        self.file.seek(length + 4, io.SEEK_CUR)  # data and CRC
+
+    def read_next_chunk(self):
+        length, name = self.read_chunk_header()
+        return self.read_chunk_body(length, name)
+
+    def read_chunk_body(self, length, name):
         data = self.read(length)
         crc = self.read(4)
         chunk = Chunk(name, length, data, crc)
-        if not self.check_crc(chunk):
-            raise TypeError('File seems to be corrupted')
+        if self.stats is not None:
+            self.stats.add('chunks')
+        self.verify_chunk(chunk)
+        if name == b'IHDR':
+            self.validator.check_header(data)
         return chunk
 
+    def verify_chunk(self, chunk):
+        verify_chunk(chunk, self.integrity, self.checksum_times)
+
+    def should_check_crc(self, name):
+        return should_check_crc(self.integrity, name)
+
     def check_crc(self, chunk):
-        data = chunk.name + chunk.data
-        return binascii.crc32(data) == int(binascii.hexlify(chunk.crc), 16)
+        return check_crc(chunk)
 
     def is_png(self):
         if self.file:
@@ -218,6 +514,32 @@ class Reader:
         self.chunks.append(chunk)
 
     def get_picture(self):
+        self.read_signature()
+        self.read_all_chunks()
+
+        return Picture(self.name, self.chunks, self.integrity, self.checksum_times, self.stats, self.inflate)
+
+    def probe(self, collect=PROBE_CHUNKS):
+        """
+        Reads the header without loading the image data: chunks that are not collected are skipped using
+        their length fields, IDAT payloads are never read.
+        :param collect: names of the ancillary chunks to read, e.g. {b'tEXt', b'pHYs', b'tIME'}; with an empty
+        collection reading stops right after IHDR
+        :return: Picture with IHDR metadata and the collected chunks
+        """
+        self.read_signature()
+        chunks = [self.read_next_chunk()]  # IHDR must come first
+        if collect:
+            length, name = self.read_chunk_header()
+            while name != b'IEND':
+                if name in collect:
+                    chunks.append(self.read_chunk_body(length, name))
+                else:
+                    self.skip_chunk(length)
+                length, name = self.read_chunk_header()
+        return Picture(self.name, chunks, self.integrity, self.checksum_times, self.stats, self.inflate)
+
+    def read_signature(self):
         if not self.file:
             raise ReferenceError('Nothing is opened')
 
@@ -225,23 +547,166 @@ class Reader:
         if not self.is_png():
             raise TypeError('File seems to be corrupted')
         self.file.read(8)  # PNG signature
-        self.read_all_chunks()
+        self.validator = validation.ChunkValidator(self.limits)
+
+    def iter_chunks(self):
+        """
+        Reads the chunks one at a time without keeping them.
+        :return: generator of chunks up to and including IEND
+        """
+        chunk = self.read_next_chunk()
+        while chunk.name != b'IEND':
+            yield chunk
+            chunk = self.read_next_chunk()
+        yield chunk
+
+    def iter_rows(self):
+        """
+        Decodes the opened file one scanline at a time. IDAT chunks are read lazily and inflated incrementally,
+        so only the previous scanline and the inflater window are held in memory. Interlaced images are
+        deinterlaced in full before the first row is returned.
+        :return: generator of unfiltered scanlines, see pixels.PixelBuffer for their layout
+        """
+        picture, pieces = self.__stream_image_data()
+        return _iter_rows(picture, pieces)
+
+    def iter_passes(self):
+        """
+        Progressive decoding of an interlaced file, reading IDAT chunks only as far as each pass needs.
+        :return: generator of (pass number, preview), see Picture.iter_passes
+        """
+        picture, pieces = self.__stream_image_data()
+        channels, _, _ = picture.get_scanline_layout()
+        if picture.interlace_method != 1:
+            raise LookupError('Image is not interlaced')
+        return pixels.iter_adam7_previews(pieces, picture.width, picture.height, channels, picture.bit_depth)
+
+    def __stream_image_data(self):
+        self.read_signature()
+        chunks = self.iter_chunks()
+        picture = Picture(self.name, [next(chunks)], self.integrity, self.checksum_times, self.stats,
+                          self.inflate)  # IHDR first
+        return picture, picture.iter_image_data(chunk.data for chunk in chunks if chunk.name == b'IDAT')
+
+
+def get_checksum_times(stats):
+    """
+    :param stats: deflate.Stats object or None
+    :return: dictionary of the seconds spent on 'crc32' and 'adler32', the checksum stages of the stats when there are
+    stats
+    """
+    checksum_times = stats.times if stats is not None else {}
+    checksum_times.setdefault('crc32', 0.0)
+    checksum_times.setdefault('adler32', 0.0)
+    return checksum_times
+
+
+def verify_chunk(chunk, integrity, checksum_times):
+    """
+    Checks the CRC of a chunk when the integrity policy asks for it, raising TypeError on a mismatch.
+    :param checksum_times: dictionary collecting the seconds spent, see get_checksum_times
+    """
+    if should_check_crc(integrity, chunk.name):
+        start = time.perf_counter()
+        valid = check_crc(chunk)
+        checksum_times['crc32'] += time.perf_counter() - start
+        if not valid:
+            raise TypeError('File seems to be corrupted')
+
+
+def check_crc(chunk):
+    # The CRC covers the name and the data, continuing from the CRC of the name avoids joining them
+    return binascii.crc32(chunk.data, binascii.crc32(chunk.name)) == int.from_bytes(chunk.crc, 'big')
 
-        return Picture(self.name, self.chunks)
+
+def should_check_crc(integrity, name):
+    """
+    :param integrity: STRICT, CRITICAL_ONLY or SKIP
+    :return: whether the policy verifies the CRC of chunks of that type
+    """
+    if integrity == STRICT:
+        return True
+    return integrity == CRITICAL_ONLY and 65 <= name[0] <= 90  # uppercase first letter: critical
+
+
+def _iter_rows(picture, pieces, height=None):
+    channels, stride, bpp = picture.get_scanline_layout()
+    height = picture.height if height is None else height
+    if picture.interlace_method == 1:
+        image = pixels.deinterlace(pieces, picture.width, picture.height, channels, picture.bit_depth)
+        return (bytes(image.row(y)) for y in range(height))
+    return pixels.iter_unfiltered_rows(pieces, height, stride, bpp)
 
 
 def main():
     reader = Reader()
     pic = reader.open('pics/mario.png').get_picture()
-    data_chunks = []
-    for chunk in pic.chunks:
-        if chunk.name == b'IDAT':
-            data_chunks.append(chunk)
-
-    for chunk in data_chunks:
-        coded = binascii.hexlify(chunk.data)
-        decoded = Deflate.decode(coded)
-        print(decoded)
+    reader.close()
+    print(pic)
+    print(pic.decode_pixels())
+
+
+def test():
+    import zlib
+    import random
+    import struct
+    import tempfile
+    generator = random.Random(0)
+
+    def chunk(name, data):
+        return struct.pack('>I', len(data)) + name + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(name)))
+
+    def samples(image):
+        # One integer per sample, row by row
+        data = pixels.unpack_samples(image.data, image.width, image.height, image.channels, image.bit_depth)
+        if image.bit_depth == 16:
+            data = [int.from_bytes(data[start:start + 2], 'big') for start in range(0, len(data), 2)]
+        row_length = image.width * image.channels
+        return [list(data[start:start + row_length]) for start in range(0, len(data), row_length)]
+
+    def box(image, factor, average):
+        # Reference downscale: mean of every block rounded to nearest, or its top left pixel
+        rows, channels = samples(image), image.channels
+        result = []
+        for y in range(0, image.height, factor):
+            line = []
+            for x in range(0, image.width, factor):
+                block = [rows[v][u * channels:(u + 1) * channels] for v in range(y, min(y + factor, image.height))
+                         for u in range(x, min(x + factor, image.width))]
+                if average:
+                    line += [(sum(pixel[c] for pixel in block) + len(block) // 2) // len(block)
+                             for c in range(channels)]
+                else:
+                    line += block[0]
+            result.append(line)
+        return result
+
+    width, height = 13, 11
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.png')
+        for color_type, bit_depth in ((2, 8), (2, 16), (0, 4), (3, 2), (3, 8)):
+            channels = pixels.CHANNELS[color_type]
+            stride = pixels.row_stride(width, channels, bit_depth)
+            filtered = pixels.filter_scanlines(generator.randbytes(stride * height), height, stride,
+                                               pixels.bytes_per_pixel(channels, bit_depth))
+            header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+            plte = chunk(b'PLTE', generator.randbytes(3 << bit_depth)) if color_type == 3 else b''
+            with open(path, 'wb') as file:
+                file.write(bytes((137, 80, 78, 71, 13, 10, 26, 10)) + chunk(b'IHDR', header) + plte +
+                           chunk(b'IDAT', zlib.compress(filtered)) + chunk(b'IEND', b''))
+            reader = Reader().open(path)
+            try:
+                picture = reader.get_picture()
+            finally:
+                reader.close()
+            image = picture.decode_pixels()
+            for y0, y1 in ((0, height), (0, 1), (4, 9), (10, 11), (5, 5)):
+                region = picture.decode_region(y0, y1)
+                assert bytes(region.data) == bytes(image.data[y0 * stride:y1 * stride])
+            for factor in (1, 2, 3, 4, 20):
+                scaled = picture.decode_scaled(factor)
+                assert samples(scaled) == box(image, factor, color_type != 3)
+
 
 if __name__ == '__main__':
     main()
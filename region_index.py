@@ -0,0 +1,259 @@
+import os
+import struct
+import pixels
+from deflate import index
+
+SPAN = index.SPAN
+SIDECAR_SUFFIX = '.idx'
+MAGIC = b'PNGIDX2\n'
+# magic, zlib stream length, IHDR data, stride, height, entries, IDAT chunks; followed by the IDAT CRCs
+HEADER = struct.Struct('>8sQ13sIIII')
+CRC_SIZE = 4
+ENTRY = struct.Struct('>QQIIII')  # bit offset, output offset, row, window, pending and previous row lengths
+
+
+class IndexEntry:
+    """
+    A checkpoint of the inflater together with the unfiltering state at that point of the image data.
+    """
+    __slots__ = ('checkpoint', 'y', 'pending', 'previous')
+
+    def __init__(self, checkpoint, y, pending, previous):
+        self.checkpoint = checkpoint
+        self.y = y  # scanline the checkpoint falls into
+        self.pending = pending  # inflated bytes of that scanline before the checkpoint
+        self.previous = previous  # unfiltered scanline y - 1
+
+    def __str__(self):
+        return 'Row: {}, {}'.format(self.y, self.checkpoint)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class RegionIndex:
+    """
+    Checkpoints into the image data of a non-interlaced picture, so that a range of rows can be decoded without
+    inflating everything before it. Saved next to the PNG as a sidecar file.
+    """
+    def __init__(self, stream_length, header, stride, height, entries, chunk_crcs):
+        """
+        :param stream_length: length of the zlib stream (all IDAT payloads), to detect a stale index
+        :param header: IHDR data of the picture
+        :param chunk_crcs: CRCs of the IDAT chunks joined, see get_chunk_crcs; they change with the content even
+        when the length does not, e.g. for rewritten stored blocks
+        """
+        self.stream_length = stream_length
+        self.header = bytes(header)
+        self.chunk_crcs = bytes(chunk_crcs)
+        self.stride = stride
+        self.height = height
+        self.entries = entries
+
+    def __str__(self):
+        return 'Checkpoints: {}, Rows: {}, Stride: {}'.format(len(self.entries), self.height, self.stride)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def find(self, y):
+        """
+        :return: the last entry at or before the start of row y
+        """
+        low, high = 0, len(self.entries)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.entries[middle].y <= y:
+                low = middle
+            else:
+                high = middle
+        return self.entries[low]
+
+    def matches(self, stream_length, header, chunk_crcs):
+        return self.stream_length == stream_length and self.header == bytes(header) and \
+            self.chunk_crcs == bytes(chunk_crcs)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, self.stream_length, self.header, self.stride, self.height,
+                                   len(self.entries), len(self.chunk_crcs) // CRC_SIZE))
+            file.write(self.chunk_crcs)
+            for entry in self.entries:
+                checkpoint = entry.checkpoint
+                file.write(ENTRY.pack(checkpoint.bit_offset, checkpoint.output_offset, entry.y,
+                                      len(checkpoint.window), len(entry.pending), len(entry.previous)))
+                file.write(checkpoint.window)
+                file.write(entry.pending)
+                file.write(entry.previous)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise TypeError('Index file seems to be corrupted')
+        _, stream_length, header, stride, height, count, chunks = HEADER.unpack_from(data)
+        position = HEADER.size + chunks * CRC_SIZE
+        if position > len(data):
+            raise TypeError('Index file seems to be corrupted')
+        chunk_crcs = data[HEADER.size:position]
+        entries = []
+        for _ in range(count):
+            if position + ENTRY.size > len(data):
+                raise TypeError('Index file seems to be corrupted')
+            bit_offset, output_offset, y, window_length, pending_length, previous_length = \
+                ENTRY.unpack_from(data, position)
+            position += ENTRY.size
+            fields = []
+            for length in (window_length, pending_length, previous_length):
+                fields.append(data[position:position + length])
+                position += length
+            if position > len(data):
+                raise TypeError('Index file seems to be corrupted')
+            window, pending, previous = fields
+            entries.append(IndexEntry(index.Checkpoint(bit_offset, output_offset, window), y, pending, previous))
+        return cls(stream_length, header, stride, height, entries, chunk_crcs)
+
+
+def build(stream, header, chunk_crcs, height, stride, bpp, span=SPAN):
+    """
+    Inflates and unfilters the whole image data once, recording a checkpoint about every `span` inflated bytes.
+    :param stream: zlib stream of the image data
+    :param chunk_crcs: CRCs of the IDAT chunks the stream comes from, see get_chunk_crcs
+    :return: RegionIndex
+    """
+    assembler = pixels.RowAssembler(height, stride, bpp)
+    entries = []
+    for checkpoint, piece in index.iter_spans(memoryview(stream)[2:], span):
+        entries.append(IndexEntry(checkpoint, assembler.y, bytes(assembler.pending), assembler.previous))
+        assembler.feed(piece)
+    if assembler.y < height:
+        raise ValueError('Not enough image data')
+    return RegionIndex(len(stream), header, stride, height, entries, chunk_crcs)
+
+
+def iter_rows(stream, region_index, y0, y1, bpp):
+    """
+    Decodes rows y0 <= y < y1, inflating from the nearest checkpoint. The Adler-32 of the stream cannot be
+    verified this way.
+    :return: generator of unfiltered scanlines
+    """
+    entry = region_index.find(y0)
+    stride = region_index.stride
+    assembler = pixels.RowAssembler(y1, stride, bpp, entry.y, entry.previous, entry.pending)
+    span = min(index.SPAN, (y1 - entry.y) * (stride + 1))
+    y = entry.y
+    for _, piece in index.iter_spans(memoryview(stream)[2:], span, entry.checkpoint):
+        for row in assembler.feed(piece):
+            if y >= y0:
+                yield row
+            y += 1
+        if y >= y1:
+            return
+
+
+def open_index(path, picture, span=SPAN):
+    """
+    Loads the sidecar index of a PNG file, building and saving it first when it is missing or stale.
+    :param picture: reader.Picture read from the file
+    :return: RegionIndex
+    """
+    try:
+        region_index = load_sidecar(path)
+    except TypeError:
+        region_index = None
+    if region_index is None or not picture.index_matches(region_index):
+        region_index = picture.build_index(span)
+        region_index.save(sidecar_path(path))
+    return region_index
+
+
+def get_chunk_crcs(chunks):
+    """
+    :param chunks: the IDAT chunks of a picture
+    :return: their CRCs joined, the content part of cache.content_key
+    """
+    return b''.join(bytes(chunk.crc) for chunk in chunks)
+
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+
+def load_sidecar(path):
+    """
+    :return: RegionIndex saved next to the PNG file, None when there is none
+    """
+    if not os.path.isfile(sidecar_path(path)):
+        return None
+    return RegionIndex.load(sidecar_path(path))
+
+
+def test():
+    import zlib
+    import random
+    import tempfile
+    from reader import Reader
+    generator = random.Random(0)
+    width, height = 64, 200
+    stride = width * 3
+
+    def chunk(name, data):
+        return struct.pack('>I', len(data)) + name + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(name)))
+
+    def write_png(path, level):
+        data = generator.randbytes(height * stride).translate(bytes(range(0, 256, 16)) * 16)
+        filtered = pixels.filter_scanlines(data, height, stride, 3)
+        # A block boundary every 2000 bytes, so that there are several checkpoints
+        compressor = zlib.compressobj(level)
+        stream = b''.join(compressor.compress(filtered[start:start + 2000]) + compressor.flush(zlib.Z_FULL_FLUSH)
+                          for start in range(0, len(filtered), 2000)) + compressor.flush()
+        header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+        idat = b''.join(chunk(b'IDAT', stream[start:start + 5000]) for start in range(0, len(stream), 5000))
+        with open(path, 'wb') as file:
+            file.write(bytes((137, 80, 78, 71, 13, 10, 26, 10)) + chunk(b'IHDR', header) + idat + chunk(b'IEND', b''))
+
+    def read_picture(path):
+        reader = Reader().open(path)
+        try:
+            return reader.get_picture()
+        finally:
+            reader.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.png')
+        for level in (6, 0):
+            write_png(path, level)
+            picture = read_picture(path)
+            stream = memoryview(bytes(picture.get_image_data()))[2:]
+            spans = list(index.iter_spans(stream, 4096))
+            inflated = b''.join(piece for _, piece in spans)
+            assert len(spans) > 2
+            for checkpoint, _ in spans:
+                resumed = b''.join(piece for _, piece in index.iter_spans(stream, 4096, checkpoint))
+                assert resumed == inflated[checkpoint.output_offset:]
+
+            image = picture.decode_pixels()
+            region_index = open_index(path, picture, 4096)
+            loaded = load_sidecar(path)
+            assert len(loaded.entries) == len(region_index.entries) > 2 and picture.index_matches(loaded)
+            for y0, y1 in ((0, height), (0, 1), (57, 58), (90, 160), (199, 200)):
+                expected = bytes(image.data[y0 * stride:y1 * stride])
+                assert bytes(picture.decode_region(y0, y1, region_index).data) == expected
+                assert bytes(picture.decode_region(y0, y1, loaded).data) == expected
+
+        # Same IHDR and IDAT lengths with stored blocks, only the IDAT CRCs tell the new content apart
+        write_png(path, 0)
+        changed = read_picture(path)
+        assert loaded.stream_length == sum(chunk.length for chunk in changed.get_chunks(b'IDAT'))
+        assert not changed.index_matches(loaded)
+        try:
+            changed.decode_region(0, 1, loaded)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('Stale index accepted')
+        assert changed.index_matches(open_index(path, changed, 4096)) and changed.index_matches(load_sidecar(path))
+        with open(sidecar_path(path), 'r+b') as file:
+            file.write(b'garbage')
+        assert changed.index_matches(open_index(path, changed, 4096))
@@ -0,0 +1,35 @@
+"""
+Runs the test() function of every module that has assertion-based tests.
+
+    python tests.py
+"""
+import async_reader
+import cache
+import mapped_reader
+import palette
+import pixels
+import reader
+import region_index
+import validation
+import writer
+from deflate import backends, deflate, parallel, zlib_stream
+
+try:
+    import pixels_numpy
+except ImportError:
+    pixels_numpy = None  # optional, its test is skipped
+
+MODULES = (deflate, zlib_stream, parallel, backends, async_reader, cache, mapped_reader, palette, pixels, pixels_numpy,
+           reader, region_index, validation, writer)
+
+
+def main():
+    for module in MODULES:
+        if module is None:
+            continue
+        module.test()
+        print('{}: ok'.format(module.__name__))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Cheap validation run while the chunk headers are read, before any image data is inflated: the chunk ordering rules
+of the PNG specification and configurable limits against oversized images and decompression bombs.
+"""
+import pixels
+
+PNG_MAX_VALUE = 2 ** 31 - 1  # largest chunk length, width and height allowed by the specification
+
+# Image size, the amount of image data and the chunk lengths are not limited by default: multi-gigapixel scans and
+# large ICC profiles or metadata are legitimate, the inflated output is always capped at the size implied by IHDR, and
+# callers reading untrusted files tighten these through Limits
+MAX_PIXELS = None  # width * height
+MAX_IMAGE_DATA = None  # compressed bytes in all IDAT chunks
+MAX_CHUNK_LENGTH = None  # bytes of any chunk other than IDAT, PNG_MAX_VALUE is always enforced
+MAX_CHUNKS = 2 ** 16  # chunks other than IDAT, whose number grows with the image
+# Largest inflated / compressed size of the image data. Deflate cannot exceed about 1032:1, so the default only
+# rejects image data too short for the size IHDR gives, before trying to inflate it
+MAX_RATIO = 1100
+
+BEFORE_PLTE = {b'cHRM', b'gAMA', b'iCCP', b'sBIT', b'sRGB'}
+AFTER_PLTE = {b'bKGD', b'hIST', b'tRNS'}
+BEFORE_IDAT = BEFORE_PLTE | AFTER_PLTE | {b'PLTE', b'pHYs', b'sPLT'}
+SINGLE = {b'IHDR', b'PLTE', b'IEND', b'cHRM', b'gAMA', b'iCCP', b'sBIT', b'sRGB', b'bKGD', b'hIST', b'tRNS', b'pHYs',
+          b'tIME'}
+
+
+class Limits:
+    """
+    Resource limits of the readers, None disables a limit.
+    """
+    __slots__ = ('max_pixels', 'max_image_data', 'max_chunks', 'max_chunk_length', 'max_ratio')
+
+    def __init__(self, max_pixels=MAX_PIXELS, max_image_data=MAX_IMAGE_DATA, max_chunks=MAX_CHUNKS,
+                 max_chunk_length=MAX_CHUNK_LENGTH, max_ratio=MAX_RATIO):
+        """
+        :param max_pixels: largest width * height
+        :param max_image_data: largest sum of the IDAT lengths
+        :param max_chunks: largest number of chunks other than IDAT, IHDR and IEND included
+        :param max_chunk_length: largest length of a chunk other than IDAT
+        :param max_ratio: largest ratio of the inflated size implied by IHDR to the IDAT lengths
+        """
+        self.max_pixels = max_pixels
+        self.max_image_data = max_image_data
+        self.max_chunks = max_chunks
+        self.max_chunk_length = max_chunk_length
+        self.max_ratio = max_ratio
+
+
+DEFAULT_LIMITS = Limits()
+NO_LIMITS = Limits(None, None, None, None, None)
+
+
+class ChunkValidator:
+    """
+    Checks the chunks of one file as their headers arrive. Broken rules for critical chunks and exceeded limits raise
+    ValueError; ancillary chunks at a place the specification does not allow are reported, to be ignored as libpng
+    does.
+    """
+    def __init__(self, limits=DEFAULT_LIMITS):
+        self.limits = limits
+        self.count = 0
+        self.seen = set()
+        self.image_data = 0  # sum of the IDAT lengths
+        self.image_data_ended = False
+        self.inflated_size = None  # size of the image data implied by IHDR, see check_header
+
+    def check_chunk(self, name, length):
+        """
+        Called with every chunk header, before the chunk data is read.
+        :return: False when the chunk is a misplaced or repeated ancillary chunk
+        """
+        limits = self.limits
+        first = not self.seen
+        if name != b'IDAT':
+            self.count += 1
+            if limits.max_chunks is not None and self.count > limits.max_chunks:
+                raise ValueError('Too many chunks')
+        if length > PNG_MAX_VALUE:
+            raise ValueError('Invalid chunk length')
+        if first != (name == b'IHDR'):
+            raise ValueError('IHDR must be the first chunk and appear once')
+        if b'IEND' in self.seen:
+            raise ValueError('Chunk after IEND')
+
+        if name == b'IDAT':
+            if self.image_data_ended:
+                raise ValueError('IDAT chunks are not contiguous')
+            self.image_data += length
+            if limits.max_image_data is not None and self.image_data > limits.max_image_data:
+                raise ValueError('Image data exceeds the limit')
+        else:
+            if limits.max_chunk_length is not None and length > limits.max_chunk_length:
+                raise ValueError('Chunk exceeds the length limit')
+            if b'IDAT' in self.seen and not self.image_data_ended:
+                self.image_data_ended = True
+                self.check_ratio()
+        if name == b'PLTE' and (b'PLTE' in self.seen or b'IDAT' in self.seen):
+            raise ValueError('PLTE must appear once, before the image data')
+        if name == b'IEND' and b'IDAT' not in self.seen:
+            raise ValueError('No image data')
+
+        keep = not ((name in SINGLE and name in self.seen) or (name in BEFORE_IDAT and b'IDAT' in self.seen) or
+                    (name in BEFORE_PLTE and b'PLTE' in self.seen))
+        self.seen.add(name)
+        return keep
+
+    def check_header(self, data):
+        """
+        Called with the IHDR data: checks the dimensions and records the size the image data inflates to.
+        """
+        if len(data) < 13:
+            raise ValueError('Truncated IHDR chunk')
+        width, height = int.from_bytes(data[0:4], 'big'), int.from_bytes(data[4:8], 'big')
+        bit_depth, color_type, interlace_method = data[8], data[9], data[12]
+        if not 0 < width <= PNG_MAX_VALUE or not 0 < height <= PNG_MAX_VALUE:
+            raise ValueError('Invalid image dimensions')
+        if self.limits.max_pixels is not None and width * height > self.limits.max_pixels:
+            raise ValueError('Image exceeds the pixel limit')
+        if color_type in pixels.CHANNELS:
+            self.inflated_size = pixels.image_data_size(width, height, pixels.CHANNELS[color_type], bit_depth,
+                                                        interlace_method)
+
+    def check_ratio(self):
+        max_ratio = self.limits.max_ratio
+        if max_ratio is not None and self.inflated_size is not None and \
+                self.inflated_size > max_ratio * self.image_data:
+            raise ValueError('Image data too short for the image size')
+
+
+def check_chunk_order(chunks, limits=NO_LIMITS):
+    """
+    Validates a complete list of chunks, e.g. those of a Picture.
+    :param chunks: chunks in file order
+    :return: the chunks without the misplaced or repeated ancillary chunks
+    """
+    validator = ChunkValidator(limits)
+    kept = []
+    for chunk in chunks:
+        if validator.check_chunk(chunk.name, chunk.length):
+            kept.append(chunk)
+        if chunk.name == b'IHDR':
+            validator.check_header(chunk.data)
+    # Chunks that belong after PLTE are only known to be misplaced once PLTE shows up
+    names = [chunk.name for chunk in kept]
+    if b'PLTE' in names:
+        palette_position = names.index(b'PLTE')
+        kept = [chunk for position, chunk in enumerate(kept)
+                if position > palette_position or chunk.name not in AFTER_PLTE]
+    return kept
+
+
+def test():
+    import os
+    import zlib
+    import struct
+    import tempfile
+    from reader import Reader
+    from writer import SIGNATURE, make_chunk
+
+    def expect_error(function, message):
+        try:
+            function()
+        except ValueError as error:
+            assert message in str(error), str(error)
+        else:
+            raise AssertionError('Expected: ' + message)
+
+    def check(names):
+        validator = ChunkValidator()
+        for name in names:
+            validator.check_chunk(name, 0)
+
+    check([b'IHDR', b'PLTE', b'IDAT', b'IDAT', b'tEXt', b'IEND'])
+    ChunkValidator().check_chunk(b'IHDR', 0)
+    ChunkValidator().check_chunk(b'IHDR', PNG_MAX_VALUE)
+    expect_error(lambda: ChunkValidator().check_chunk(b'IHDR', PNG_MAX_VALUE + 1), 'Invalid chunk length')
+    expect_error(lambda: ChunkValidator(Limits(max_chunk_length=2 ** 23)).check_chunk(b'IHDR', 2 ** 23 + 1),
+                 'length limit')
+    expect_error(lambda: check([b'IHDR', b'IDAT', b'tEXt', b'IDAT', b'IEND']), 'not contiguous')
+    expect_error(lambda: check([b'IHDR', b'IDAT', b'PLTE', b'IEND']), 'PLTE must appear once')
+    expect_error(lambda: check([b'tEXt', b'IHDR', b'IDAT', b'IEND']), 'IHDR must be the first')
+    expect_error(lambda: check([b'IHDR', b'IHDR', b'IDAT', b'IEND']), 'IHDR must be the first')
+    expect_error(lambda: check([b'IHDR', b'IDAT', b'IEND', b'tEXt']), 'Chunk after IEND')
+    expect_error(lambda: check([b'IHDR', b'IEND']), 'No image data')
+
+    def read(width, height, image_data, how):
+        header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+        path = os.path.join(directory, 'test.png')
+        with open(path, 'wb') as file:
+            file.write(SIGNATURE + make_chunk(b'IHDR', header) + make_chunk(b'IDAT', zlib.compress(image_data, 9)) +
+                       make_chunk(b'IEND', b''))
+        reader = Reader().open(path)
+        try:
+            if how == 'rows':
+                return b''.join(bytes(row) for row in reader.iter_rows())
+            return bytes(reader.get_picture().decode_pixels().data)
+        finally:
+            reader.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for how in ('pixels', 'rows'):
+            assert read(8, 8, b'\0\1\2\3\4\5\6\7\x08' * 8, how) == b'\1\2\3\4\5\6\7\x08' * 8
+            # Decompression bomb: 10 MB of image data for an 8x8 image
+            expect_error(lambda: read(8, 8, bytes(10 ** 7), how), 'exceeds the expected size')
+            # 16 MB of image data implied by IHDR, from a few bytes of IDAT
+            expect_error(lambda: read(4000, 4000, bytes(100), how), 'too short')
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,269 @@
+"""
+PNG encoder, the counterpart of Reader and Picture. Rows are filtered and compressed in slices across a thread pool
+(zlib and NumPy release the GIL), pigz style: a single zlib stream where every slice is deflated on its own, primed
+with the end of the previous slice and closed with a sync flush, and the Adler-32 of the slices combined.
+The output depends on the preset only, not on the number of workers.
+"""
+import os
+import sys
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pixels
+from reader import Reader
+from deflate import zlib_stream
+
+SIGNATURE = bytes((137, 80, 78, 71, 13, 10, 26, 10))
+
+# Speed/size presets: zlib level, candidate filter types and bytes of filtered data per slice
+FAST = 'fast'
+DEFAULT = 'default'
+SMALL = 'small'
+PRESETS = {FAST: (1, (pixels.FILTER_SUB,), 2 ** 17),
+           DEFAULT: (6, pixels.ALL_FILTERS, 2 ** 17),
+           SMALL: (9, pixels.ALL_FILTERS, 2 ** 20)}
+
+COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}  # channels -> color type, indexed-color when there is a palette
+BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+INDEXED = 3
+RAW_WINDOW_BITS = -15
+WINDOW_SIZE = 2 ** 15  # bytes of the previous slice a slice is primed with
+ZLIB_HEADER_METHOD = 0x78  # deflate with a 32K window
+# Ancillary chunks copied by Writer.write_picture, all allowed anywhere before PLTE and IDAT
+KEPT_CHUNKS = (b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'sBIT', b'pHYs')
+
+
+class Writer:
+    def __init__(self, preset=DEFAULT, workers=None, backend=pixels.AUTO, level=None, filter_types=None):
+        """
+        :param preset: FAST, DEFAULT or SMALL, see PRESETS
+        :param workers: number of threads (default: number of CPUs), 1 encodes in the calling thread
+        :param backend: filtering backend, 'python', 'numpy' or 'auto', see pixels.filter_image
+        :param level: zlib compression level instead of the preset's
+        :param filter_types: candidate filter types instead of the preset's; indexed-color and sub-byte images are
+        never filtered, as recommended by the PNG specification
+        """
+        if preset not in PRESETS:
+            raise LookupError('Unknown preset')
+        preset_level, preset_filters, self.slice_size = PRESETS[preset]
+        self.level = preset_level if level is None else level
+        self.filter_types = tuple(preset_filters if filter_types is None else filter_types)
+        self.workers = workers
+        self.backend = backend
+
+    def iter_png(self, image, plte=None, trns=None, chunks=()):
+        """
+        :param image: pixels.PixelBuffer with the unfiltered rows
+        :param plte: palette (PLTE data), the image holds indices when given
+        :param trns: transparency (tRNS data)
+        :param chunks: (name, data) pairs of ancillary chunks written after IHDR, they must be valid before PLTE
+        :return: generator of the encoded file in pieces: the signature, then one chunk at a time
+        """
+        color_type = INDEXED if plte is not None else COLOR_TYPES.get(image.channels)
+        if color_type is None or image.bit_depth not in BIT_DEPTHS[color_type]:
+            raise ValueError('Unsupported combination of channels and bit depth')
+        if color_type == INDEXED and image.channels != 1:
+            raise ValueError('Indexed-color images have a single channel')
+        if image.width <= 0 or image.height <= 0:
+            raise ValueError('Empty image')
+        if len(image.data) < image.height * image.stride:
+            raise ValueError('Not enough image data')
+
+        yield SIGNATURE
+        yield make_chunk(b'IHDR', struct.pack('>IIBBBBB', image.width, image.height, image.bit_depth, color_type,
+                                              0, 0, 0))
+        for name, data in chunks:
+            yield make_chunk(name, data)
+        if plte is not None:
+            yield make_chunk(b'PLTE', plte)
+        if trns is not None:
+            yield make_chunk(b'tRNS', trns)
+        filter_types = self.filter_types
+        if color_type == INDEXED or image.bit_depth < 8:
+            filter_types = (pixels.FILTER_NONE,)
+        for data in self.iter_image_data(image, filter_types):
+            yield make_chunk(b'IDAT', data)
+        yield make_chunk(b'IEND', b'')
+
+    def encode(self, image, plte=None, trns=None, chunks=()):
+        """
+        :return: bytes of the PNG file, see iter_png
+        """
+        return b''.join(self.iter_png(image, plte, trns, chunks))
+
+    def write(self, file, image, plte=None, trns=None, chunks=()):
+        """
+        :param file: path of the PNG file to create, see iter_png for the other parameters
+        """
+        with open(file, 'wb') as output:
+            for piece in self.iter_png(image, plte, trns, chunks):
+                output.write(piece)
+
+    def write_picture(self, picture, file, backend=pixels.AUTO):
+        """
+        Re-encodes a picture read by Reader, e.g. to recompress it or to drop its interlacing.
+        Palette, transparency and the color space chunks (KEPT_CHUNKS) are kept.
+        :param picture: reader.Picture
+        :param file: path of the PNG file to create
+        :param backend: unfiltering backend, see Picture.decode_pixels
+        """
+        image = picture.decode_pixels(backend)
+        plte, trns = picture.get_chunks(b'PLTE'), picture.get_chunks(b'tRNS')
+        chunks = [(chunk.name, chunk.data) for chunk in picture.chunks if chunk.name in KEPT_CHUNKS]
+        if picture.color_type != INDEXED:
+            plte = None  # a suggested palette of a truecolor image would make the output indexed
+        self.write(file, image, plte[0].data if plte else None, trns[0].data if trns else None, chunks)
+
+    def iter_image_data(self, image, filter_types):
+        """
+        Filters and compresses the rows slice by slice, yielding every compressed slice as soon as it and the ones
+        before it are done. About twice as many slices as workers are held in memory at once.
+        :return: generator of the pieces of the zlib stream, one per slice
+        """
+        slice_rows = max(1, self.slice_size // (image.stride + 1))
+        starts = range(0, image.height, slice_rows)
+        data = memoryview(image.data)
+
+        def filter_slice(y):
+            height = min(slice_rows, image.height - y)
+            previous = data[(y - 1) * image.stride:y * image.stride] if y else None
+            return pixels.filter_image(data[y * image.stride:(y + height) * image.stride], height, image.stride,
+                                       image.bytes_per_pixel, filter_types, previous, self.backend)
+
+        def compress_slice(filtered, dictionary, last):
+            return compress_slice_data(filtered, dictionary, last, self.level)
+
+        if self.workers == 1:
+            submit = _call
+            executor = None
+            pending = 1
+        else:
+            workers = self.workers or os.cpu_count()
+            executor = ThreadPoolExecutor(workers)
+            submit = executor.submit
+            pending = 2 * workers
+        try:
+            # Filtering runs ahead in the pool; a slice is compressed once the one before it is filtered, and the
+            # oldest slice is yielded while at most `pending` later ones are being filtered and compressed
+            filtering = deque(submit(filter_slice, y) for y in starts[:pending])
+            compressing = deque()
+            dictionary = None
+            checksum = 1
+            last = len(starts) - 1
+            yielded = 0
+            for index in range(len(starts)):
+                filtered = bytes(filtering.popleft().result())
+                if index + pending < len(starts):
+                    filtering.append(submit(filter_slice, starts[index + pending]))
+                compressing.append(submit(compress_slice, filtered, dictionary, index == last))
+                dictionary = filtered[-WINDOW_SIZE:]
+                while len(compressing) > pending or (index == last and compressing):
+                    output, adler, length = compressing.popleft().result()
+                    checksum = zlib_stream.adler32_combine(checksum, adler, length)
+                    if yielded == 0:
+                        output = zlib_header(self.level) + output
+                    if yielded == last:
+                        output += struct.pack('>I', checksum)
+                    yielded += 1
+                    yield output
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+def compress_slice_data(filtered, dictionary, last, level):
+    """
+    Deflates one slice of filtered image data as part of a single stream.
+    :param dictionary: end of the previous slice, None for the first one
+    :param last: whether the slice ends the stream; the others end with a sync flush, on a byte boundary
+    :return: raw deflate data, Adler-32 and length of the slice
+    """
+    if dictionary is None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, RAW_WINDOW_BITS)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, RAW_WINDOW_BITS, zdict=dictionary)
+    output = compressor.compress(filtered) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return output, zlib.adler32(filtered), len(filtered)
+
+
+def zlib_header(level):
+    """
+    :return: the two header bytes of a zlib stream compressed at that level
+    """
+    level_code = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    flags = level_code << 6
+    flags += 31 - ((ZLIB_HEADER_METHOD << 8) | flags) % 31
+    return bytes((ZLIB_HEADER_METHOD, flags))
+
+
+def make_chunk(name, data):
+    """
+    :return: length, type, data and CRC of a chunk
+    """
+    crc = zlib.crc32(data, zlib.crc32(name))
+    return struct.pack('>I', len(data)) + name + bytes(data) + struct.pack('>I', crc)
+
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+def _call(function, *arguments):
+    # executor.submit in the calling thread
+    return _Result(function(*arguments))
+
+
+def main():
+    """
+    Re-encodes a PNG file with every preset and checks that the reader gets the same pixels back.
+    """
+    source = sys.argv[1] if len(sys.argv) > 1 else 'pics/mario.png'
+    reader = Reader()
+    picture = reader.open(source).get_picture()
+    reader.close()
+    expected = bytes(picture.decode_pixels().data)
+    for preset in PRESETS:
+        target = '{}.{}.png'.format(os.path.splitext(source)[0], preset)
+        Writer(preset).write_picture(picture, target)
+        reader = Reader()
+        copy = reader.open(target).get_picture()
+        reader.close()
+        same = bytes(copy.decode_pixels().data) == expected
+        print('{}: {} bytes, {}'.format(target, os.path.getsize(target), 'identical' if same else 'DIFFERENT'))
+
+
+def test():
+    import random
+    import tempfile
+    generator = random.Random(0)
+    width, height = 37, 23
+    cases = [(channels, bit_depth, None) for channels, color_type in COLOR_TYPES.items()
+             for bit_depth in BIT_DEPTHS[color_type]]
+    cases += [(1, bit_depth, bytes(value % 256 for value in range(3 << bit_depth))) for bit_depth in BIT_DEPTHS[INDEXED]]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.png')
+        for channels, bit_depth, plte in cases:
+            stride = pixels.row_stride(width, channels, bit_depth)
+            image = pixels.PixelBuffer(generator.randbytes(stride * height), width, height, channels, bit_depth)
+            for preset in PRESETS:
+                encoded = []
+                for workers in (1, 3):
+                    writer = Writer(preset, workers)
+                    writer.slice_size = 4 * stride  # several slices even for a small image
+                    encoded.append(writer.encode(image, plte))
+                assert encoded[0] == encoded[1]
+                with open(path, 'wb') as file:
+                    file.write(encoded[0])
+                reader = Reader().open(path)
+                try:
+                    assert bytes(reader.get_picture().decode_pixels().data) == image.data
+                finally:
+                    reader.close()
+
+
+if __name__ == '__main__':
+    main()